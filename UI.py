@@ -1,3 +1,4 @@
+import os
 import sys
 import cv2
 import numpy as np
@@ -5,10 +6,10 @@ from PyQt6.QtWidgets import (
     QApplication, QLabel, QWidget, QPushButton, QVBoxLayout, QLineEdit,
     QFileDialog, QStackedWidget, QHBoxLayout, QFrame, QListWidget,
     QListWidgetItem, QMessageBox, QTableWidget, QTableWidgetItem,
-    QHeaderView, QComboBox, QDateEdit
+    QHeaderView, QComboBox, QDateEdit, QCheckBox
 )
-from PyQt6.QtCore import QDate
-from PyQt6.QtGui import QImage, QPixmap, QFont
+from PyQt6.QtCore import QDate, QTimer
+from PyQt6.QtGui import QImage, QPixmap, QFont, QKeySequence, QShortcut
 from PyQt6.QtCore import Qt
 
 from detector import FaceDetector
@@ -16,6 +17,13 @@ from aligner import FaceAligner
 from extractor import FeatureExtractor
 from matcher import FaceMatcher
 from database import FaceDatabase
+from stream import FrameGrabber
+from pipeline import RecognitionPipeline, draw_results
+from worker import InferenceEngine, ModelLoader
+from tracker import FaceTracker
+from attendance import AttendanceWriter
+import metrics
+import runtime
 
 
 # ============================
@@ -70,17 +78,31 @@ def show_qimage(label: QLabel, img):
     label.setPixmap(scaled_pixmap)
 
 
+def read_image(path):
+    """
+    读取图片文件，失败时返回 None
+    cv2.imread 在 Windows 上无法打开中文路径，先读成字节再解码
+    """
+    try:
+        return cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+    except Exception as e:
+        print(f"读取图片失败: {e}", file=sys.stderr)
+        return None
+
+
 # ============================
 # 注册页面
 # ============================
 class RegisterPage(QWidget):
-    def __init__(self, db, detector, aligner, extractor):
+    def __init__(self, pipeline, engine):
         super().__init__()
-        self.db = db
-        self.detector = detector
-        self.aligner = aligner
-        self.extractor = extractor
+        self.pipeline = pipeline
+        self.engine = engine
         self.current_img = None
+        self.pending_task = None
+        self.engine.task_finished.connect(self.on_task_finished)
+        self.engine.task_failed.connect(self.on_task_failed)
+        self.engine.task_dropped.connect(self.on_task_dropped)
 
         # 标题
         title = QLabel("注册人脸")
@@ -101,6 +123,9 @@ class RegisterPage(QWidget):
         self.name_input.setFixedHeight(40)
         self.name_input.setStyleSheet("font-size:16px; padding:5px;")
 
+        # 多模板注册：同一人在不同光照/角度下追加注册照
+        self.append_check = QCheckBox("追加为已注册人员的新模板")
+
         # 选择图片按钮
         self.btn_select = QPushButton("选择图片")
         self.btn_select.clicked.connect(self.select_image)
@@ -118,18 +143,26 @@ class RegisterPage(QWidget):
         # 图片标签水平居中
         layout.addWidget(self.image_label, alignment=Qt.AlignmentFlag.AlignHCenter)
         layout.addWidget(self.name_input)
+        layout.addWidget(self.append_check)
         layout.addWidget(self.btn_select)
         layout.addWidget(self.btn_register)
         layout.setAlignment(Qt.AlignmentFlag.AlignTop)
 
         self.setLayout(layout)
 
+    def set_ready(self, ready):
+        """模型加载完成前禁用注册"""
+        self.btn_register.setEnabled(ready and self.pending_task is None)
+
     # 选择图片
     def select_image(self):
         file, _ = QFileDialog.getOpenFileName(self, "选择图片", "", "Images (*.jpg *.png *.jpeg)")
         if not file:
             return
-        img = cv2.imread(file)
+        img = read_image(file)
+        if img is None:
+            QMessageBox.warning(self, "错误", f"无法读取图片：{file}")
+            return
         self.current_img = img
         show_qimage(self.image_label, img)
 
@@ -143,60 +176,55 @@ class RegisterPage(QWidget):
             print("请输入姓名")
             return
 
-        try:
-            boxes, kps = self.detector.detect(self.current_img)
-            if len(boxes) == 0:
-                print("没有检测到人脸")
-                return
+        if self.pending_task is not None:
+            print("正在注册，请稍候")
+            return
 
-            kp = kps[0] if kps is not None and len(kps) > 0 else None
-            aligned = self.aligner.align(self.current_img, keypoints=kp, box=boxes[0])
-            feature = self.extractor.extract(aligned)
-            
-            if feature is None:
-                print("特征提取失败")
-                return
+        # 检测/特征提取/数据库操作在后台线程执行，不阻塞界面
+        self.pending_task = self.engine.submit(self.pipeline.register, self.current_img.copy(), name,
+                                               append_template=self.append_check.isChecked())
+        if self.pending_task is None:
+            print("系统繁忙，请稍后再试")
+            return
+        self.btn_register.setEnabled(False)
 
-            # 检查是否已存在相同名字
-            if self.db.check_name_exists(name):
-                print(f"警告：名字 '{name}' 已存在！")
-                print(f"如需更新，请使用不同的名字或修改数据库记录")
-                return
+    def on_task_finished(self, task_id, result):
+        if task_id != self.pending_task:
+            return
+        self.pending_task = None
+        self.btn_register.setEnabled(True)
+        success, message = result
+        print(message)
 
-            # 检查是否已存在相同人脸（通过特征相似度）
-            exists, matched_name, similarity = self.db.find_similar_face(feature, threshold=0.85)
-            if exists:
-                print(f"警告：检测到与已注册人员 '{matched_name}' 非常相似的人脸（相似度：{similarity:.3f}）")
-                print(f"请确认这是否是同一个人，如果是，请使用名字 '{matched_name}' 或更新该记录")
-                return
+    def on_task_failed(self, task_id, error):
+        if task_id != self.pending_task:
+            return
+        self.pending_task = None
+        self.btn_register.setEnabled(True)
+        print(f"注册失败: {error}")
 
-            # 添加新记录
-            result = self.db.add(name, feature)
-            if result == "inserted":
-                print(f"注册成功：{name}")
-            else:
-                print(f"更新成功：{name}")
-                
-        except ValueError as e:
-            print(f"注册失败: {e}")
-        except Exception as e:
-            print(f"注册失败: {e}")
-            import traceback
-            traceback.print_exc()
+    def on_task_dropped(self, task_id):
+        # 队列已满时可能被实时识别的新帧挤掉
+        if task_id != self.pending_task:
+            return
+        self.pending_task = None
+        self.btn_register.setEnabled(True)
+        print("系统繁忙，注册任务已被取消，请重试")
 
 
 # ============================
 # 检测页面
 # ============================
 class DetectPage(QWidget):
-    def __init__(self, db, detector, aligner, extractor, matcher):
+    def __init__(self, pipeline, engine):
         super().__init__()
-        self.db = db
-        self.detector = detector
-        self.aligner = aligner
-        self.extractor = extractor
-        self.matcher = matcher
+        self.pipeline = pipeline
+        self.engine = engine
         self.current_img = None
+        self.pending_task = None
+        self.engine.task_finished.connect(self.on_task_finished)
+        self.engine.task_failed.connect(self.on_task_failed)
+        self.engine.task_dropped.connect(self.on_task_dropped)
 
         title = QLabel("人脸检测")
         title.setFont(QFont("Microsoft YaHei", 18, QFont.Weight.Bold))
@@ -213,60 +241,121 @@ class DetectPage(QWidget):
         self.btn_select.clicked.connect(self.select_image)
         self.btn_select.setFixedHeight(40)
 
+        # 实时识别：摄像头编号 / 视频文件 / RTSP 地址
+        self.source_input = QLineEdit()
+        self.source_input.setPlaceholderText("摄像头编号(如 0) / 视频文件路径 / RTSP 地址")
+        self.source_input.setFixedHeight(40)
+        self.source_input.setStyleSheet("font-size:14px; padding:5px;")
+
+        self.btn_stream = QPushButton("开始实时识别")
+        self.btn_stream.clicked.connect(self.toggle_stream)
+        self.btn_stream.setFixedHeight(40)
+
+        self.grabber = None
+        self.tracker = None
+        self.stream_timer = QTimer(self)
+        self.stream_timer.setInterval(15)
+        self.stream_timer.timeout.connect(self.on_stream_tick)
+
+        stream_layout = QHBoxLayout()
+        stream_layout.addWidget(self.source_input)
+        stream_layout.addWidget(self.btn_stream)
+
         layout = QVBoxLayout()
         layout.addWidget(title)
         # 图片标签水平居中
         layout.addWidget(self.image_label, alignment=Qt.AlignmentFlag.AlignHCenter)
         layout.addWidget(self.btn_select)
+        layout.addLayout(stream_layout)
         layout.setAlignment(Qt.AlignmentFlag.AlignTop)
 
         self.setLayout(layout)
 
+    def set_ready(self, ready):
+        """模型加载完成前禁用识别"""
+        self.btn_select.setEnabled(ready)
+        self.btn_stream.setEnabled(ready)
+
     def select_image(self):
         file, _ = QFileDialog.getOpenFileName(self, "选择图片", "", "Images (*.jpg *.png)")
         if not file:
             return
-        img = cv2.imread(file)
+        img = read_image(file)
+        if img is None:
+            QMessageBox.warning(self, "错误", f"无法读取图片：{file}")
+            return
+        self.stop_stream()
         self.current_img = img
         self.process(img)
 
-    def process(self, img):
+    def toggle_stream(self):
+        if self.grabber is not None:
+            self.stop_stream()
+            return
+        source = self.source_input.text().strip() or "0"
         try:
-            frame = img.copy()
-            boxes, kps = self.detector.detect(frame)
-
-            db = self.db.get_database()
-            for i, box in enumerate(boxes):
-                try:
-                    kp = kps[i] if kps is not None and i < len(kps) else None
-                    aligned = self.aligner.align(frame, keypoints=kp, box=box)
-                    fea = self.extractor.extract(aligned)
-                    if fea is None:
-                        continue
-                    name, sim = self.matcher.match(fea, db)
-
-                    x1, y1, x2, y2 = box.astype(int)
-                    color = (0, 255, 0) if name != "Unknown" else (0, 0, 255)
-                    cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-                    cv2.putText(frame, f"{name} ({sim:.2f})", (x1, y1 - 8),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
-                    
-                    # 如果识别成功，记录考勤
-                    if name != "Unknown":
-                        success, message = self.db.add_attendance(name)
-                        if success:
-                            print(message)
-                        else:
-                            print(f"考勤记录: {message}")
-                except Exception as e:
-                    print(f"处理第 {i+1} 个人脸时出错: {e}")
-                    continue
-
-            show_qimage(self.image_label, frame)
+            self.grabber = FrameGrabber(source).start()
         except Exception as e:
-            print(f"图片处理失败: {e}")
-            import traceback
-            traceback.print_exc()
+            QMessageBox.warning(self, "错误", f"打开视频源失败：{str(e)}")
+            self.grabber = None
+            return
+        # 视频流使用跟踪器，已识别的人脸不再逐帧提取特征
+        self.tracker = FaceTracker()
+        self.btn_stream.setText("停止实时识别")
+        self.btn_select.setEnabled(False)
+        self.stream_timer.start()
+        print(f"开始实时识别: {source}")
+
+    def stop_stream(self):
+        if self.grabber is None:
+            return
+        self.stream_timer.stop()
+        grabber = self.grabber
+        self.grabber = None
+        self.engine.cancel(self.pending_task)
+        self.pending_task = None
+        grabber.stop()
+        self.btn_stream.setText("开始实时识别")
+        self.btn_select.setEnabled(True)
+        print(f"实时识别已停止，丢弃过期帧 {grabber.dropped} 帧")
+
+    def on_stream_tick(self):
+        """定时取最新帧识别；处理期间到达的旧帧已由 FrameGrabber 丢弃"""
+        # 上一帧还在识别时不取新帧，保证同一时间最多只有一帧在处理
+        if self.pending_task is not None:
+            return
+        frame = self.grabber.read()
+        if frame is None:
+            if self.grabber.finished:
+                self.stop_stream()
+            return
+        self.current_img = frame
+        self.process(frame, tracker=self.tracker)
+
+    def process(self, img, tracker=None):
+        """提交到后台线程识别，结果在 on_task_finished 中显示"""
+        if self.pending_task is not None:
+            # 单张图片模式下新图片优先，丢弃还未完成的旧任务
+            self.engine.cancel(self.pending_task)
+        frame = img.copy()
+        self.pending_task = self.engine.submit(self.pipeline.recognize, frame, tracker=tracker, drop_oldest=True)
+
+    def on_task_finished(self, task_id, results):
+        if task_id != self.pending_task:
+            return
+        self.pending_task = None
+        frame = draw_results(self.current_img.copy(), results)
+        show_qimage(self.image_label, frame)
+
+    def on_task_failed(self, task_id, error):
+        if task_id != self.pending_task:
+            return
+        self.pending_task = None
+        print(f"图片处理失败: {error}")
+
+    def on_task_dropped(self, task_id):
+        if task_id == self.pending_task:
+            self.pending_task = None
 
 
 # ============================
@@ -714,16 +803,18 @@ class MainWindow(QWidget):
         self.setWindowTitle("人脸识别系统")
         self.resize(850, 650)
 
-        # load models (添加错误处理)
-        try:
-            print("正在加载人脸检测模型...")
-            self.detector = FaceDetector()
-            print("人脸检测模型加载成功")
-        except Exception as e:
-            print(f"人脸检测模型加载失败: {e}")
-            print("请确保 yolov8x-face-lindevs.pt 文件存在")
-            raise
-        
+        # 模型在后台线程池中并行加载，窗口立即显示；删除管理和考勤记录页面不依赖模型，可以直接使用
+        self.detector = None
+        self.extractor = None
+        self.loader = ModelLoader()
+        self.loader.loaded.connect(self.on_model_loaded)
+        self.loader.failed.connect(self.on_model_failed)
+        print("正在后台加载人脸检测模型和特征提取模型...")
+        # 大图先缩小到长边 1280 再检测，对齐仍使用原图
+        self.loader.load("detector", lambda: FaceDetector(max_side=1280))
+        # 只加载 buffalo_l 中的识别模型
+        self.loader.load("extractor", FeatureExtractor)
+
         try:
             self.aligner = FaceAligner()
             print("人脸对齐器初始化成功")
@@ -731,15 +822,6 @@ class MainWindow(QWidget):
             print(f"人脸对齐器初始化失败: {e}")
             raise
 
-        try:
-            print("正在加载特征提取模型...")
-            self.extractor = FeatureExtractor()
-            print("特征提取模型加载成功")
-        except Exception as e:
-            print(f"特征提取模型加载失败: {e}")
-            print("请确保已安装 insightface 库和相关模型")
-            raise
-
         try:
             self.matcher = FaceMatcher()
             print("人脸匹配器初始化成功")
@@ -754,12 +836,30 @@ class MainWindow(QWidget):
         except Exception as e:
             print(f"数据库连接失败: {e}")
             print("请确保 MySQL 服务正在运行，且数据库和表已创建")
+            self.loader.shutdown()
             raise
 
+        # 考勤在内存中去重后由后台线程批量写入
+        self.attendance_writer = AttendanceWriter(self.db).start()
+        # 检测器和特征提取器加载完成后再填入流水线
+        self.pipeline = RecognitionPipeline(self.detector, self.aligner, self.extractor, self.matcher, self.db,
+                                            attendance_sink=self.attendance_writer)
+        # 后台推理引擎：检测/识别/数据库操作都在工作线程中执行
+        self.engine = InferenceEngine()
+
+        # 性能指标：Ctrl+M 在控制台打印；设置环境变量 FACE_METRICS_PORT 时开放 /metrics 端点
+        QShortcut(QKeySequence("Ctrl+M"), self, activated=metrics.dump)
+        self.metrics_server = None
+        if os.environ.get("FACE_METRICS_PORT"):
+            try:
+                self.metrics_server = metrics.serve(int(os.environ["FACE_METRICS_PORT"]))
+            except Exception as e:
+                print(f"指标端点启动失败: {e}")
+
         # 页面切换
         self.stack = QStackedWidget()
-        self.register_page = RegisterPage(self.db, self.detector, self.aligner, self.extractor)
-        self.detect_page = DetectPage(self.db, self.detector, self.aligner, self.extractor, self.matcher)
+        self.register_page = RegisterPage(self.pipeline, self.engine)
+        self.detect_page = DetectPage(self.pipeline, self.engine)
         self.delete_page = DeletePage(self.db)
         self.attendance_page = AttendancePage(self.db)
 
@@ -767,6 +867,12 @@ class MainWindow(QWidget):
         self.stack.addWidget(self.detect_page)
         self.stack.addWidget(self.delete_page)
         self.stack.addWidget(self.attendance_page)
+        self.register_page.set_ready(False)
+        self.detect_page.set_ready(False)
+
+        # 模型加载状态
+        self.status_label = QLabel("正在加载模型，注册和检测功能稍后可用...")
+        self.status_label.setStyleSheet("color:#808080;")
 
         # 按钮
         btn_reg = QPushButton("注册人脸")
@@ -794,9 +900,39 @@ class MainWindow(QWidget):
         layout = QVBoxLayout()
         layout.addWidget(self.stack)
         layout.addLayout(btn_layout)
+        layout.addWidget(self.status_label)
 
         self.setLayout(layout)
 
+    def on_model_loaded(self, name, model):
+        setattr(self, name, model)
+        setattr(self.pipeline, name, model)
+        print("人脸检测模型加载成功" if name == "detector" else "特征提取模型加载成功")
+        if self.pipeline.is_ready():
+            self.register_page.set_ready(True)
+            self.detect_page.set_ready(True)
+            self.status_label.setText("模型加载完成")
+
+    def on_model_failed(self, name, error):
+        if name == "detector":
+            print(f"人脸检测模型加载失败: {error}")
+            print("请确保 yolov8x-face-lindevs.pt 文件存在")
+            self.status_label.setText(f"人脸检测模型加载失败：{error}")
+        else:
+            print(f"特征提取模型加载失败: {error}")
+            print("请确保已安装 insightface 库和相关模型")
+            self.status_label.setText(f"特征提取模型加载失败：{error}")
+        self.status_label.setStyleSheet("color:red;")
+
+    def closeEvent(self, event):
+        self.loader.shutdown()
+        self.detect_page.stop_stream()
+        self.engine.stop()
+        self.attendance_writer.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+        super().closeEvent(event)
+
     def switch_to_delete_page(self):
         """切换到删除页面并刷新列表"""
         self.stack.setCurrentIndex(2)
@@ -812,6 +948,8 @@ class MainWindow(QWidget):
 # 入口
 if __name__ == "__main__":
     try:
+        # 推理线程数等从环境变量读取，见 runtime.RuntimeConfig.from_env
+        runtime.configure(runtime.RuntimeConfig.from_env())
         app = QApplication(sys.argv)
         w = MainWindow()
         w.show()
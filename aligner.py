@@ -1,5 +1,39 @@
 from insightface.utils import face_align
 import cv2
+import numpy as np
+
+
+def estimate_transforms(keypoints, image_size=112):
+    """
+    一次求出所有人脸到 ArcFace 标准关键点的相似变换（旋转+等比缩放+平移）
+    keypoints: [N, 5, 2]
+    输出: [N, 2, 3] 仿射矩阵，与 face_align.estimate_norm 的结果相同
+    """
+    if image_size % 112 == 0:
+        ratio, diff_x = image_size / 112.0, 0.0
+    else:
+        ratio = image_size / 128.0
+        diff_x = 8.0 * ratio
+    dst = face_align.arcface_dst.astype(np.float64) * ratio
+    dst[:, 0] += diff_x
+
+    src = np.asarray(keypoints, dtype=np.float64).reshape(-1, 5, 2)
+    src_mean = src.mean(axis=1)                                   # [N, 2]
+    dst_mean = dst.mean(axis=0)                                   # [2]
+    sx, sy = (src - src_mean[:, None, :]).transpose(2, 0, 1)      # [N, 5]
+    dx, dy = (dst - dst_mean).T                                   # [5]
+    # 最小二乘闭式解: x' = a*x - b*y + tx, y' = b*x + a*y + ty
+    denom = np.maximum((sx * sx + sy * sy).sum(axis=1), 1e-12)
+    a = (sx * dx + sy * dy).sum(axis=1) / denom
+    b = (sx * dy - sy * dx).sum(axis=1) / denom
+    tx = dst_mean[0] - a * src_mean[:, 0] + b * src_mean[:, 1]
+    ty = dst_mean[1] - b * src_mean[:, 0] - a * src_mean[:, 1]
+
+    M = np.empty((len(src), 2, 3), dtype=np.float64)
+    M[:, 0, 0], M[:, 0, 1], M[:, 0, 2] = a, -b, tx
+    M[:, 1, 0], M[:, 1, 1], M[:, 1, 2] = b, a, ty
+    return M
+
 
 class FaceAligner:
     def __init__(self, input_size=112):
@@ -18,3 +52,20 @@ class FaceAligner:
         else:
             raise ValueError("必须提供 keypoints 或 box")
         return aligned
+
+    def align_batch(self, image, keypoints, out=None):
+        """
+        批量对齐同一张图像中的多个人脸
+        keypoints: [N, 5, 2] 关键点
+        out: 可选的预分配缓冲区 [>=N, size, size, 3]，重复使用可避免每帧分配内存
+        输出: [N, size, size, 3] 对齐后的人脸，可直接传给 FeatureExtractor.extract_batch
+        """
+        size = self.input_size
+        M = estimate_transforms(keypoints, size)
+        n = len(M)
+        if out is None or len(out) < n or out.shape[1:] != (size, size, image.shape[2]):
+            out = np.empty((n, size, size, image.shape[2]), dtype=image.dtype)
+        for i in range(n):
+            # 直接写入缓冲区的第 i 张
+            cv2.warpAffine(image, M[i], (size, size), dst=out[i], borderValue=0.0)
+        return out[:n]
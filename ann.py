@@ -0,0 +1,389 @@
+import copy
+import os
+import sys
+import threading
+
+import numpy as np
+
+import metrics
+from matcher import dedupe_labels
+
+
+def _normalize(x):
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return x / norms
+
+
+def _assign(features, centroids, chunk=8192):
+    """把每个特征分配到最相似的聚类中心（分块计算，避免大矩阵占满内存）"""
+    assign = np.empty(len(features), dtype=np.int64)
+    for start in range(0, len(features), chunk):
+        assign[start:start + chunk] = np.argmax(features[start:start + chunk] @ centroids.T, axis=1)
+    return assign
+
+
+class IVFIndex:
+    """
+    倒排文件（IVF-Flat）近似最近邻索引，纯 NumPy 实现
+    先用球面 k-means 把特征划分为 nlist 个簇，查询时只扫描与探针最相似的 nprobe 个簇，
+    簇内仍是精确的内积计算；nprobe = nlist 时退化为精确搜索
+    接口与 GalleryIndex 一致（search / search_batch），可直接传给 FaceMatcher
+    """
+    def __init__(self, dim=512, nlist=None, nprobe=8):
+        """
+        nlist: 簇数量，默认取 sqrt(N)
+        nprobe: 每次查询扫描的簇数量，越大召回率越高、速度越慢
+        """
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.centroids = np.zeros((0, dim), dtype=np.float32)
+        self.list_vectors = []
+        self.list_labels = []
+        # 训练时的特征条数，以及索引对应的 face_features_version 版本号（未知为 None）
+        self.trained_size = 0
+        self.version = None
+
+    def __len__(self):
+        return sum(len(labels) for labels in self.list_labels)
+
+    @property
+    def is_trained(self):
+        return len(self.centroids) > 0
+
+    def train(self, features, iters=20, seed=0):
+        """用球面 k-means 训练聚类中心"""
+        features = _normalize(np.asarray(features, dtype=np.float32).reshape(-1, self.dim))
+        n = len(features)
+        if n == 0:
+            raise ValueError("训练数据为空")
+        nlist = min(self.nlist or max(1, int(np.sqrt(n))), n)
+        rng = np.random.default_rng(seed)
+        centroids = features[rng.choice(n, nlist, replace=False)].copy()
+        for _ in range(iters):
+            assign = _assign(features, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, features)
+            counts = np.bincount(assign, minlength=nlist)
+            empty = counts == 0
+            # 空簇重新随机选一个样本作为中心
+            sums[empty] = features[rng.choice(n, int(empty.sum()))]
+            centroids = _normalize(sums)
+        self.set_centroids(centroids, trained_size=n)
+
+    def set_centroids(self, centroids, trained_size=0):
+        """直接使用已有的聚类中心（如沿用旧索引的中心），清空所有倒排列表"""
+        self.centroids = np.ascontiguousarray(np.asarray(centroids, dtype=np.float32))
+        self.nlist = len(self.centroids)
+        self.trained_size = trained_size
+        self.list_vectors = [np.zeros((0, self.dim), dtype=np.float32) for _ in range(self.nlist)]
+        self.list_labels = [np.zeros(0, dtype=object) for _ in range(self.nlist)]
+
+    def add_batch(self, labels, features):
+        """批量插入特征（需先 train）"""
+        if not self.is_trained:
+            raise ValueError("索引尚未训练，请先调用 train 或 build")
+        features = np.asarray(features, dtype=np.float32).reshape(-1, self.dim)
+        labels = np.array(list(labels), dtype=object)
+        assign = _assign(features, self.centroids)
+        for lst in np.unique(assign):
+            mask = assign == lst
+            self.list_vectors[lst] = np.vstack([self.list_vectors[lst], features[mask]])
+            self.list_labels[lst] = np.concatenate([self.list_labels[lst], labels[mask]])
+
+    def add(self, label, feature):
+        self.add_batch([label], np.asarray(feature)[None, :])
+
+    def __copy__(self):
+        """浅拷贝：特征数组共享，倒排列表本身复制，在副本上增删不影响原索引"""
+        other = object.__new__(type(self))
+        other.__dict__.update(self.__dict__)
+        other.list_vectors = list(self.list_vectors)
+        other.list_labels = list(self.list_labels)
+        return other
+
+    def remove(self, label):
+        """
+        删除指定姓名的所有特征
+        返回: 删除的条数
+        """
+        removed = 0
+        for lst, labels in enumerate(self.list_labels):
+            keep = labels != label
+            if not keep.all():
+                removed += int(len(labels) - keep.sum())
+                self.list_vectors[lst] = self.list_vectors[lst][keep]
+                self.list_labels[lst] = labels[keep]
+        return removed
+
+    def build(self, labels, features, **train_kwargs):
+        """训练并插入全部特征"""
+        self.train(features, **train_kwargs)
+        self.add_batch(labels, features)
+        return self
+
+    @classmethod
+    def from_database(cls, db, nlist=None, nprobe=8):
+        """从 face_features 表构建索引（同名的多条特征全部加入）"""
+        labels, features = [], []
+        for name, value in db.load_all().items():
+            for fea in (value if isinstance(value, list) else [value]):
+                labels.append(name)
+                features.append(fea)
+        index = cls(dim=len(features[0]) if features else 512, nlist=nlist, nprobe=nprobe)
+        if features:
+            index.build(labels, np.stack(features))
+        return index
+
+    def search(self, probe, top_k=1):
+        labels, scores = self.search_batch(np.asarray(probe)[None, :], top_k=top_k)
+        return labels[0], scores[0]
+
+    def search_batch(self, probes, top_k=1):
+        """
+        probes: [M, dim] 特征矩阵
+        输出: (labels, scores)，与 GalleryIndex.search_batch 相同
+        """
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.dim)
+        m = probes.shape[0]
+        if not self.is_trained or len(self) == 0:
+            return [[] for _ in range(m)], np.zeros((m, 0), dtype=np.float32)
+
+        nprobe = min(self.nprobe, self.nlist)
+        coarse = probes @ self.centroids.T
+        probe_lists = np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe]
+
+        all_labels, all_scores = [], []
+        for probe, lists in zip(probes, probe_lists):
+            vectors = np.vstack([self.list_vectors[lst] for lst in lists])
+            labels = np.concatenate([self.list_labels[lst] for lst in lists])
+            sims = vectors @ probe
+            # 同一人可能有多个模板，多取一些候选再按人去重
+            k = min(top_k * 4, len(sims))
+            if k == 0:
+                all_labels.append([])
+                all_scores.append(sims[:0])
+                continue
+            idx = np.argpartition(-sims, k - 1)[:k] if k < len(sims) else np.arange(len(sims))
+            idx = idx[np.argsort(-sims[idx])]
+            all_labels.append(list(labels[idx]))
+            all_scores.append(sims[idx])
+
+        # 同一人的多个模板取最大相似度；候选不足 top_k 的行补 -1
+        return dedupe_labels(all_labels, all_scores, top_k)
+
+    def save(self, path):
+        """保存到 .npz 文件"""
+        sizes = np.array([len(labels) for labels in self.list_labels], dtype=np.int64)
+        vectors = np.vstack(self.list_vectors) if self.list_vectors else np.zeros((0, self.dim), dtype=np.float32)
+        labels = np.concatenate(self.list_labels) if self.list_labels else np.zeros(0, dtype=object)
+        np.savez(path, centroids=self.centroids, sizes=sizes, vectors=vectors,
+                 labels=np.array([str(x) for x in labels], dtype=str),
+                 meta=np.array([self.dim, self.nlist or 0, self.nprobe, self.trained_size,
+                                -1 if self.version is None else self.version], dtype=np.int64))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        meta = [int(x) for x in data['meta']]
+        dim, nlist, nprobe = meta[:3]
+        index = cls(dim=dim, nlist=nlist or None, nprobe=nprobe)
+        # 旧版本保存的文件没有训练规模和版本号
+        if len(meta) >= 5:
+            index.trained_size = meta[3]
+            index.version = meta[4] if meta[4] >= 0 else None
+        index.centroids = data['centroids']
+        offsets = np.concatenate([[0], np.cumsum(data['sizes'])])
+        vectors, labels = data['vectors'], data['labels'].astype(object)
+        index.list_vectors = [vectors[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+        index.list_labels = [labels[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+        return index
+
+
+class IVFGallery:
+    """
+    持久化的 IVF 人脸库来源，接口与 FaceDatabase.get_gallery 相同，可作为 RecognitionPipeline 的 gallery_source
+    索引保存在 path（.npz）中并记录构建时的 face_features_version 版本号:
+        - 人脸库少于 min_size 条特征时直接返回精确的 GalleryIndex（小库精确搜索已经足够快）
+        - 版本号与数据库一致时返回 IVF 索引
+        - 本机通过 FaceDatabase 增删人脸时（db.add_gallery_listener），索引正好是修改前的版本就直接
+          add / remove 增量更新，不重建；索引文件在 save_interval 秒后合并保存一次
+        - 版本号不一致（其他终端增删过人脸）或索引为空时先返回精确索引，
+          同时在后台线程重建并保存索引，重建完成后自动切换
+    重建时规模变化不超过一倍则沿用原聚类中心，只重新分配倒排列表；增量更新后规模超出一倍时重新训练
+    """
+    def __init__(self, db, path="gallery_ivf.npz", nlist=None, nprobe=8, min_size=10000, save_interval=10.0):
+        self.db = db
+        # np.savez 会自动补 .npz 扩展名
+        self.path = path if path.endswith(".npz") else path + ".npz"
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_size = min_size
+        self.save_interval = save_interval
+        self._index = None
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._building = False
+        self._save_timer = None
+        if hasattr(db, "add_gallery_listener"):
+            db.add_gallery_listener(self._on_gallery_change)
+        if os.path.exists(self.path):
+            try:
+                self._index = IVFIndex.load(self.path)
+                self._index.nprobe = nprobe
+            except Exception as e:
+                print(f"读取 IVF 索引失败，将重新构建: {e}", file=sys.stderr)
+
+    def _is_current(self, index, version):
+        return index is not None and index.is_trained and len(index) > 0 and index.version == version
+
+    def get_gallery(self):
+        """返回当前可用的索引：IVF 索引，或过期/小库时的精确 GalleryIndex"""
+        gallery, version = self.db.get_gallery_snapshot()
+        if len(gallery) < self.min_size:
+            return gallery
+        index = self._index
+        if self._is_current(index, version):
+            return index
+        metrics.inc("ivf_stale_fallbacks_total")
+        with self._lock:
+            if not self._building:
+                self._building = True
+                threading.Thread(target=self._rebuild, args=(gallery, version), daemon=True).start()
+        return gallery
+
+    def _on_gallery_change(self, version, update):
+        """本机修改人脸库后增量更新索引（索引不是修改前的版本时不处理，由 get_gallery 重建）"""
+        with self._lock:
+            index = self._index
+            if index is None or not index.is_trained or index.version is None or index.version != version - 1:
+                return
+            index = copy.copy(index)
+            update(index)
+            index.version = version
+            self._index = index
+            metrics.inc("ivf_incremental_updates_total")
+            drifted = not index.trained_size / 2 <= len(index) <= index.trained_size * 2
+            if drifted and not self._building:
+                # 规模变化过大，聚类中心已不再合适，后台重新训练
+                self._building = True
+                threading.Thread(target=lambda: self._rebuild(*self.db.get_gallery_snapshot()),
+                                 daemon=True).start()
+            elif self._save_timer is None:
+                self._save_timer = threading.Timer(self.save_interval, self._save_latest)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+    def _save(self, index):
+        """先写临时文件再替换，其他进程不会读到写了一半的索引"""
+        with self._save_lock:
+            tmp = self.path[:-len(".npz")] + ".tmp.npz"
+            index.save(tmp)
+            os.replace(tmp, self.path)
+
+    def _save_latest(self):
+        with self._lock:
+            self._save_timer = None
+            index = self._index
+        try:
+            self._save(index)
+        except Exception as e:
+            print(f"保存 IVF 索引失败: {e}", file=sys.stderr)
+
+    def close(self):
+        """保存尚未写入文件的增量更新"""
+        with self._lock:
+            timer, self._save_timer = self._save_timer, None
+        if timer is not None:
+            timer.cancel()
+            self._save_latest()
+
+    def refresh(self):
+        """索引过期时在当前线程中同步重建（命令行工具启动时使用），返回 get_gallery() 的结果"""
+        gallery, version = self.db.get_gallery_snapshot()
+        if len(gallery) >= self.min_size and not self._is_current(self._index, version):
+            with self._lock:
+                start = not self._building
+                self._building = True
+            if start:
+                self._rebuild(gallery, version)
+        return self.get_gallery()
+
+    def _rebuild(self, gallery, version):
+        """由精确索引的快照构建 IVF 索引并保存"""
+        try:
+            with metrics.span("ivf_rebuild_seconds"):
+                rows = np.arange(len(gallery.labels)) if gallery.valid is None else np.flatnonzero(gallery.valid)
+                labels = gallery.labels[rows]
+                features = np.asarray(gallery.matrix[rows], dtype=np.float32)
+                old = self._index
+                index = IVFIndex(dim=gallery.dim, nlist=self.nlist, nprobe=self.nprobe)
+                if (old is not None and old.is_trained and old.dim == gallery.dim
+                        and old.trained_size / 2 <= len(rows) <= old.trained_size * 2):
+                    index.set_centroids(old.centroids, trained_size=old.trained_size)
+                    index.add_batch(labels, features)
+                else:
+                    index.build(labels, features)
+                index.version = version
+            with self._lock:
+                current = self._index
+                if current is not None and current.version is not None and current.version > version:
+                    # 重建期间本机又有增量更新，已有的索引更新，丢弃这次重建结果
+                    return
+                self._index = index
+            self._save(index)
+            metrics.inc("ivf_rebuilds_total")
+        except Exception as e:
+            print(f"重建 IVF 索引失败，继续使用精确搜索: {e}", file=sys.stderr)
+        finally:
+            with self._lock:
+                self._building = False
+
+
+def recall_at_k(ann_index, exact_index, probes, top_k=10):
+    """
+    评估近似索引相对精确搜索的召回率
+    返回: 近似 top_k 结果中命中精确 top_k 结果的平均比例
+    """
+    ann_labels, _ = ann_index.search_batch(probes, top_k=top_k)
+    exact_labels, _ = exact_index.search_batch(probes, top_k=top_k)
+    hits = []
+    for a, e in zip(ann_labels, exact_labels):
+        if e:
+            hits.append(len(set(a) & set(e)) / len(set(e)))
+    return float(np.mean(hits)) if hits else 1.0
+
+
+if __name__ == '__main__':
+    import argparse
+    from database import FaceDatabase
+    from matcher import GalleryIndex
+
+    parser = argparse.ArgumentParser(description="从 face_features 表构建 IVF 近似索引并评估召回率")
+    parser.add_argument("--out", default="gallery_ivf.npz", help="索引保存路径")
+    parser.add_argument("--nlist", type=int, default=None, help="簇数量，默认 sqrt(N)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32], help="评估的 nprobe 取值")
+    parser.add_argument("--queries", type=int, default=1000, help="评估用查询数量")
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+
+    db = FaceDatabase()
+    # 先读版本号再加载特征：加载期间有写入时索引会被视为过期，由 IVFGallery 重建
+    version = db.get_gallery_version()
+    index = IVFIndex.from_database(db, nlist=args.nlist)
+    index.version = version
+    index.save(args.out)
+    print(f"索引已保存: {args.out}（{len(index)} 条特征，{index.nlist} 个簇）")
+
+    # 用库内特征加噪声作为查询，与精确搜索比较
+    labels = np.concatenate(index.list_labels)
+    vectors = np.vstack(index.list_vectors)
+    exact = GalleryIndex(labels, vectors)
+    rng = np.random.default_rng(0)
+    sample = vectors[rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)]
+    queries = _normalize(sample + rng.normal(scale=0.03, size=sample.shape).astype(np.float32))
+    for nprobe in args.nprobe:
+        index.nprobe = nprobe
+        print(f"nprobe={nprobe}: recall@{args.top_k} = {recall_at_k(index, exact, queries, args.top_k):.4f}")
+    db.close()
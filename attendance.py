@@ -0,0 +1,124 @@
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import metrics
+
+
+class AttendanceWriter:
+    """
+    异步批量考勤写入
+    在内存中按姓名去重（dedup_minutes 分钟内同一人只记一次），通过去重的记录进入队列，
+    由后台线程每 flush_interval 秒或攒够 batch_size 条时用一条多行 INSERT 写入数据库
+    写入失败的记录放回队列重试（数据库暂时不可用），同一条记录失败 max_retries 次后把这批拆开逐段写入，
+    单独写也失败的记录丢弃并打印，不会一直阻塞后面的考勤；停止后不再重试
+    """
+    def __init__(self, db, dedup_minutes=5, flush_interval=2.0, batch_size=100, max_retries=5):
+        self.db = db
+        self.dedup_window = timedelta(minutes=dedup_minutes)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.dropped = 0
+        self.last_seen = {}
+        self.records = queue.Queue()
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """载入今天每人最后一次考勤时间（重启后去重仍然有效），启动后台写入线程"""
+        try:
+            self.last_seen.update(self.db.get_last_attendance_times())
+        except Exception as e:
+            print(f"载入今日考勤记录失败: {e}", file=sys.stderr)
+        metrics.set_gauge("attendance_pending", self.pending)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def record(self, name, when=None):
+        """
+        记录一次考勤（立即返回，不访问数据库）
+        返回: (是否接受, 消息)
+        """
+        when = when or datetime.now().replace(microsecond=0)
+        with self.lock:
+            last = self.last_seen.get(name)
+            if last is not None and last.date() == when.date() and when - last < self.dedup_window:
+                return False, f"已在{int(self.dedup_window.total_seconds() // 60)}分钟内记录过考勤"
+            self.last_seen[name] = when
+        # 队列中的记录为 (姓名, 时间, 已失败次数)
+        self.records.put((name, when, 0))
+        return True, f"考勤记录成功: {name} - {when.strftime('%Y-%m-%d %H:%M:%S')}"
+
+    def pending(self):
+        """等待写入的记录数"""
+        return self.records.qsize()
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while self.running or not self.records.empty():
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                batch.append(self.records.get(timeout=timeout))
+            except queue.Empty:
+                pass
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._flush(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+        self._flush(batch)
+
+    def _write(self, batch):
+        with metrics.span("attendance_flush_seconds"):
+            success, message = self.db.add_attendance_batch([(name, when) for name, when, _ in batch])
+        if success:
+            metrics.inc("attendance_records_written_total", len(batch))
+        else:
+            metrics.inc("attendance_flush_failures_total")
+            print(message, file=sys.stderr)
+        return success
+
+    def _flush(self, batch):
+        if not batch or self._write(batch):
+            return
+        retry = [(name, when, attempts + 1) for name, when, attempts in batch
+                 if attempts + 1 < self.max_retries]
+        if self.running and retry:
+            # 写入失败时放回队列，下次重试
+            for item in retry:
+                self.records.put(item)
+            time.sleep(self.flush_interval)
+        exhausted = [item for item in batch if not self.running or item[2] + 1 >= self.max_retries]
+        self._write_split(exhausted)
+
+    def _write_split(self, batch):
+        """对半拆分写入，找出单独写也失败的记录并丢弃，其余记录照常写入"""
+        if not batch:
+            return
+        if len(batch) > 1:
+            middle = len(batch) // 2
+            for part in (batch[:middle], batch[middle:]):
+                if not self._write(part):
+                    self._write_split(part)
+            return
+        name, when, _ = batch[0]
+        self.dropped += 1
+        metrics.inc("attendance_records_dropped_total")
+        print(f"考勤记录写入多次失败，已丢弃: {name} - {when.strftime('%Y-%m-%d %H:%M:%S')}", file=sys.stderr)
+
+    def stop(self):
+        """停止后台线程，退出前写入所有剩余记录（写入失败的不再重试）"""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=10)
+            if self.thread.is_alive() or self.pending():
+                print(f"考勤写入线程未能在停止前完成，还有 {self.pending()} 条考勤记录未写入", file=sys.stderr)
+            self.thread = None
+        if self.dropped:
+            print(f"共有 {self.dropped} 条考勤记录写入失败被丢弃", file=sys.stderr)
@@ -0,0 +1,293 @@
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块，不统计内存峰值
+    resource = None
+
+try:
+    import psutil
+except ImportError:  # 可选依赖，Linux 上直接读 /proc
+    psutil = None
+
+# 112x112 ArcFace 标准关键点，用于合成人脸图的对齐输入
+_ARCFACE_KPS = np.array([[38.2946, 51.6963], [73.5318, 51.5014], [56.0252, 71.7366],
+                         [41.5493, 92.3655], [70.7299, 92.2041]], dtype=np.float32)
+
+
+def peak_rss_mb():
+    """进程启动以来的内存峰值（MB），只增不减，不能反映单个阶段"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def current_rss_mb():
+    """当前常驻内存（MB）；Linux 读 /proc/self/statm，其他平台需要 psutil，都不可用时返回 None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        pass
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    return None
+
+
+class RssSampler:
+    """
+    后台线程每 interval 秒采样一次当前常驻内存，记录阶段内的峰值
+    with RssSampler() as sampler: ...; sampler.start_mb / sampler.peak_mb
+    """
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.start_mb = None
+        self.peak_mb = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        rss = current_rss_mb()
+        if rss is not None and (self.peak_mb is None or rss > self.peak_mb):
+            self.peak_mb = rss
+        return rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self.start_mb = self._sample()
+        if self.start_mb is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._sample()
+
+
+def summarize(samples, items_per_call=1):
+    """
+    samples: 每次调用的耗时（秒）
+    返回: p50/p95/p99/平均延迟（毫秒）和吞吐量（每秒处理的条目数）
+    """
+    ms = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        "calls": len(ms),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "throughput": round(items_per_call * len(ms) / max(ms.sum() / 1000, 1e-9), 1),
+    }
+
+
+def run_stage(name, fn, iterations, warmup=3, items_per_call=1, **params):
+    """预热后重复调用 fn，返回该阶段的统计结果"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    # 采样本阶段内的常驻内存峰值；ru_maxrss 是整个进程的历史峰值，模型加载后各阶段都相同
+    with RssSampler() as rss:
+        for _ in range(iterations):
+            start = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - start)
+    result = {"stage": name, **params, **summarize(samples, items_per_call)}
+    if rss.peak_mb is not None:
+        result["peak_rss_mb"] = round(rss.peak_mb, 1)
+        result["rss_growth_mb"] = round(rss.peak_mb - rss.start_mb, 1)
+    print(f"{name:<10} {json.dumps(params, ensure_ascii=False):<40} p50={result['p50_ms']:.2f}ms "
+          f"p95={result['p95_ms']:.2f}ms p99={result['p99_ms']:.2f}ms {result['throughput']:.1f}/s",
+          file=sys.stderr)
+    return result
+
+
+def synthetic_image(width, height, faces=0, face_img=None, seed=0):
+    """
+    合成测试图: 随机噪声背景上按网格贴 faces 张人脸
+    返回: (图像, 每张人脸的 5 个关键点 [faces, 5, 2])
+    """
+    rng = np.random.default_rng(seed)
+    img = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    if face_img is None:
+        face_img = rng.integers(0, 256, size=(112, 112, 3), dtype=np.uint8)
+    cols = max(1, int(np.ceil(np.sqrt(faces))))
+    cell = min(width, height) // max(cols, 1)
+    size = max(32, int(cell * 0.8))
+    face = cv2.resize(face_img, (size, size))
+    kps = []
+    for i in range(faces):
+        x, y = (i % cols) * cell, (i // cols) * cell
+        if x + size > width or y + size > height:
+            break
+        img[y:y + size, x:x + size] = face
+        kps.append(_ARCFACE_KPS * (size / 112) + np.array([x, y], dtype=np.float32))
+    return img, np.array(kps, dtype=np.float32).reshape(-1, 5, 2)
+
+
+def load_samples(path, limit=20):
+    """读取样例图片目录中的前 limit 张图片"""
+    images = []
+    for filename in sorted(os.listdir(path)):
+        if os.path.splitext(filename)[1].lower() in (".jpg", ".jpeg", ".png", ".bmp"):
+            img = cv2.imdecode(np.fromfile(os.path.join(path, filename), dtype=np.uint8), cv2.IMREAD_COLOR)
+            if img is not None:
+                images.append((filename, img))
+        if len(images) >= limit:
+            break
+    return images
+
+
+def random_gallery(size, dim=512, templates=1, seed=0):
+    """随机生成 size 人（每人 templates 个模板）的人脸库"""
+    from matcher import GalleryIndex
+    rng = np.random.default_rng(seed)
+    feats = rng.standard_normal((size * templates, dim), dtype=np.float32)
+    feats /= np.linalg.norm(feats, axis=1, keepdims=True)
+    labels = [f"p{i}" for i in range(size) for _ in range(templates)]
+    return GalleryIndex(labels, feats, dim=dim)
+
+
+def index_mb(index):
+    """索引常驻内存的大小（MB）"""
+    if hasattr(index, "nbytes"):
+        nbytes = index.nbytes
+    elif hasattr(index, "list_vectors"):
+        nbytes = sum(v.nbytes for v in index.list_vectors) + index.centroids.nbytes
+    else:
+        nbytes = index.matrix.nbytes
+    return round(nbytes / (1024 * 1024), 1)
+
+
+def bench_matching(sizes, batch_sizes, indexes, iterations, dim=512):
+    """人脸库规模扫描：不同规模、不同查询批大小、不同索引下的匹配耗时"""
+    from matcher import FaceMatcher, QuantizedGalleryIndex
+    matcher = FaceMatcher()
+    rng = np.random.default_rng(1)
+    results = []
+    for size in sizes:
+        gallery = random_gallery(size, dim=dim)
+        for index_name in indexes:
+            if index_name == "exact":
+                index = gallery
+            elif index_name in ("int8", "float16"):
+                index = QuantizedGalleryIndex(gallery, mode=index_name)
+            elif index_name == "ivf":
+                from ann import IVFIndex
+                index = IVFIndex(dim=dim).build(gallery.labels, gallery.matrix)
+            else:
+                raise ValueError(f"不支持的索引: {index_name}")
+            for m in batch_sizes:
+                probes = gallery.matrix[rng.integers(0, size, m)] + rng.normal(scale=0.05, size=(m, dim))
+                probes = (probes / np.linalg.norm(probes, axis=1, keepdims=True)).astype(np.float32)
+                results.append(run_stage("match", lambda: matcher.match_batch(probes, index), iterations,
+                                         items_per_call=m, gallery=size, index=index_name, batch=m,
+                                         index_mb=index_mb(index)))
+    return results
+
+
+def bench_models(args, results):
+    """检测 / 对齐 / 特征提取"""
+    from detector import FaceDetector
+    from aligner import FaceAligner
+    from extractor import FeatureExtractor
+
+    detector = FaceDetector(model_path=args.model, backend=args.backend, max_side=args.max_side)
+    aligner = FaceAligner()
+    extractor = FeatureExtractor()
+    samples = load_samples(args.images) if args.images else []
+    face_img = None
+
+    # 样例图片: 检测 + 取第一张检测到的人脸作为合成图的贴图
+    for filename, img in samples:
+        boxes, kps = detector.detect(img)
+        if face_img is None and len(boxes) and kps is not None and len(kps):
+            face_img = aligner.align(img, keypoints=kps[0])
+        results.append(run_stage("detect", lambda: detector.detect(img), args.iterations,
+                                 source=filename, resolution=f"{img.shape[1]}x{img.shape[0]}",
+                                 faces=int(len(boxes))))
+
+    for resolution in args.resolutions:
+        width, height = (int(v) for v in resolution.lower().split("x"))
+        for faces in args.faces:
+            img, kps = synthetic_image(width, height, faces, face_img)
+            results.append(run_stage("detect", lambda: detector.detect(img), args.iterations,
+                                     source="synthetic", resolution=resolution, faces=faces))
+            if len(kps):
+                results.append(run_stage("align", lambda: [aligner.align(img, keypoints=kp) for kp in kps],
+                                         args.iterations, items_per_call=len(kps),
+                                         resolution=resolution, faces=len(kps)))
+                buffer = np.empty((len(kps), aligner.input_size, aligner.input_size, 3), dtype=np.uint8)
+                results.append(run_stage("align_batch", lambda: aligner.align_batch(img, kps, out=buffer),
+                                         args.iterations, items_per_call=len(kps),
+                                         resolution=resolution, faces=len(kps)))
+
+    aligned = face_img if face_img is not None else synthetic_image(112, 112, 1)[0]
+    results.append(run_stage("extract", lambda: extractor.extract(aligned), args.iterations, batch=1))
+    for batch in args.batch_sizes:
+        faces = [aligned] * batch
+        results.append(run_stage("extract", lambda: extractor.extract_batch(faces), args.iterations,
+                                 items_per_call=batch, batch=batch))
+
+
+if __name__ == '__main__':
+    import argparse
+    import runtime
+
+    parser = argparse.ArgumentParser(description="流水线各阶段性能测试，结果输出为 JSON")
+    parser.add_argument("--images", default=None, help="样例图片目录")
+    parser.add_argument("--backend", default="yolo", help="检测后端: yolo / onnx / scrfd")
+    parser.add_argument("--model", default=None, help="检测模型路径，默认使用后端的默认模型")
+    parser.add_argument("--max-side", type=int, default=None, help="检测前把图像长边缩小到该尺寸")
+    parser.add_argument("--resolutions", nargs="+", default=["640x480", "1280x720", "1920x1080"],
+                        help="合成图分辨率")
+    parser.add_argument("--faces", type=int, nargs="+", default=[1, 4, 16], help="合成图中的人脸数")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32], help="特征提取/匹配的批大小")
+    parser.add_argument("--gallery-sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="匹配测试的人脸库规模")
+    parser.add_argument("--indexes", nargs="+", default=["exact"],
+                        help="匹配测试的索引: exact / int8 / float16 / ivf")
+    parser.add_argument("--iterations", type=int, default=50, help="每项测试的调用次数")
+    parser.add_argument("--match-only", action="store_true", help="只测试匹配（不加载模型）")
+    parser.add_argument("--out", default="-", help="JSON 输出文件，默认标准输出")
+    runtime.add_arguments(parser)
+    args = parser.parse_args()
+
+    config = runtime.configure(runtime.from_args(args))
+
+    results = []
+    if not args.match_only:
+        bench_models(args, results)
+    results.extend(bench_matching(args.gallery_sizes, args.batch_sizes, args.indexes, args.iterations))
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "backend": None if args.match_only else args.backend,
+        "runtime": config.to_dict(),
+        "process_peak_rss_mb": peak_rss_mb(),
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out == "-":
+        print(text)
+    else:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
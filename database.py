@@ -1,70 +1,133 @@
-import pymysql
+import copy
+import sys
+import threading
+import time
 import numpy as np
-from datetime import datetime
+from datetime import datetime, timedelta
+
+import schema
+import metrics
+from db_pool import ConnectionPool
+from matcher import GalleryIndex, QuantizedGalleryIndex
 
 class FaceDatabase:
-    def __init__(self, host="localhost", user="root", password="123456", database="face_recognition"):
+    def __init__(self, host="localhost", user="root", password="123456", database="face_recognition",
+                 gallery_check_interval=2.0, gallery_options=None, pool_size=4, connect_timeout=5,
+                 read_timeout=30, write_timeout=30, acquire_timeout=10, gallery_quantization=None):
+        """
+        pool_size: 连接池最大连接数，多个摄像头/工作线程共用
+        connect_timeout / read_timeout / write_timeout / acquire_timeout: 连接池超时设置（秒），见 ConnectionPool
+        gallery_check_interval: 检查人脸库版本号的最小间隔（秒），
+        间隔内直接使用缓存的人脸库，不访问数据库
+        gallery_options: 传给 GalleryIndex 的参数，如 {'aggregate': 'mean_topk', 'centroid_candidates': 50}
+        gallery_quantization: 'int8' / 'float16' 时缓存 QuantizedGalleryIndex，不保留 float32 矩阵
+        （内存为 1/4 或 1/2，相似度为近似值，gallery_options 不生效）
+        """
+        # 人脸库缓存：只在版本号变化时重新加载
+        self.gallery_check_interval = gallery_check_interval
+        self.gallery_options = gallery_options or {}
+        self.gallery_quantization = gallery_quantization
+        self._gallery = None
+        self._gallery_version = None
+        self._gallery_checked_at = 0.0
+        self._gallery_lock = threading.Lock()
+        self._gallery_listeners = []
+        metrics.set_gauge("gallery_templates", lambda: len(self._gallery) if self._gallery is not None else 0)
         try:
-            self.conn = pymysql.connect(
+            # 每个操作从连接池取连接、使用独立游标，可在多个线程中同时调用
+            self.pool = ConnectionPool(
                 host=host,
                 user=user,
                 password=password,
-                database=database
+                database=database,
+                size=pool_size,
+                connect_timeout=connect_timeout,
+                read_timeout=read_timeout,
+                write_timeout=write_timeout,
+                acquire_timeout=acquire_timeout
             )
-            self.cursor = self.conn.cursor()
+            # 立即建立一个连接，尽早发现配置错误
+            self.pool.release(self.pool.acquire())
         except Exception as e:
-            print(f"数据库连接失败: {e}")
-            print("请确保 MySQL 服务正在运行，且数据库和表已创建")
+            print(f"数据库连接失败: {e}", file=sys.stderr)
+            print("请确保 MySQL 服务正在运行，且数据库和表已创建", file=sys.stderr)
             raise
+        # 建表和索引只在启动时检查一次
+        schema.migrate(self.pool)
 
     def check_name_exists(self, name):
         """检查名字是否已存在"""
         sql = "SELECT COUNT(*) FROM face_features WHERE name = %s"
-        self.cursor.execute(sql, (name,))
-        count = self.cursor.fetchone()[0]
+        with self.pool.cursor() as cursor:
+            cursor.execute(sql, (name,))
+            count = cursor.fetchone()[0]
         return count > 0
 
+    def find_similar_faces(self, feature, top_k=5, threshold=0.85):
+        """
+        在缓存的人脸库上查找最相似的若干人（一次矩阵运算，不访问 face_features 表）
+        返回: [(姓名, 相似度), ...]，按相似度从高到低，只包含相似度 >= threshold 的人
+        """
+        labels, scores = self.get_gallery().search(np.asarray(feature, dtype=np.float32), top_k=top_k)
+        return [(name, float(score)) for name, score in zip(labels, scores) if score >= threshold]
+
     def find_similar_face(self, feature, threshold=0.85):
         """
         检查是否存在相似的人脸特征
-        返回: (是否存在, 匹配的姓名, 相似度)
+        返回: (是否存在, 最相似的姓名, 相似度)
         threshold: 相似度阈值，默认0.85（较高，确保是同一个人）
         """
-        sql = "SELECT name, feature FROM face_features"
-        self.cursor.execute(sql)
-        rows = self.cursor.fetchall()
-
-        for name, fea_bytes in rows:
-            db_feature = np.frombuffer(fea_bytes, dtype=np.float32)
-            # 计算余弦相似度
-            cos_sim = np.dot(feature, db_feature)
-            if cos_sim >= threshold:
-                return True, name, cos_sim
+        similar = self.find_similar_faces(feature, top_k=1, threshold=threshold)
+        if similar:
+            return True, similar[0][0], similar[0][1]
         return False, None, 0.0
 
-    def add(self, name, feature, overwrite_if_exists=False):
+    def add(self, name, feature, overwrite_if_exists=False, append_template=False):
         """
         保存人脸特征到数据库
         overwrite_if_exists: 如果名字已存在，是否覆盖（默认False）
+        append_template: 如果名字已存在，是否作为该人的新模板追加一条记录（多模板注册）
         """
         feature_bytes = feature.tobytes()
         
-        if self.check_name_exists(name):
+        if self.check_name_exists(name) and not append_template:
             if overwrite_if_exists:
                 # 更新现有记录
                 sql = "UPDATE face_features SET feature = %s WHERE name = %s"
-                self.cursor.execute(sql, (feature_bytes, name))
-                self.conn.commit()
+                with self.pool.transaction() as cursor:
+                    cursor.execute(sql, (feature_bytes, name))
+                    version = self._bump_gallery_version(cursor)
+                self._apply_gallery_change(version, lambda g: (g.remove(name), g.add(name, feature)))
                 return "updated"
             else:
                 raise ValueError(f"名字 '{name}' 已存在，请使用不同的名字或选择覆盖")
         
         # 插入新记录
         sql = "INSERT INTO face_features (name, feature) VALUES (%s, %s)"
-        self.cursor.execute(sql, (name, feature_bytes))
-        self.conn.commit()
+        with self.pool.transaction() as cursor:
+            cursor.execute(sql, (name, feature_bytes))
+            version = self._bump_gallery_version(cursor)
+        self._apply_gallery_change(version, lambda g: g.add(name, feature))
         return "inserted"
 
+    def add_many(self, records):
+        """
+        批量插入人脸特征（一个事务、一次版本号更新），不做重名检查，由调用方负责
+        records: [(name, feature), ...]，同名的多条记录作为该人的多个模板
+        返回: 插入的记录数
+        """
+        if not records:
+            return 0
+        sql = "INSERT INTO face_features (name, feature) VALUES (%s, %s)"
+        rows = [(name, np.asarray(feature, dtype=np.float32).tobytes()) for name, feature in records]
+        with self.pool.transaction() as cursor:
+            cursor.executemany(sql, rows)
+            version = self._bump_gallery_version(cursor)
+
+        self._apply_gallery_change(version, lambda g: g.add_batch([name for name, _ in records],
+                                                                  [feature for _, feature in records]))
+        return len(rows)
+
     def load_all(self):
         """
         加载所有特征
@@ -72,8 +135,9 @@ class FaceDatabase:
         注意：如果有多个同名记录，只返回第一个
         """
         sql = "SELECT name, feature FROM face_features"
-        self.cursor.execute(sql)
-        rows = self.cursor.fetchall()
+        with self.pool.cursor() as cursor:
+            cursor.execute(sql)
+            rows = cursor.fetchall()
 
         db = {}
         for name, fea_bytes in rows:
@@ -102,11 +166,104 @@ class FaceDatabase:
                 simplified_db[name] = value
         return simplified_db
 
+    def init_gallery_version_table(self):
+        """
+        初始化人脸库版本表（如果不存在则创建）
+        face_features 每次增删改都会把版本号加一，其他终端据此判断缓存是否过期
+        启动时已由 schema.migrate 创建，保留此方法以兼容旧代码
+        """
+        sql = """
+        CREATE TABLE IF NOT EXISTS face_features_version (
+            id TINYINT PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+        with self.pool.cursor() as cursor:
+            cursor.execute(sql)
+            cursor.execute("INSERT IGNORE INTO face_features_version (id, version) VALUES (1, 0)")
+
+    def get_gallery_version(self):
+        """获取数据库中人脸库的当前版本号"""
+        with self.pool.cursor() as cursor:
+            cursor.execute("SELECT version FROM face_features_version WHERE id = 1")
+            row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def _bump_gallery_version(self, cursor):
+        """在调用方的事务中把版本号加一，返回新版本号"""
+        cursor.execute("UPDATE face_features_version SET version = version + 1 WHERE id = 1")
+        cursor.execute("SELECT version FROM face_features_version WHERE id = 1")
+        return cursor.fetchone()[0]
+
+    def add_gallery_listener(self, callback):
+        """
+        订阅本地的人脸库修改（供 ann.IVFGallery 等派生索引增量更新）
+        callback(version, update): version 为修改后的版本号，update(index) 把本次修改应用到
+        提供 add / add_batch / remove 的索引上
+        """
+        self._gallery_listeners.append(callback)
+
+    def _apply_gallery_change(self, version, update):
+        """
+        本地修改后同步缓存
+        如果缓存正好是修改前的版本，直接增量更新；否则说明期间有其他终端修改过，丢弃缓存
+        更新在副本上进行再整体替换，其他线程正在使用的旧索引不受影响
+        """
+        with self._gallery_lock:
+            if self._gallery is not None and self._gallery_version == version - 1:
+                gallery = copy.copy(self._gallery)
+                update(gallery)
+                self._gallery = gallery
+                self._gallery_version = version
+            else:
+                self._gallery = None
+        for callback in self._gallery_listeners:
+            try:
+                callback(version, update)
+            except Exception as e:
+                print(f"同步人脸库修改失败: {e}", file=sys.stderr)
+
+    def get_gallery(self, force_reload=False):
+        """
+        获取缓存的人脸库索引（用于匹配）
+        只有数据库中的版本号变化时才重新执行 SELECT 加载全部特征
+        同名的多条记录都作为该人的模板保留
+        返回: GalleryIndex
+        """
+        return self.get_gallery_snapshot(force_reload)[0]
+
+    def get_gallery_snapshot(self, force_reload=False):
+        """
+        同 get_gallery，同时返回该索引对应的 face_features_version 版本号
+        （供 ann.IVFGallery 等派生索引判断是否过期）
+        返回: (GalleryIndex, 版本号)
+        """
+        with self._gallery_lock:
+            now = time.monotonic()
+            if (not force_reload and self._gallery is not None
+                    and now - self._gallery_checked_at < self.gallery_check_interval):
+                return self._gallery, self._gallery_version
+
+            version = self.get_gallery_version()
+            self._gallery_checked_at = now
+            if force_reload or self._gallery is None or version != self._gallery_version:
+                # 保留每个人的全部模板，匹配时按人聚合
+                with metrics.span("gallery_reload_seconds"):
+                    if self.gallery_quantization:
+                        self._gallery = QuantizedGalleryIndex.from_dict(self.load_all(),
+                                                                        mode=self.gallery_quantization)
+                    else:
+                        self._gallery = GalleryIndex.from_dict(self.load_all(), **self.gallery_options)
+                self._gallery_version = version
+                metrics.inc("gallery_reloads_total")
+            return self._gallery, self._gallery_version
+
     def get_all_names(self):
         """获取所有已注册的姓名列表"""
         sql = "SELECT DISTINCT name FROM face_features ORDER BY name"
-        self.cursor.execute(sql)
-        rows = self.cursor.fetchall()
+        with self.pool.cursor() as cursor:
+            cursor.execute(sql)
+            rows = cursor.fetchall()
         return [row[0] for row in rows]
 
     def delete(self, name):
@@ -115,19 +272,24 @@ class FaceDatabase:
         返回: 删除的记录数
         """
         sql = "DELETE FROM face_features WHERE name = %s"
-        self.cursor.execute(sql, (name,))
-        deleted_count = self.cursor.rowcount
-        self.conn.commit()
+        with self.pool.transaction() as cursor:
+            cursor.execute(sql, (name,))
+            deleted_count = cursor.rowcount
+            if deleted_count > 0:
+                version = self._bump_gallery_version(cursor)
+        if deleted_count > 0:
+            self._apply_gallery_change(version, lambda g: g.remove(name))
         return deleted_count
 
     def get_count_by_name(self, name):
         """获取指定名字的记录数量"""
         sql = "SELECT COUNT(*) FROM face_features WHERE name = %s"
-        self.cursor.execute(sql, (name,))
-        return self.cursor.fetchone()[0]
+        with self.pool.cursor() as cursor:
+            cursor.execute(sql, (name,))
+            return cursor.fetchone()[0]
 
     def init_attendance_table(self):
-        """初始化考勤表（如果不存在则创建）"""
+        """初始化考勤表（如果不存在则创建）；启动时已由 schema.migrate 创建，保留此方法以兼容旧代码"""
         sql = """
         CREATE TABLE IF NOT EXISTS attendance_records (
             id INT AUTO_INCREMENT PRIMARY KEY,
@@ -140,8 +302,8 @@ class FaceDatabase:
             INDEX idx_attendance_time (attendance_time)
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
         """
-        self.cursor.execute(sql)
-        self.conn.commit()
+        with self.pool.cursor() as cursor:
+            cursor.execute(sql)
 
     def add_attendance(self, name):
         """
@@ -149,9 +311,6 @@ class FaceDatabase:
         返回: (是否成功, 消息)
         """
         try:
-            # 确保表存在
-            self.init_attendance_table()
-            
             # 获取当前时间
             now = datetime.now()
             attendance_time = now.strftime("%Y-%m-%d %H:%M:%S")
@@ -160,29 +319,61 @@ class FaceDatabase:
             
             # 检查今天是否已经记录过考勤（防止重复记录）
             # 可以设置时间间隔，比如5分钟内不重复记录
+            # 直接比较 attendance_time 列（不套函数），可以走 (name, attendance_time) 组合索引
+            since = (now - timedelta(minutes=5)).strftime("%Y-%m-%d %H:%M:%S")
             sql_check = """
             SELECT id FROM attendance_records 
-            WHERE name = %s AND date = %s 
-            AND TIMESTAMPDIFF(MINUTE, attendance_time, %s) < 5
+            WHERE name = %s AND attendance_time > %s AND date = %s 
             ORDER BY attendance_time DESC LIMIT 1
             """
-            self.cursor.execute(sql_check, (name, date, attendance_time))
-            if self.cursor.fetchone():
-                return False, "已在5分钟内记录过考勤"
-            
             # 插入考勤记录
             sql = """
             INSERT INTO attendance_records (name, attendance_time, date, time) 
             VALUES (%s, %s, %s, %s)
             """
-            self.cursor.execute(sql, (name, attendance_time, date, time_str))
-            self.conn.commit()
+            with self.pool.transaction() as cursor:
+                cursor.execute(sql_check, (name, since, date))
+                if cursor.fetchone():
+                    return False, "已在5分钟内记录过考勤"
+                cursor.execute(sql, (name, attendance_time, date, time_str))
             return True, f"考勤记录成功: {name} - {attendance_time}"
             
         except Exception as e:
-            self.conn.rollback()
             return False, f"考勤记录失败: {str(e)}"
 
+    def add_attendance_batch(self, records):
+        """
+        批量添加考勤记录（多行 INSERT，一次提交；去重由调用方负责，见 AttendanceWriter）
+        records: [(name, datetime), ...]
+        返回: (是否成功, 消息)
+        """
+        try:
+            rows = [(name, when.strftime("%Y-%m-%d %H:%M:%S"), when.strftime("%Y-%m-%d"), when.strftime("%H:%M:%S"))
+                    for name, when in records]
+            sql = """
+            INSERT INTO attendance_records (name, attendance_time, date, time) 
+            VALUES (%s, %s, %s, %s)
+            """
+            # pymysql 的 executemany 会把 INSERT ... VALUES 合并成一条多行语句
+            with self.pool.transaction() as cursor:
+                cursor.executemany(sql, rows)
+            return True, f"批量写入考勤记录 {len(rows)} 条"
+
+        except Exception as e:
+            return False, f"批量写入考勤记录失败: {str(e)}"
+
+    def get_last_attendance_times(self, date=None):
+        """
+        获取指定日期（默认今天）每人最后一次考勤时间
+        返回: {name: datetime}
+        """
+        date = date or datetime.now().strftime("%Y-%m-%d")
+        sql = "SELECT name, MAX(attendance_time) FROM attendance_records WHERE date = %s GROUP BY name"
+        with self.pool.cursor() as cursor:
+            cursor.execute(sql, (date,))
+            rows = cursor.fetchall()
+        return {name: last for name, last in rows}
+
     def get_attendance_records(self, name=None, date=None, limit=100):
         """
         获取考勤记录
@@ -192,8 +383,6 @@ class FaceDatabase:
         返回: 记录列表 [(id, name, attendance_time, date, time), ...]
         """
         try:
-            self.init_attendance_table()
-            
             sql = "SELECT id, name, attendance_time, date, time FROM attendance_records WHERE 1=1"
             params = []
             
@@ -208,8 +397,9 @@ class FaceDatabase:
             sql += " ORDER BY attendance_time DESC LIMIT %s"
             params.append(limit)
             
-            self.cursor.execute(sql, params)
-            return self.cursor.fetchall()
+            with self.pool.cursor() as cursor:
+                cursor.execute(sql, params)
+                return cursor.fetchall()
             
         except Exception as e:
             print(f"获取考勤记录失败: {e}")
@@ -221,8 +411,6 @@ class FaceDatabase:
         返回: {'total_count': 总次数, 'by_date': {日期: 次数}}
         """
         try:
-            self.init_attendance_table()
-            
             sql = "SELECT date, COUNT(*) as count FROM attendance_records WHERE 1=1"
             params = []
             
@@ -240,8 +428,9 @@ class FaceDatabase:
             
             sql += " GROUP BY date ORDER BY date DESC"
             
-            self.cursor.execute(sql, params)
-            rows = self.cursor.fetchall()
+            with self.pool.cursor() as cursor:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
             
             total_count = sum(row[1] for row in rows)
             by_date = {row[0]: row[1] for row in rows}
@@ -261,10 +450,10 @@ class FaceDatabase:
         返回: (id, name, attendance_time, date, time) 或 None
         """
         try:
-            self.init_attendance_table()
             sql = "SELECT id, name, attendance_time, date, time FROM attendance_records WHERE id = %s"
-            self.cursor.execute(sql, (record_id,))
-            result = self.cursor.fetchone()
+            with self.pool.cursor() as cursor:
+                cursor.execute(sql, (record_id,))
+                result = cursor.fetchone()
             return result
         except Exception as e:
             print(f"获取考勤记录失败: {e}")
@@ -279,8 +468,6 @@ class FaceDatabase:
         返回: (是否成功, 消息)
         """
         try:
-            self.init_attendance_table()
-            
             # 如果提供了新时间，需要解析日期和时间
             if attendance_time:
                 dt = datetime.strptime(attendance_time, "%Y-%m-%d %H:%M:%S")
@@ -309,16 +496,16 @@ class FaceDatabase:
             sql = f"UPDATE attendance_records SET {', '.join(updates)} WHERE id = %s"
             params.append(record_id)
             
-            self.cursor.execute(sql, params)
-            self.conn.commit()
+            with self.pool.cursor() as cursor:
+                cursor.execute(sql, params)
+                updated_count = cursor.rowcount
             
-            if self.cursor.rowcount > 0:
+            if updated_count > 0:
                 return True, "更新成功"
             else:
                 return False, "未找到要更新的记录"
                 
         except Exception as e:
-            self.conn.rollback()
             return False, f"更新失败: {str(e)}"
 
     def delete_attendance(self, record_id):
@@ -328,11 +515,10 @@ class FaceDatabase:
         返回: (是否成功, 消息)
         """
         try:
-            self.init_attendance_table()
             sql = "DELETE FROM attendance_records WHERE id = %s"
-            self.cursor.execute(sql, (record_id,))
-            deleted_count = self.cursor.rowcount
-            self.conn.commit()
+            with self.pool.cursor() as cursor:
+                cursor.execute(sql, (record_id,))
+                deleted_count = cursor.rowcount
             
             if deleted_count > 0:
                 return True, f"成功删除 {deleted_count} 条记录"
@@ -340,7 +526,6 @@ class FaceDatabase:
                 return False, "未找到要删除的记录"
                 
         except Exception as e:
-            self.conn.rollback()
             return False, f"删除失败: {str(e)}"
 
     def add_attendance_manual(self, name, attendance_time):
@@ -351,8 +536,6 @@ class FaceDatabase:
         返回: (是否成功, 消息)
         """
         try:
-            self.init_attendance_table()
-            
             # 解析时间
             dt = datetime.strptime(attendance_time, "%Y-%m-%d %H:%M:%S")
             date = dt.strftime("%Y-%m-%d")
@@ -363,14 +546,12 @@ class FaceDatabase:
             INSERT INTO attendance_records (name, attendance_time, date, time) 
             VALUES (%s, %s, %s, %s)
             """
-            self.cursor.execute(sql, (name, attendance_time, date, time_str))
-            self.conn.commit()
+            with self.pool.cursor() as cursor:
+                cursor.execute(sql, (name, attendance_time, date, time_str))
             return True, f"考勤记录添加成功: {name} - {attendance_time}"
             
         except Exception as e:
-            self.conn.rollback()
             return False, f"添加失败: {str(e)}"
 
     def close(self):
-        self.cursor.close()
-        self.conn.close()
+        self.pool.close()
@@ -0,0 +1,146 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import pymysql
+
+import metrics
+
+
+class ConnectionPool:
+    """
+    线程安全的 MySQL 连接池
+    每次操作从池中取一个连接、使用独立的游标，用完归还；
+    空闲超过 ping_interval 的连接在使用前 ping 一次，MySQL 断开空闲连接后会自动重连
+    连接为自动提交模式，需要多条语句原子执行时使用 transaction()
+    """
+    def __init__(self, host="localhost", user="root", password="123456", database="face_recognition",
+                 size=4, connect_timeout=5, read_timeout=30, write_timeout=30,
+                 acquire_timeout=10, ping_interval=30):
+        """
+        size: 最大连接数
+        connect_timeout / read_timeout / write_timeout: pymysql 的连接、读、写超时（秒）
+        acquire_timeout: 连接全部被占用时等待空闲连接的最长时间（秒）
+        ping_interval: 连接空闲超过该时间（秒）后，使用前先 ping 检查
+        """
+        self.connect_kwargs = dict(
+            host=host,
+            user=user,
+            password=password,
+            database=database,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            write_timeout=write_timeout,
+            autocommit=True,
+        )
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self.ping_interval = ping_interval
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        metrics.set_gauge("db_pool_connections", lambda: self._created, state="open")
+        metrics.set_gauge("db_pool_connections", self._idle.qsize, state="idle")
+
+    def _connect(self):
+        return pymysql.connect(**self.connect_kwargs)
+
+    def acquire(self):
+        """取一个可用连接；池已满时最多等待 acquire_timeout 秒"""
+        if self._closed:
+            raise RuntimeError("连接池已关闭")
+        try:
+            conn, last_used = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    return self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            try:
+                conn, last_used = self._idle.get(timeout=self.acquire_timeout)
+            except queue.Empty:
+                raise TimeoutError(f"获取数据库连接超时（{self.acquire_timeout} 秒）")
+
+        if time.monotonic() - last_used > self.ping_interval:
+            try:
+                conn.ping(reconnect=True)
+            except Exception:
+                self._discard(conn)
+                raise
+        return conn
+
+    def release(self, conn):
+        """归还连接"""
+        if self._closed:
+            self._discard(conn)
+            return
+        self._idle.put((conn, time.monotonic()))
+
+    def _discard(self, conn):
+        with self._lock:
+            self._created -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """
+        with pool.connection() as conn: ...
+        出现连接级错误时丢弃该连接，下次重新建立
+        """
+        with metrics.span("db_acquire_seconds"):
+            conn = self.acquire()
+        try:
+            yield conn
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            metrics.inc("db_connection_errors_total")
+            self._discard(conn)
+            raise
+        except Exception:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    @contextmanager
+    def cursor(self):
+        """单条语句（自动提交）: with pool.cursor() as cursor: ..."""
+        with metrics.span("db_query_seconds", kind="cursor"), self.connection() as conn:
+            with conn.cursor() as cursor:
+                yield cursor
+
+    @contextmanager
+    def transaction(self):
+        """事务: 正常退出时提交，异常时回滚"""
+        with metrics.span("db_query_seconds", kind="transaction"), self.connection() as conn:
+            conn.begin()
+            try:
+                with conn.cursor() as cursor:
+                    yield cursor
+                conn.commit()
+            except Exception:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+                raise
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
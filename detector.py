@@ -1,10 +1,151 @@
-from ultralytics import YOLO
+import os
+import sys
+import cv2
 import numpy as np
 
+from runtime import get_config
 
-class FaceDetector:
-    def __init__(self, model_path="yolov8x-face-lindevs.pt"):
+
+# 各后端的默认模型
+DEFAULT_MODELS = {
+    "yolo": "yolov8x-face-lindevs.pt",     # 也可用 yolov8n/yolov8s-face-lindevs.pt 或导出的 .onnx
+    "onnx": "yolov8n-face-lindevs.onnx",   # ultralytics 导出的 ONNX，直接用 onnxruntime 推理
+    "scrfd": "buffalo_l/det_10g.onnx",     # InsightFace 自带的 SCRFD 检测模型（buffalo_s 为 det_500m.onnx）
+}
+
+
+def _insightface_model_file(path):
+    """
+    解析 InsightFace 模型路径，'包名/文件名' 形式的相对路径从 ~/.insightface/models 中查找，
+    不存在时自动下载对应模型包
+    """
+    if os.path.exists(path):
+        return path
+    pack, filename = os.path.split(path)
+    from insightface.utils import storage
+    model_dir = storage.ensure_available('models', pack, root='~/.insightface')
+    return os.path.join(model_dir, filename)
+
+
+class _YoloBackend:
+    """
+    ultralytics YOLO（.pt 或导出的 .onnx 均可）
+    PyTorch 推理只能设置线程数；导出的 .onnx 由 ultralytics 自己创建会话，
+    需要完整的 onnxruntime 配置时请使用 'onnx' 后端
+    """
+    def __init__(self, model_path, input_size, conf_thresh, nms_thresh, runtime):
+        if runtime.intra_op_threads:
+            import torch
+            torch.set_num_threads(runtime.intra_op_threads)
+        from ultralytics import YOLO
         self.model = YOLO(model_path)
+        self.input_size = input_size
+        self.conf_thresh = conf_thresh
+        self.nms_thresh = nms_thresh
+
+    def detect(self, image):
+        results = self.model(image, imgsz=self.input_size, conf=self.conf_thresh,
+                             iou=self.nms_thresh, verbose=False)[0]
+        boxes = results.boxes.xyxy.cpu().numpy()
+        if hasattr(results, 'keypoints') and results.keypoints is not None:
+            kp = results.keypoints.cpu().numpy()
+            # keypoints 格式: [N, num_keypoints, 2] 或 [N, num_keypoints, 3]
+            # 提取前两个维度（x, y），忽略置信度
+            if kp.shape[-1] >= 2:
+                keypoints = kp[..., :2]  # 只取 x, y 坐标
+            else:
+                keypoints = kp
+        else:
+            keypoints = None
+        return boxes, keypoints
+
+
+class _OnnxBackend:
+    """
+    直接用 onnxruntime 运行 ultralytics 导出的 YOLOv8 人脸 ONNX 模型，不依赖 PyTorch
+    输出格式: [1, 4+1(+15), N]，即 cx,cy,w,h,score（可选 5 个关键点 x,y,conf）
+    """
+    def __init__(self, model_path, input_size, conf_thresh, nms_thresh, runtime):
+        self.session = runtime.create_session(model_path)
+        self.input_name = self.session.get_inputs()[0].name
+        self.input_size = input_size
+        self.conf_thresh = conf_thresh
+        self.nms_thresh = nms_thresh
+
+    def _letterbox(self, image):
+        h, w = image.shape[:2]
+        scale = min(self.input_size / h, self.input_size / w)
+        nh, nw = int(round(h * scale)), int(round(w * scale))
+        pad_y, pad_x = (self.input_size - nh) // 2, (self.input_size - nw) // 2
+        canvas = np.full((self.input_size, self.input_size, 3), 114, dtype=np.uint8)
+        canvas[pad_y:pad_y + nh, pad_x:pad_x + nw] = cv2.resize(image, (nw, nh), interpolation=cv2.INTER_LINEAR)
+        blob = cv2.dnn.blobFromImage(canvas, 1.0 / 255, swapRB=True)
+        return blob, scale, pad_x, pad_y
+
+    def detect(self, image):
+        blob, scale, pad_x, pad_y = self._letterbox(image)
+        pred = self.session.run(None, {self.input_name: blob})[0][0].T  # [N, C]
+        pred = pred[pred[:, 4] >= self.conf_thresh]
+        if len(pred) == 0:
+            return np.zeros((0, 4), dtype=np.float32), None
+
+        cx, cy, bw, bh = pred[:, 0], pred[:, 1], pred[:, 2], pred[:, 3]
+        boxes = np.stack([cx - bw / 2, cy - bh / 2, cx + bw / 2, cy + bh / 2], axis=1)
+        keep = cv2.dnn.NMSBoxes(np.stack([boxes[:, 0], boxes[:, 1], bw, bh], axis=1).tolist(),
+                                pred[:, 4].tolist(), self.conf_thresh, self.nms_thresh)
+        keep = np.array(keep, dtype=int).reshape(-1)
+
+        boxes = boxes[keep]
+        boxes[:, [0, 2]] = (boxes[:, [0, 2]] - pad_x) / scale
+        boxes[:, [1, 3]] = (boxes[:, [1, 3]] - pad_y) / scale
+
+        keypoints = None
+        if pred.shape[1] >= 5 + 15:
+            kp = pred[keep, 5:5 + 15].reshape(-1, 5, 3)[..., :2]
+            keypoints = (kp - np.array([pad_x, pad_y])) / scale
+        return boxes.astype(np.float32), keypoints
+
+
+class _ScrfdBackend:
+    """InsightFace 的 SCRFD 检测器，同时输出 5 个关键点"""
+    def __init__(self, model_path, input_size, conf_thresh, nms_thresh, runtime):
+        from insightface.model_zoo.scrfd import SCRFD
+        model_file = _insightface_model_file(model_path)
+        self.model = SCRFD(model_file=model_file, session=runtime.create_session(model_file))
+        self.input_size = (input_size, input_size)
+        self.model.prepare(ctx_id=-1, input_size=self.input_size,
+                           det_thresh=conf_thresh, nms_thresh=nms_thresh)
+
+    def detect(self, image):
+        det, kpss = self.model.detect(image, input_size=self.input_size)
+        return det[:, :4], kpss
+
+
+BACKENDS = {
+    "yolo": _YoloBackend,
+    "onnx": _OnnxBackend,
+    "scrfd": _ScrfdBackend,
+}
+
+
+class FaceDetector:
+    def __init__(self, model_path=None, backend="yolo", input_size=640, conf_thresh=0.25, nms_thresh=0.45,
+                 max_side=None, runtime=None):
+        """
+        model_path: 模型路径，默认使用 DEFAULT_MODELS 中对应后端的模型
+        backend: 'yolo'（ultralytics）、'onnx'（onnxruntime 运行 YOLOv8 ONNX）或 'scrfd'（InsightFace）
+        input_size: 检测输入尺寸（正方形边长）
+        conf_thresh / nms_thresh: 置信度阈值和 NMS IoU 阈值
+        max_side: 检测前把图像长边缩小到该尺寸（如 640），结果再映射回原图坐标；None 表示不缩放
+        runtime: runtime.RuntimeConfig（线程数、图优化等），默认使用全局配置
+        """
+        self.max_side = max_side
+        if backend not in BACKENDS:
+            raise ValueError(f"不支持的检测后端: {backend}，可选: {', '.join(BACKENDS)}")
+        self.backend_name = backend
+        self.model_path = model_path or DEFAULT_MODELS[backend]
+        self.backend = BACKENDS[backend](self.model_path, input_size, conf_thresh, nms_thresh,
+                                         runtime or get_config())
 
     def detect(self, image):
         """
@@ -12,25 +153,28 @@ class FaceDetector:
         输出: boxes, keypoints
         """
         try:
-            results = self.model(image)[0]
-            boxes = results.boxes.xyxy.cpu().numpy()
-            if hasattr(results, 'keypoints') and results.keypoints is not None:
-                kp = results.keypoints.cpu().numpy()
-                # keypoints 格式: [N, num_keypoints, 2] 或 [N, num_keypoints, 3]
-                # 提取前两个维度（x, y），忽略置信度
-                if kp.shape[-1] >= 2:
-                    keypoints = kp[..., :2]  # 只取 x, y 坐标
-                else:
-                    keypoints = kp
+            scale = 1.0
+            h, w = image.shape[:2]
+            if self.max_side and max(h, w) > self.max_side:
+                # 在缩小的副本上检测，对齐时仍从原图裁剪
+                scale = self.max_side / max(h, w)
+                small = cv2.resize(image, (max(1, int(round(w * scale))), max(1, int(round(h * scale)))),
+                                   interpolation=cv2.INTER_AREA)
+                boxes, keypoints = self.backend.detect(small)
             else:
-                keypoints = None
+                boxes, keypoints = self.backend.detect(image)
+            if scale != 1.0:
+                boxes = np.asarray(boxes, dtype=np.float32) / scale
+                if keypoints is not None:
+                    keypoints = np.asarray(keypoints, dtype=np.float32) / scale
             return boxes, keypoints
         except Exception as e:
-            print(f"人脸检测失败: {e}")
+            print(f"人脸检测失败: {e}", file=sys.stderr)
             import traceback
             traceback.print_exc()
             return np.array([]), None
 if __name__ == '__main__':
+    from ultralytics import YOLO
     model = YOLO("yolov8x-face-lindevs.pt")
     results = model("1.jpg")
     results[0].show()
@@ -0,0 +1,190 @@
+import copy
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp"}
+NO_FACE = "没有检测到人脸"
+
+# 工作进程内的检测器和对齐器（每个进程加载一次）
+_detector = None
+_aligner = None
+
+
+def collect_images(root):
+    """
+    遍历 root/姓名/*.jpg 目录结构
+    返回: [(姓名, 图片路径), ...]
+    """
+    items = []
+    for name in sorted(os.listdir(root)):
+        person_dir = os.path.join(root, name)
+        if not os.path.isdir(person_dir):
+            continue
+        for filename in sorted(os.listdir(person_dir)):
+            if os.path.splitext(filename)[1].lower() in IMAGE_EXTS:
+                items.append((name, os.path.join(person_dir, filename)))
+    return items
+
+
+def _init_worker(detector_kwargs, runtime_config):
+    global _detector, _aligner
+    # 每个进程只用一个 OpenCV 线程，并行度由进程数决定
+    cv2.setNumThreads(1)
+    if runtime_config is not None:
+        import runtime
+        runtime.configure(runtime_config)
+    from detector import FaceDetector
+    from aligner import FaceAligner
+    _detector = FaceDetector(**detector_kwargs)
+    _aligner = FaceAligner()
+
+
+def _detect_align(item):
+    """
+    工作进程: 读取图片、检测并对齐第一个人脸
+    返回: (姓名, 路径, 对齐后的人脸或 None, 错误信息)
+    """
+    name, path = item
+    try:
+        return _detect_align_file(name, path)
+    except Exception as e:
+        # 单张图片出错（无权限、文件被删除等）不影响整批注册
+        return name, path, None, f"处理失败: {e}"
+
+
+def _detect_align_file(name, path):
+    # imdecode 可以读取中文路径
+    img = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return name, path, None, "无法读取图片"
+    boxes, kps = _detector.detect(img)
+    if len(boxes) == 0:
+        return name, path, None, NO_FACE
+    kp = kps[0] if kps is not None and len(kps) > 0 else None
+    return name, path, _aligner.align(img, keypoints=kp, box=boxes[0]), None
+
+
+def enroll_directory(root, db, extractor, detector_kwargs=None, workers=None, chunk_size=256,
+                     threshold=0.85, append=False, dry_run=False, runtime_config=None):
+    """
+    批量注册目录中的人脸
+    检测和对齐在进程池中并行，特征按批提取；每个人的所有照片都作为该人的模板，
+    与库中其他人（包括本次已注册的人）相似度超过 threshold 的照片跳过；
+    每 chunk_size 张照片在一个事务中写入数据库
+    append: 库中已存在的姓名是否追加模板（默认跳过该人）
+    runtime_config: 检测进程使用的 runtime.RuntimeConfig（应按进程数分配线程）
+    返回: 统计 dict
+    """
+    items = collect_images(root)
+    existing = set(db.get_all_names())
+    if not append:
+        skipped_names = sorted({name for name, _ in items if name in existing})
+        for name in skipped_names:
+            print(f"跳过已注册人员: {name}（如需追加模板请使用 --append）")
+        items = [(name, path) for name, path in items if name not in existing]
+
+    stats = {"images": len(items), "inserted": 0, "no_face": 0, "failed": 0, "duplicate": 0}
+    # 在内存副本上做重复检查，写库前不影响数据库的人脸库缓存
+    gallery = copy.copy(db.get_gallery())
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(detector_kwargs or {}, runtime_config)) as pool:
+        results = pool.map(_detect_align, items, chunksize=8)
+        chunk = []
+        for result in results:
+            chunk.append(result)
+            if len(chunk) >= chunk_size:
+                _enroll_chunk(chunk, db, extractor, gallery, threshold, dry_run, stats)
+                chunk = []
+        _enroll_chunk(chunk, db, extractor, gallery, threshold, dry_run, stats)
+
+    stats["seconds"] = round(time.perf_counter() - start, 2)
+    return stats
+
+
+def _enroll_chunk(chunk, db, extractor, gallery, threshold, dry_run, stats):
+    faces = []
+    for name, path, aligned, error in chunk:
+        if aligned is None:
+            print(f"{path}: {error}")
+            stats["no_face" if error == NO_FACE else "failed"] += 1
+        else:
+            faces.append((name, path, aligned))
+    if not faces:
+        return
+
+    feats = extractor.extract_batch([aligned for _, _, aligned in faces])
+    labels, scores = gallery.search_batch(feats, top_k=1)
+    # 同一批内的照片互相比较，避免一批中两个不同姓名的同一人都被注册
+    sims = feats @ feats.T
+
+    records, accepted = [], []
+    for i, (name, path, _) in enumerate(faces):
+        if not feats[i].any():
+            print(f"{path}: 特征提取失败")
+            stats["failed"] += 1
+            continue
+        if labels[i] and labels[i][0] != name and scores[i][0] >= threshold:
+            print(f"{path}: 与已注册人员 '{labels[i][0]}' 非常相似（相似度：{scores[i][0]:.3f}），跳过")
+            stats["duplicate"] += 1
+            continue
+        clash = [j for j in accepted if faces[j][0] != name and sims[i, j] >= threshold]
+        if clash:
+            j = clash[0]
+            print(f"{path}: 与本次注册的 '{faces[j][0]}' 非常相似（相似度：{sims[i, j]:.3f}），跳过")
+            stats["duplicate"] += 1
+            continue
+        accepted.append(i)
+        records.append((name, feats[i]))
+
+    if records:
+        gallery.add_batch([name for name, _ in records], [feature for _, feature in records])
+    if not dry_run:
+        db.add_many(records)
+    stats["inserted"] += len(records)
+    done = stats['inserted'] + stats['no_face'] + stats['failed'] + stats['duplicate']
+    print(f"已处理 {done}/{stats['images']} 张，"
+          f"注册 {stats['inserted']} 张")
+
+
+if __name__ == '__main__':
+    import argparse
+    import runtime
+    from database import FaceDatabase
+    from extractor import FeatureExtractor
+
+    parser = argparse.ArgumentParser(description="批量注册人脸：目录结构为 <dir>/姓名/*.jpg")
+    parser.add_argument("dir", help="照片根目录")
+    parser.add_argument("--workers", type=int, default=None, help="检测进程数，默认 CPU 核数减 1（留给主进程提取特征）")
+    parser.add_argument("--chunk-size", type=int, default=256, help="每个事务写入的照片数")
+    parser.add_argument("--threshold", type=float, default=0.85, help="重复人脸判定阈值")
+    parser.add_argument("--append", action="store_true", help="已注册的姓名追加模板，而不是跳过")
+    parser.add_argument("--backend", default="yolo", help="检测后端: yolo / onnx / scrfd")
+    parser.add_argument("--model", default=None, help="检测模型路径，默认使用后端的默认模型")
+    parser.add_argument("--max-side", type=int, default=1280, help="检测前把图像长边缩小到该尺寸")
+    parser.add_argument("--dry-run", action="store_true", help="只检查，不写入数据库")
+    runtime.add_arguments(parser)
+    args = parser.parse_args()
+
+    # 检测进程与主进程的特征提取同时运行：主进程也算一份，按 (检测进程数 + 1) 分配线程，
+    # 分剩的核都给主进程，总线程数不超过 CPU 核数
+    cpus = os.cpu_count() or 1
+    workers = args.workers or max(1, cpus - 1)
+    worker_threads = runtime.threads_per_worker(workers + 1)
+    runtime.configure(runtime.from_args(args, default_threads=max(1, cpus - workers * worker_threads)))
+    worker_config = runtime.from_args(args, default_threads=worker_threads)
+    db = FaceDatabase()
+    extractor = FeatureExtractor()
+    detector_kwargs = {"model_path": args.model, "backend": args.backend, "max_side": args.max_side}
+    stats = enroll_directory(args.dir, db, extractor, detector_kwargs=detector_kwargs, workers=workers,
+                             chunk_size=args.chunk_size, threshold=args.threshold, append=args.append,
+                             dry_run=args.dry_run, runtime_config=worker_config)
+    print(f"完成: 共 {stats['images']} 张，注册 {stats['inserted']} 张，"
+          f"未检测到人脸 {stats['no_face']} 张，读取/处理失败 {stats['failed']} 张，"
+          f"疑似重复 {stats['duplicate']} 张，耗时 {stats['seconds']} 秒")
+    db.close()
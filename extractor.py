@@ -1,19 +1,116 @@
+import glob
+import os
 import insightface
+import numpy as np
+
+from runtime import get_config
+
+# 各模型包中的识别模型文件
+RECOGNITION_MODELS = {
+    "buffalo_l": "w600k_r50.onnx",
+    "buffalo_m": "w600k_r50.onnx",
+    "buffalo_s": "w600k_mbf.onnx",
+    "buffalo_sc": "w600k_mbf.onnx",
+    "antelopev2": "glintr100.onnx",
+}
+
+
+def load_recognition_model(model_name="buffalo_l", ctx_id=-1, runtime=None):
+    """
+    只加载模型包中的识别模型（ArcFaceONNX），不加载检测/关键点/性别年龄模型
+    模型包不在本地时自动下载
+    runtime: runtime.RuntimeConfig，默认使用全局配置
+    """
+    from insightface.model_zoo import model_zoo
+    from insightface.model_zoo.arcface_onnx import ArcFaceONNX
+    from insightface.utils import storage
+    model_dir = storage.ensure_available('models', model_name, root='~/.insightface')
+    model_file = os.path.join(model_dir, RECOGNITION_MODELS.get(model_name, ""))
+    if not os.path.isfile(model_file):
+        # 未知的模型包：逐个检查，取第一个识别模型
+        model_file = None
+        for onnx_file in sorted(glob.glob(os.path.join(model_dir, '*.onnx'))):
+            model = model_zoo.get_model(onnx_file)
+            if model is not None and model.taskname == 'recognition':
+                model_file = onnx_file
+                break
+        if model_file is None:
+            raise RuntimeError(f"模型包 {model_name} 中没有识别模型")
+    session = (runtime or get_config()).create_session(model_file)
+    model = ArcFaceONNX(model_file=model_file, session=session)
+    model.prepare(ctx_id)
+    return model
+
 
 class FeatureExtractor:
-    def __init__(self, model_name="buffalo_l", ctx_id=-1, det_size=(320,320)):
+    def __init__(self, model_name="buffalo_l", ctx_id=-1, det_size=(320,320), rec_only=True,
+                 max_batch_size=32, runtime=None):
         """
         ctx_id=-1 表示 CPU
+        rec_only=True 表示对齐后的人脸直接送入识别模型（ArcFace），
+        不再经过 InsightFace 内部的检测/关键点/性别年龄模型
+        max_batch_size: extract_batch 单次推理的最大人脸数
+        runtime: runtime.RuntimeConfig（线程数、图优化等），默认使用全局配置
         """
-        self.model = insightface.app.FaceAnalysis(name=model_name)
-        self.model.prepare(ctx_id=ctx_id, det_size=det_size)
+        self.rec_only = rec_only
+        self.max_batch_size = max_batch_size
+        if rec_only:
+            # 只加载识别模型，启动更快、占用内存更少
+            self.model = None
+            self.rec_model = load_recognition_model(model_name, ctx_id, runtime)
+        else:
+            self.model = insightface.app.FaceAnalysis(name=model_name)
+            # FaceAnalysis 不支持传入 SessionOptions，按统一配置重建各子模型的会话
+            config = runtime or get_config()
+            for sub_model in self.model.models.values():
+                sub_model.session = config.create_session(sub_model.model_file)
+            self.model.prepare(ctx_id=ctx_id, det_size=det_size)
+            # 识别子模型（ArcFaceONNX），输入为 112x112 对齐人脸
+            self.rec_model = self.model.models['recognition']
+        self.feature_dim = self.rec_model.session.get_outputs()[0].shape[-1]
 
     def extract(self, face_img):
         """
         输入: 对齐后的 BGR 人脸图像
-        输出: 128/512维特征向量
+        输出: 128/512维特征向量（已归一化）
         """
+        if self.rec_only:
+            feat = self.rec_model.get_feat(face_img).flatten().astype(np.float32)
+            norm = np.linalg.norm(feat)
+            if norm == 0:
+                return None
+            return feat / norm
         faces = self.model.get(face_img)
         if len(faces) == 0:
             return None
         return faces[0].normed_embedding
+
+    def extract_batch(self, face_imgs, batch_size=None):
+        """
+        批量提取特征
+        输入: N 张对齐后的 BGR 人脸图像（列表或 [N,112,112,3] 数组）
+        输出: [N, 512] float32 特征矩阵（已归一化）
+        每 batch_size 张人脸合成一个 NCHW 张量，只调用一次识别模型
+        rec_only=False 时逐张提取，提取失败的行为全零向量
+        """
+        batch_size = batch_size or self.max_batch_size
+        n = len(face_imgs)
+        feats = np.zeros((n, self.feature_dim), dtype=np.float32)
+        if n == 0:
+            return feats
+
+        if not self.rec_only:
+            for i, face_img in enumerate(face_imgs):
+                fea = self.extract(face_img)
+                if fea is not None:
+                    feats[i] = fea
+            return feats
+
+        for start in range(0, n, batch_size):
+            chunk = [face_imgs[i] for i in range(start, min(start + batch_size, n))]
+            # get_feat 内部用 blobFromImages 把整批图像拼成一个 NCHW 张量
+            feats[start:start + len(chunk)] = self.rec_model.get_feat(chunk)
+
+        norms = np.linalg.norm(feats, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return feats / norms
@@ -0,0 +1,236 @@
+import json
+import os
+import numpy as np
+
+from matcher import GalleryIndex, QuantizedGalleryIndex
+
+
+def _truncate_partial_line(path, chunk=4096):
+    """
+    截掉文件末尾没有换行符的半行（上次写入中断留下的）
+    否则下一次追加会接在半行后面，拼成一行错误的记录
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            start = max(0, pos - chunk)
+            f.seek(start)
+            i = f.read(pos - start).rfind(b"\n")
+            if i >= 0:
+                pos = start + i + 1
+                break
+            pos = start
+        if pos != end:
+            f.truncate(pos)
+
+
+class MmapFeatureStore:
+    """
+    本地内存映射特征库，可替代 MySQL BLOB 存储
+    目录结构（<g> 为 meta.json 中的代数 generation，第 0 代不带后缀，兼容旧目录）:
+        meta.json         特征维度和当前代数
+        features.<g>.f32  [capacity, dim] float32 矩阵（内存映射，按需倍增扩容）
+        labels.<g>.txt    每行一个姓名，行号即特征行号（只追加）
+        deleted.<g>.txt   被删除（墓碑）的行号，每行一个（只追加）
+    写入顺序为先特征后姓名，进程中断时最多丢失最后一条未写完的记录（没有换行符的末行读取时忽略，
+    写入进程下一次追加前截掉）
+    compact 先完整写出下一代文件，再原子替换 meta.json 切换代数；中途崩溃时 meta.json 仍指向旧一代，
+    不属于当前代的文件一律忽略，由下一次 compact 清理
+    只支持一个写入进程；其他只读进程通过 get_gallery() 自动发现文件变化
+    """
+    def __init__(self, path, dim=512, initial_capacity=1024, quantization=None):
+        """
+        quantization: 'int8' / 'float16' 时 get_gallery() 返回 QuantizedGalleryIndex，
+        常驻内存的只有量化矩阵，精排只读取内存映射文件中的候选行
+        """
+        self.path = path
+        self.quantization = quantization
+        os.makedirs(path, exist_ok=True)
+        self.meta_file = os.path.join(path, "meta.json")
+        if os.path.exists(self.meta_file):
+            with open(self.meta_file, encoding="utf-8") as f:
+                dim = json.load(f)["dim"]
+        else:
+            self._write_meta(dim, 0)
+        self.dim = dim
+        self.initial_capacity = initial_capacity
+        self._gallery = None
+        self._load()
+
+    def _write_meta(self, dim, generation):
+        """先写临时文件再替换，meta.json 的切换是原子的"""
+        tmp = self.meta_file + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"dim": dim, "generation": generation}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.meta_file)
+
+    def _files(self, generation):
+        """指定代数的 (特征文件, 姓名文件, 墓碑文件)"""
+        suffix = f".{generation}" if generation else ""
+        return (os.path.join(self.path, f"features{suffix}.f32"),
+                os.path.join(self.path, f"labels{suffix}.txt"),
+                os.path.join(self.path, f"deleted{suffix}.txt"))
+
+    def _load(self):
+        """从磁盘读取当前代的姓名和墓碑，映射特征文件"""
+        # 先记下文件标记再读取：读取期间其他进程的写入会在下一次 get_gallery() 时被发现
+        self._disk_stamp = self._stamp()
+        with open(self.meta_file, encoding="utf-8") as f:
+            self.generation = json.load(f).get("generation", 0)
+        self.features_file, self.labels_file, self.deleted_file = self._files(self.generation)
+        self.labels = []
+        if os.path.exists(self.labels_file):
+            with open(self.labels_file, encoding="utf-8") as f:
+                # 写入进程可能正在追加，没有换行符的末行还没写完
+                self.labels = [line[:-1] for line in f if line.endswith("\n")]
+        self.deleted = np.zeros(len(self.labels), dtype=bool)
+        if os.path.exists(self.deleted_file):
+            with open(self.deleted_file, encoding="utf-8") as f:
+                for line in f:
+                    if line.endswith("\n") and int(line) < len(self.labels):
+                        self.deleted[int(line)] = True
+        if not os.path.exists(self.features_file):
+            self._resize_file(max(self.initial_capacity, len(self.labels)))
+        self._map()
+        self._gallery = None
+
+    def _map(self):
+        rows = os.path.getsize(self.features_file) // (self.dim * 4)
+        self.matrix = np.memmap(self.features_file, dtype=np.float32, mode="r+", shape=(rows, self.dim))
+
+    def _resize_file(self, rows):
+        with open(self.features_file, "ab") as f:
+            f.truncate(rows * self.dim * 4)
+
+    @property
+    def capacity(self):
+        return self.matrix.shape[0]
+
+    def __len__(self):
+        """有效（未删除）的特征条数"""
+        return int(len(self.labels) - self.deleted.sum())
+
+    def append_batch(self, labels, features):
+        """追加多条特征"""
+        features = np.asarray(features, dtype=np.float32).reshape(-1, self.dim)
+        labels = list(labels)
+        start, end = len(self.labels), len(self.labels) + len(labels)
+        if end > self.capacity:
+            # 容量不足时倍增扩容并重新映射
+            capacity = max(end, self.capacity * 2)
+            self.matrix.flush()
+            del self.matrix
+            self._resize_file(capacity)
+            self._map()
+        self.matrix[start:end] = features
+        self.matrix.flush()
+        _truncate_partial_line(self.labels_file)
+        with open(self.labels_file, "a", encoding="utf-8") as f:
+            for label in labels:
+                f.write(f"{label}\n")
+        self.labels.extend(labels)
+        self.deleted = np.concatenate([self.deleted, np.zeros(len(labels), dtype=bool)])
+        # 内存中的状态已包含本次写入
+        self._disk_stamp = self._stamp()
+        self._gallery = None
+
+    def append(self, label, feature):
+        self.append_batch([label], np.asarray(feature)[None, :])
+
+    def delete(self, label):
+        """
+        删除指定姓名的所有特征（只写墓碑，空间在 compact 时回收）
+        返回: 删除的条数
+        """
+        rows = [i for i, name in enumerate(self.labels) if name == label and not self.deleted[i]]
+        if rows:
+            _truncate_partial_line(self.deleted_file)
+            with open(self.deleted_file, "a", encoding="utf-8") as f:
+                for i in rows:
+                    f.write(f"{i}\n")
+            self.deleted[rows] = True
+            self._disk_stamp = self._stamp()
+            self._gallery = None
+        return len(rows)
+
+    def compact(self):
+        """回收被删除的行：写出下一代特征文件和姓名文件（没有墓碑），再切换 meta.json 中的代数"""
+        self._remove_stale_generations()
+        keep = np.flatnonzero(~self.deleted)
+        labels = [self.labels[i] for i in keep]
+        generation = self.generation + 1
+        features_file, labels_file, deleted_file = self._files(generation)
+        capacity = max(self.initial_capacity, len(labels))
+        out = np.memmap(features_file, dtype=np.float32, mode="w+", shape=(capacity, self.dim))
+        out[:len(labels)] = self.matrix[keep]
+        out.flush()
+        del out
+        with open(labels_file, "w", encoding="utf-8") as f:
+            for label in labels:
+                f.write(f"{label}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(deleted_file):
+            os.remove(deleted_file)
+        # 提交点：meta.json 指向新一代之前崩溃，旧一代文件仍然完整有效
+        self._write_meta(self.dim, generation)
+        del self.matrix
+        self._load()
+        self._remove_stale_generations()
+
+    def _remove_stale_generations(self):
+        """删除不属于当前代的文件（上次 compact 留下的旧文件或中途崩溃的半成品）"""
+        current = set(self._files(self.generation))
+        for filename in os.listdir(self.path):
+            full = os.path.join(self.path, filename)
+            if full in current or not filename.startswith(("features", "labels", "deleted")):
+                continue
+            try:
+                os.remove(full)
+            except OSError:
+                # Windows 上其他进程仍映射着旧文件时无法删除，下次再清理
+                pass
+
+    def _stamp(self):
+        """文件变化标记，用于发现其他进程的写入（meta.json 变化说明已切换到新一代）"""
+        with open(self.meta_file, encoding="utf-8") as f:
+            generation = json.load(f).get("generation", 0)
+        stamp = [generation]
+        for p in self._files(generation):
+            st = os.stat(p) if os.path.exists(p) else None
+            stamp.append((st.st_size, st.st_mtime_ns) if st else None)
+        return tuple(stamp)
+
+    def get_gallery(self):
+        """
+        获取人脸库索引（与 FaceDatabase.get_gallery 接口相同）
+        特征矩阵直接引用内存映射文件，不复制；被删除的行通过 valid 掩码排除
+        磁盘上的文件与上次读取时不同（其他进程写入过）时先重新读取
+        """
+        if self._stamp() != self._disk_stamp:
+            self._load()
+        if self._gallery is None:
+            n = len(self.labels)
+            self._gallery = GalleryIndex(self.labels, self.matrix[:n], dim=self.dim,
+                                         valid=~self.deleted if self.deleted.any() else None)
+            if self.quantization:
+                self._gallery = QuantizedGalleryIndex(self._gallery, mode=self.quantization, keep_float=True)
+        return self._gallery
+
+    @classmethod
+    def from_database(cls, db, path, dim=512):
+        """把 face_features 表导出为本地特征库（同名的多条特征全部导出）"""
+        store = cls(path, dim=dim)
+        labels, features = [], []
+        for name, value in db.load_all().items():
+            for fea in (value if isinstance(value, list) else [value]):
+                labels.append(name)
+                features.append(fea)
+        if features:
+            store.append_batch(labels, np.stack(features))
+        return store
@@ -1,5 +1,390 @@
 import numpy as np
 
+
+def _normalize_rows(x):
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return x / norms
+
+
+def _object_array(values):
+    """转换为一维 object 数组（不会把元组等标签拆成多维）"""
+    values = list(values)
+    out = np.empty(len(values), dtype=object)
+    out[:] = values
+    return out
+
+
+def dedupe_labels(labels, scores, top_k):
+    """
+    同一人有多个模板时，按相似度从高到低保留每个姓名第一次出现的结果（即取最大值）
+    labels: M 个已排序的姓名列表；scores: 与之对应的相似度
+    返回: (labels, scores)，scores 为 [M, top_k] 矩阵，不足的位置补 -1
+    """
+    out_labels = []
+    out_scores = np.full((len(labels), top_k), -1.0, dtype=np.float32)
+    for i, (row_labels, row_scores) in enumerate(zip(labels, scores)):
+        seen = []
+        for label, score in zip(row_labels, row_scores):
+            if label in seen or not np.isfinite(score):
+                continue
+            out_scores[i, len(seen)] = score
+            seen.append(label)
+            if len(seen) == top_k:
+                break
+        out_labels.append(seen)
+    return out_labels, out_scores
+
+
+class GalleryIndex:
+    """
+    内存中的人脸库索引
+    特征保存为连续的 [N, dim] float32 矩阵，labels 为与之平行的姓名数组，
+    一次矩阵乘法即可完成所有比对
+    同一姓名可以有多个模板（不同光照/角度的注册照），按人聚合相似度:
+        aggregate='max'       取该人所有模板中的最大相似度
+        aggregate='mean_topk' 取该人最相似的 top_templates 个模板的平均值
+    centroid_candidates: 设置后先用每人的模板均值（中心）粗筛出这么多人，再只比对这些人的全部模板
+    valid: 可选的布尔掩码，False 的行（如已删除的特征）不参与匹配
+    """
+    def __init__(self, labels=None, features=None, dim=512, valid=None,
+                 aggregate="max", top_templates=3, centroid_candidates=None):
+        if aggregate not in ("max", "mean_topk"):
+            raise ValueError(f"不支持的聚合方式: {aggregate}")
+        labels = [] if labels is None else list(labels)
+        if features is None or len(labels) == 0:
+            features = np.zeros((0, dim), dtype=np.float32)
+        self.labels = np.array(labels, dtype=object)
+        self.matrix = np.ascontiguousarray(np.asarray(features, dtype=np.float32).reshape(len(labels), -1)
+                                           if labels else features)
+        self.dim = self.matrix.shape[1]
+        self.valid = None if valid is None else np.asarray(valid, dtype=bool)
+        self.aggregate = aggregate
+        self.top_templates = top_templates
+        self.centroid_candidates = centroid_candidates
+        self._groups = None
+
+    @classmethod
+    def from_dict(cls, database, dim=512, **kwargs):
+        """database: {'name': vector 或 [vector, ...], ...}，同名的多个模板全部保留"""
+        labels, features = [], []
+        for name, value in database.items():
+            for fea in (value if isinstance(value, list) else [value]):
+                labels.append(name)
+                features.append(np.asarray(fea, dtype=np.float32))
+        return cls(labels, np.stack(features) if features else None, dim=dim, **kwargs)
+
+    def __len__(self):
+        if self.valid is not None:
+            return int(self.valid.sum())
+        return len(self.labels)
+
+    @property
+    def num_identities(self):
+        return len(self._get_groups()['identities'])
+
+    def add(self, label, feature):
+        """追加一条特征（同名时作为该人的新模板）"""
+        self.add_batch([label], [feature])
+
+    def add_batch(self, labels, features):
+        """
+        一次追加多条特征，只复制一次矩阵
+        逐条 add 每次都复制整个矩阵，批量注册时耗时随条数平方增长
+        """
+        labels = _object_array(labels)
+        if not len(labels):
+            return
+        features = np.asarray(features, dtype=np.float32).reshape(len(labels), self.dim)
+        self.matrix = np.ascontiguousarray(np.vstack([self.matrix, features]))
+        self.labels = np.concatenate([self.labels, labels])
+        if self.valid is not None:
+            self.valid = np.concatenate([self.valid, np.ones(len(labels), dtype=bool)])
+        self._groups = None
+
+    def remove(self, label):
+        """
+        删除指定姓名的所有特征
+        返回: 删除的条数
+        """
+        keep = self.labels != label
+        if self.valid is not None:
+            keep |= ~self.valid
+        removed = int(len(self.labels) - keep.sum())
+        if removed:
+            self.matrix = np.ascontiguousarray(self.matrix[keep])
+            self.labels = self.labels[keep]
+            if self.valid is not None:
+                self.valid = self.valid[keep]
+            self._groups = None
+        return removed
+
+    def _get_groups(self):
+        """
+        按姓名分组模板（缓存，增删后重建）
+        rows: 按人排序后的有效行号，同一人的模板相邻；starts / counts: 每人在 rows 中的起点和模板数
+        人按首次出现的顺序编号，特征本来就按人相邻存放（如 from_dict）时 rows 即 0..N-1，匹配时不必重排列
+        """
+        if self._groups is not None:
+            return self._groups
+        rows = np.arange(len(self.labels)) if self.valid is None else np.flatnonzero(self.valid)
+        _, first, ids = np.unique(self.labels[rows].astype(str), return_index=True, return_inverse=True)
+        rank = np.empty(len(first), dtype=np.int64)
+        rank[np.argsort(first, kind="stable")] = np.arange(len(first))
+        ids = rank[ids.reshape(-1)]
+        order = np.argsort(ids, kind="stable")
+        rows, ids = rows[order], ids[order]
+        counts = np.bincount(ids, minlength=len(first))
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+
+        centroids = None
+        if self.centroid_candidates and len(first):
+            sums = np.add.reduceat(np.asarray(self.matrix[rows], dtype=np.float32), starts, axis=0)
+            centroids = np.ascontiguousarray(_normalize_rows(sums).astype(np.float32))
+
+        # 保持姓名原始类型（例如非字符串标签）
+        identities = self.labels[rows[starts]] if len(rows) else np.zeros(0, dtype=object)
+        contiguous = len(rows) == len(self.labels) and np.array_equal(rows, np.arange(len(rows)))
+        self._groups = {'identities': identities, 'rows': rows, 'starts': starts, 'counts': counts,
+                        'contiguous': contiguous, 'centroids': centroids}
+        return self._groups
+
+    def _aggregate(self, sims, starts, counts):
+        """
+        sims: [R, L] 模板相似度，同一人的模板在最后一维上相邻（第 j 人为 starts[j] 起的 counts[j] 列）
+        返回: [R, P] 每人的聚合相似度
+        直接在扁平矩阵上按段归约，不按最大模板数补齐，一个人模板很多不会拖慢其他人
+        """
+        if self.aggregate == "max" or counts.max() == 1:
+            return np.maximum.reduceat(sims, starts, axis=1)
+        t = self.top_templates
+        # 模板数不超过 t 的人直接求平均
+        person = np.add.reduceat(sims, starts, axis=1) / counts
+        big = np.flatnonzero(counts > t)
+        if len(big):
+            # 模板数超过 t 的人：只取出这些列，按（人, 相似度降序）排序后取每段前 t 个
+            lengths = counts[big]
+            offsets = np.cumsum(lengths) - lengths
+            cols = np.repeat(starts[big] - offsets, lengths) + np.arange(lengths.sum())
+            seg = np.repeat(np.arange(len(big)), lengths).astype(np.float64)
+            # 相似度在 [-1, 1] 内，段号乘 4 后各段的键互不重叠
+            keys = np.sort(seg * 4 - sims[:, cols], axis=1)
+            take = offsets[:, None] + np.arange(t)                       # [B, t]
+            person[:, big] = (seg[take] * 4 - keys[:, take]).mean(axis=-1)
+        return person
+
+    def search(self, probe, top_k=1):
+        """
+        probe: 单个特征向量
+        输出: (labels, scores)，按相似度从高到低排列
+        """
+        labels, scores = self.search_batch(np.asarray(probe)[None, :], top_k=top_k)
+        return labels[0], scores[0]
+
+    def search_batch(self, probes, top_k=1):
+        """
+        probes: [M, dim] 特征矩阵
+        输出: (labels, scores)
+            labels: M 个列表，每个列表含 top_k 个姓名（每人只出现一次）
+            scores: [M, top_k] 按人聚合后的相似度矩阵
+        """
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.dim)
+        m = probes.shape[0]
+        groups = self._get_groups() if len(self) else None
+        if groups is None or len(groups['identities']) == 0:
+            return [[] for _ in range(m)], np.zeros((m, 0), dtype=np.float32)
+        identities, rows, starts, counts = groups['identities'], groups['rows'], groups['starts'], groups['counts']
+
+        if groups['centroids'] is not None and self.centroid_candidates < len(identities):
+            # 先用每人的中心粗筛，再只比对候选人的全部模板（按实际模板数展开，不补齐）
+            c = self.centroid_candidates
+            cand = np.argpartition(-(probes @ groups['centroids'].T), c - 1, axis=1)[:, :c]
+            flat = cand.ravel()                                       # [M*C]
+            lengths = counts[flat]
+            offsets = np.cumsum(lengths) - lengths
+            pos = np.repeat(starts[flat] - offsets, lengths) + np.arange(lengths.sum())
+            probe_idx = np.repeat(np.arange(m), lengths.reshape(m, c).sum(axis=1))
+            sims = np.einsum('id,id->i', probes[probe_idx], np.asarray(self.matrix[rows[pos]], dtype=np.float32))
+            person = self._aggregate(sims[None, :], offsets, lengths).reshape(m, c)   # [M, C]
+        else:
+            cand = None
+            sims = probes @ self.matrix.T                             # [M, N]
+            if not groups['contiguous']:
+                sims = sims[:, rows]
+            person = self._aggregate(sims, starts, counts)            # [M, P]
+
+        k = min(top_k, person.shape[1])
+        if k < person.shape[1]:
+            idx = np.argpartition(-person, k - 1, axis=1)[:, :k]
+        else:
+            idx = np.tile(np.arange(person.shape[1]), (m, 1))
+        top = np.take_along_axis(person, idx, axis=1)
+        order = np.argsort(-top, axis=1)
+        idx = np.take_along_axis(idx, order, axis=1)
+        scores = np.take_along_axis(top, order, axis=1).astype(np.float32)
+        if cand is not None:
+            idx = np.take_along_axis(cand, idx, axis=1)
+        return [list(identities[row]) for row in idx], scores
+
+
+class QuantizedGalleryIndex:
+    """
+    量化人脸库索引：常驻内存的只有 int8（每行一个缩放系数）或 float16 量化矩阵，
+    分别为 float32 的 1/4 和 1/2
+    粗排按 block_size 行分块，把量化块转换到一个复用的 float32 小缓冲区（留在 CPU 缓存中）后做矩阵乘法，
+    不会一次性反量化整个人脸库
+    速度: 人脸库远大于 CPU 缓存（约 10 万条以上）时匹配受内存带宽限制，int8 读取的数据只有 1/4，比 float32 更快；
+    小人脸库整个 float32 矩阵都在缓存中，int8 反而更慢（约 1.5 倍）
+    float16 只节省内存：NumPy 的 float16 转换没有硬件加速，比 float32 慢数倍
+    精排: float32 原始矩阵为内存映射文件（MmapFeatureStore）时保留它，只读取候选行精确重排，不占常驻内存；
+    否则（如数据库加载的人脸库）丢弃 float32 矩阵，返回量化后的近似相似度（int8 误差约 1e-3）
+    """
+    def __init__(self, gallery, mode="int8", rescore=32, block_size=256, keep_float=None):
+        """
+        gallery: GalleryIndex（提供 labels / matrix / valid）
+        mode: 'int8' 或 'float16'
+        rescore: 精确重排的候选数量（保留 float32 矩阵时有效）
+        block_size: 粗排时每次转换的行数
+        keep_float: 是否保留 float32 矩阵用于精排，默认只在它是 np.memmap 时保留
+                    （MmapFeatureStore 显式传 True）
+        """
+        if mode not in ("int8", "float16"):
+            raise ValueError(f"不支持的量化方式: {mode}")
+        self.mode = mode
+        self.rescore = rescore
+        self.block_size = block_size
+        self.labels = gallery.labels
+        self.valid = gallery.valid
+        self.dim = gallery.dim
+        self.codes, self.scales = self._quantize(np.asarray(gallery.matrix, dtype=np.float32))
+        if keep_float is None:
+            keep_float = isinstance(gallery.matrix, np.memmap)
+        self.matrix = gallery.matrix if keep_float else None
+
+    @classmethod
+    def from_dict(cls, database, dim=512, mode="int8", **kwargs):
+        """database: {'name': vector 或 [vector, ...], ...}；float32 矩阵只在构建期间临时存在"""
+        return cls(GalleryIndex.from_dict(database, dim=dim), mode=mode, **kwargs)
+
+    def _quantize(self, features):
+        if self.mode == "float16":
+            return features.astype(np.float16), None
+        # 对称量化：每行按最大绝对值缩放到 [-127, 127]
+        max_abs = np.abs(features).max(axis=1) if len(features) else np.zeros(0, dtype=np.float32)
+        scales = np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+        return np.round(features / scales[:, None]).astype(np.int8), scales
+
+    def _dequantize(self, rows):
+        vectors = self.codes[rows].astype(np.float32)
+        if self.scales is not None:
+            vectors *= self.scales[rows][..., None]
+        return vectors
+
+    def __len__(self):
+        if self.valid is not None:
+            return int(self.valid.sum())
+        return len(self.labels)
+
+    @property
+    def nbytes(self):
+        """量化矩阵（常驻内存部分）占用的字节数"""
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def add(self, label, feature):
+        """追加一条特征（同名时作为该人的新模板）"""
+        self.add_batch([label], [feature])
+
+    def add_batch(self, labels, features):
+        """一次追加多条特征，量化矩阵只复制一次"""
+        labels = _object_array(labels)
+        if not len(labels):
+            return
+        features = np.asarray(features, dtype=np.float32).reshape(len(labels), self.dim)
+        codes, scales = self._quantize(features)
+        self.codes = np.vstack([self.codes, codes])
+        if scales is not None:
+            self.scales = np.concatenate([self.scales, scales])
+        if self.matrix is not None:
+            self.matrix = np.vstack([self.matrix, features])
+        self.labels = np.concatenate([self.labels, labels])
+        if self.valid is not None:
+            self.valid = np.concatenate([self.valid, np.ones(len(labels), dtype=bool)])
+
+    def remove(self, label):
+        """
+        删除指定姓名的所有特征
+        返回: 删除的条数
+        """
+        keep = self.labels != label
+        if self.valid is not None:
+            keep |= ~self.valid
+        removed = int(len(self.labels) - keep.sum())
+        if removed:
+            self.codes = self.codes[keep]
+            if self.scales is not None:
+                self.scales = self.scales[keep]
+            if self.matrix is not None:
+                self.matrix = np.asarray(self.matrix)[keep]
+            self.labels = self.labels[keep]
+            if self.valid is not None:
+                self.valid = self.valid[keep]
+        return removed
+
+    def _approx_scores(self, probes):
+        """分块计算近似相似度 [M, N]，每块转换到同一个 float32 缓冲区"""
+        n = len(self.labels)
+        sims = np.empty((probes.shape[0], n), dtype=np.float32)
+        buffer = np.empty((min(self.block_size, n), self.dim), dtype=np.float32)
+        for start in range(0, n, self.block_size):
+            end = min(start + self.block_size, n)
+            block = buffer[:end - start]
+            block[...] = self.codes[start:end]
+            np.matmul(probes, block.T, out=sims[:, start:end])
+        if self.scales is not None:
+            sims *= self.scales
+        if self.valid is not None:
+            sims[:, ~self.valid] = -np.inf
+        return sims
+
+    def search(self, probe, top_k=1):
+        labels, scores = self.search_batch(np.asarray(probe)[None, :], top_k=top_k)
+        return labels[0], scores[0]
+
+    def search_batch(self, probes, top_k=1):
+        """
+        probes: [M, dim] 特征矩阵
+        输出: (labels, scores)，与 GalleryIndex.search_batch 相同；
+        保留 float32 矩阵时 scores 为精确相似度，否则为量化后的近似相似度
+        """
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.dim)
+        m = probes.shape[0]
+        k = min(top_k, len(self))
+        if k == 0:
+            return [[] for _ in range(m)], np.zeros((m, 0), dtype=np.float32)
+
+        # 粗排：量化矩阵上取候选（同一人可能有多个模板，多取一些）
+        approx = self._approx_scores(probes)
+        r = min(max(self.rescore, k * 4), len(self))
+        if r < approx.shape[1]:
+            cand = np.argpartition(-approx, r - 1, axis=1)[:, :r]
+        else:
+            cand = np.tile(np.arange(approx.shape[1]), (m, 1))
+
+        if self.matrix is not None:
+            # 精排：候选行用 float32 原始特征重新计算
+            scores = np.einsum('md,mrd->mr', probes,
+                               np.asarray(self.matrix[cand.ravel()]).reshape(m, -1, self.dim))
+            if self.valid is not None:
+                scores[~self.valid[cand]] = -np.inf
+        else:
+            scores = np.take_along_axis(approx, cand, axis=1)
+        order = np.argsort(-scores, axis=1)
+        idx = np.take_along_axis(cand, order, axis=1)
+        scores = np.take_along_axis(scores, order, axis=1).astype(np.float32)
+        # 同一人的多个模板取最大相似度
+        return dedupe_labels([list(self.labels[row]) for row in idx], scores, k)
+
+
 class FaceMatcher:
     def __init__(self, threshold=0.55):
         self.threshold = threshold
@@ -7,14 +392,23 @@ class FaceMatcher:
     def match(self, feature, database):
         """
         feature: 待匹配特征
-        database: {'name': vector, ...}
+        database: {'name': vector, ...}、GalleryIndex 或其他带 search_batch 的索引
         输出: label, similarity
         """
-        label = "Unknown"
-        max_sim = 0
-        for name, db_fea in database.items():
-            cos_sim = np.dot(feature, db_fea)
-            if cos_sim > self.threshold and cos_sim > max_sim:
-                max_sim = cos_sim
-                label = name
-        return label, max_sim
+        return self.match_batch(np.asarray(feature)[None, :], database)[0]
+
+    def match_batch(self, features, database):
+        """
+        features: [M, dim] 待匹配特征矩阵
+        database: {'name': vector, ...}、GalleryIndex 或其他带 search_batch 的索引（如 ann.IVFIndex）
+        输出: [(label, similarity), ...]，低于阈值的为 ("Unknown", 0)
+        """
+        gallery = database if hasattr(database, 'search_batch') else GalleryIndex.from_dict(database)
+        labels, scores = gallery.search_batch(features, top_k=1)
+        results = []
+        for row_labels, row_scores in zip(labels, scores):
+            if len(row_labels) > 0 and row_scores[0] > self.threshold:
+                results.append((row_labels[0], float(row_scores[0])))
+            else:
+                results.append(("Unknown", 0))
+        return results
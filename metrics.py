@@ -0,0 +1,220 @@
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 延迟直方图的桶上限（秒）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=None):
+    items = list(key) + (list(extra) if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in items) + "}"
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """按桶估计分位数（返回所在桶的上限）"""
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        total = 0
+        for upper, n in zip(self.buckets, self.counts):
+            total += n
+            if total >= target:
+                return upper
+        return float("inf")
+
+
+class MetricsRegistry:
+    """
+    进程内指标汇总：计数器、仪表和延迟直方图，线程安全
+    render() 输出 Prometheus 文本格式，snapshot() 输出 dict
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        """计数器加 value"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        """
+        设置仪表值
+        value 可以是数值，也可以是无参函数（每次输出时调用，如队列长度）
+        """
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = value
+
+    def remove_gauge(self, name, **labels):
+        with self._lock:
+            self._gauges.pop((name, _label_key(labels)), None)
+
+    def observe(self, name, seconds, **labels):
+        """记录一次耗时（秒）"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = _Histogram(self.buckets)
+            hist.observe(seconds)
+
+    @contextmanager
+    def span(self, name, **labels):
+        """
+        计时代码段: with metrics.span("pipeline_stage_seconds", stage="detect"): ...
+        出错时额外累加 <name 去掉 _seconds>_errors_total
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc(name.replace("_seconds", "") + "_errors_total", **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def _gauge_values(self):
+        with self._lock:
+            gauges = list(self._gauges.items())
+        values = []
+        for key, value in gauges:
+            try:
+                values.append((key, float(value() if callable(value) else value)))
+            except Exception:
+                continue
+        return values
+
+    def snapshot(self):
+        """当前所有指标（直方图给出次数、平均值和估计的 p50/p95/p99，单位毫秒）"""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (h.count, h.sum, h.quantile(0.5), h.quantile(0.95), h.quantile(0.99))
+                          for key, h in self._histograms.items()}
+
+        def name_of(key):
+            return key[0] + _format_labels(key[1])
+
+        result = {"counters": {name_of(k): v for k, v in counters.items()},
+                  "gauges": {name_of(k): v for k, v in self._gauge_values()},
+                  "histograms": {}}
+        for key, (count, total, p50, p95, p99) in histograms.items():
+            result["histograms"][name_of(key)] = {
+                "count": count,
+                "mean_ms": round(total / count * 1000, 3) if count else 0.0,
+                "p50_ms": p50 * 1000, "p95_ms": p95 * 1000, "p99_ms": p99 * 1000,
+            }
+        return result
+
+    def render(self):
+        """Prometheus 文本格式"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(h.counts), h.sum, h.count) for key, h in self._histograms.items())
+        gauges = sorted(self._gauge_values())
+
+        lines = []
+        typed = set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), value in gauges:
+            header(name, "gauge")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), counts, total, count in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for upper, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', upper)])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self):
+        """打印当前指标"""
+        print(self.render())
+
+
+# 默认的全局指标，各模块直接使用
+REGISTRY = MetricsRegistry()
+inc = REGISTRY.inc
+set_gauge = REGISTRY.set_gauge
+remove_gauge = REGISTRY.remove_gauge
+observe = REGISTRY.observe
+span = REGISTRY.span
+snapshot = REGISTRY.snapshot
+render = REGISTRY.render
+dump = REGISTRY.dump
+
+REGISTRY.describe("pipeline_stage_seconds", "识别流程各阶段耗时（detect/align/extract/match）")
+REGISTRY.describe("db_query_seconds", "数据库操作耗时（含取连接）")
+REGISTRY.describe("inference_queue_depth", "后台推理队列中等待的任务数")
+REGISTRY.describe("stream_frames_dropped_total", "视频流中未被处理就被新帧覆盖的帧数")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=9100, host="0.0.0.0", registry=None):
+    """在后台线程中启动 /metrics 端点，返回 HTTP 服务对象（shutdown() 停止）"""
+    httpd = ThreadingHTTPServer((host, port), _MetricsHandler)
+    httpd.daemon_threads = True
+    httpd.registry = registry or REGISTRY
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    print(f"指标端点已启动: http://{host}:{port}/metrics")
+    return httpd
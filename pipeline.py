@@ -0,0 +1,210 @@
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import metrics
+
+
+def draw_results(frame, results):
+    """在图像上画出识别结果（识别成功绿色框，Unknown 红色框）"""
+    for res in results:
+        x1, y1, x2, y2 = res['box'].astype(int)
+        name, sim = res['label'], res['score']
+        color = (0, 255, 0) if name != "Unknown" else (0, 0, 255)
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(frame, f"{name} ({sim:.2f})", (x1, y1 - 8),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
+    return frame
+
+
+class RecognitionPipeline:
+    """
+    检测 → 对齐 → 特征提取 → 匹配 的完整流程
+    不依赖界面，可以在后台线程中调用
+    """
+    def __init__(self, detector, aligner, extractor, matcher, db, gallery_source=None, attendance_sink=None):
+        """
+        gallery_source: 提供 get_gallery() 的人脸库来源，默认为 db；
+        可传入 feature_store.MmapFeatureStore 直接从本地特征文件匹配
+        attendance_sink: 考勤写入器（如 attendance.AttendanceWriter），默认直接同步写数据库
+        """
+        self.detector = detector
+        self.aligner = aligner
+        self.extractor = extractor
+        self.matcher = matcher
+        self.db = db
+        self.gallery_source = gallery_source or db
+        self.attendance_sink = attendance_sink
+        # 每个线程复用自己的对齐缓冲区（HTTP 服务会在多个线程中同时调用）
+        self._local = threading.local()
+
+    def is_ready(self):
+        """检测和特征提取模型是否都已加载（界面在后台加载模型时使用）"""
+        return self.detector is not None and self.extractor is not None
+
+    def recognize(self, frame, record_attendance=True, tracker=None, timings=None):
+        """
+        识别图像中的所有人脸
+        tracker: FaceTracker（视频流使用），已识别的轨迹直接复用缓存身份，不重复提取特征
+        timings: 传入 dict 时写入各阶段耗时（秒）: detect / align / embed / match（不使用 tracker 时）
+        返回: [{'box': box, 'label': 姓名, 'score': 相似度}, ...]
+        """
+        t0 = time.perf_counter()
+        boxes, kps = self.detector.detect(frame)
+        metrics.observe("pipeline_stage_seconds", time.perf_counter() - t0, stage="detect")
+        metrics.inc("pipeline_frames_total")
+        metrics.inc("pipeline_faces_detected_total", len(boxes))
+        if tracker is not None:
+            return self._recognize_tracked(frame, boxes, kps, tracker, record_attendance)
+        t1 = time.perf_counter()
+
+        # 先对齐所有人脸，再一次性批量提取特征
+        aligned_faces, aligned_idx = self._align_faces(frame, boxes, kps, range(len(boxes)))
+        face_boxes = [boxes[i] for i in aligned_idx]
+        t2 = time.perf_counter()
+        features = self.extractor.extract_batch(aligned_faces)
+        t3 = time.perf_counter()
+        # 所有人脸与人脸库的比对合并为一次矩阵乘法
+        gallery = self.gallery_source.get_gallery()
+        matches = self.matcher.match_batch(features, gallery) if len(features) > 0 else []
+        t4 = time.perf_counter()
+        metrics.observe("pipeline_stage_seconds", t2 - t1, stage="align")
+        metrics.observe("pipeline_stage_seconds", t3 - t2, stage="extract")
+        metrics.observe("pipeline_stage_seconds", t4 - t3, stage="match")
+        if timings is not None:
+            timings.update(detect=t1 - t0, align=t2 - t1, embed=t3 - t2, match=t4 - t3)
+
+        results = []
+        for box, fea, (name, sim) in zip(face_boxes, features, matches):
+            if not fea.any():
+                continue
+            results.append({'box': box, 'label': name, 'score': sim})
+
+            # 如果识别成功，记录考勤
+            metrics.inc("pipeline_faces_recognized_total", result="unknown" if name == "Unknown" else "known")
+            if record_attendance and name != "Unknown":
+                self._record_attendance(name)
+        return results
+
+    def _recognize_tracked(self, frame, boxes, kps, tracker, record_attendance):
+        """带跟踪的识别：只对新轨迹或需要复核的轨迹提取特征"""
+        tracks = tracker.update(boxes)
+
+        t0 = time.perf_counter()
+        need = [i for i, track in enumerate(tracks) if tracker.needs_embedding(track)]
+        aligned_faces, aligned_idx = self._align_faces(frame, boxes, kps, need)
+        pending = [tracks[i] for i in aligned_idx]
+
+        metrics.observe("pipeline_stage_seconds", time.perf_counter() - t0, stage="align")
+        # 复用缓存身份、跳过特征提取的人脸数
+        metrics.inc("tracker_embeddings_skipped_total", len(boxes) - len(pending))
+
+        if len(aligned_faces) > 0:
+            with metrics.span("pipeline_stage_seconds", stage="extract"):
+                features = self.extractor.extract_batch(aligned_faces)
+            with metrics.span("pipeline_stage_seconds", stage="match"):
+                matches = self.matcher.match_batch(features, self.gallery_source.get_gallery())
+            for track, fea, (name, sim) in zip(pending, features, matches):
+                if fea.any():
+                    tracker.set_identity(track, name, sim)
+
+        results = []
+        for box, track in zip(boxes, tracks):
+            if track.label is None:
+                continue
+            results.append({'box': box, 'label': track.label, 'score': track.score,
+                            'track_id': track.track_id})
+            # 同一条轨迹同一身份只记录一次考勤
+            if record_attendance and track.label != "Unknown" and track.attended_label != track.label:
+                track.attended_label = track.label
+                self._record_attendance(track.label)
+        return results
+
+    def _align_faces(self, frame, boxes, kps, indices):
+        """
+        对齐 indices 指定的人脸
+        所有人脸都有关键点时一次求出全部变换并写入复用的缓冲区，否则逐个对齐（无关键点时按框裁剪）
+        返回: (对齐后的人脸数组或列表, 成功对齐的人脸下标)
+        """
+        indices = list(indices)
+        if not indices:
+            return [], []
+        if kps is not None and len(kps) == len(boxes):
+            try:
+                aligned = self.aligner.align_batch(frame, np.asarray(kps)[indices],
+                                                   out=getattr(self._local, 'align_buffer', None))
+                # 缓冲区不够大时 align_batch 会新分配，保留新的缓冲区供下一帧使用
+                self._local.align_buffer = aligned.base if aligned.base is not None else aligned
+                return aligned, indices
+            except Exception as e:
+                print(f"批量对齐人脸时出错，改为逐个对齐: {e}", file=sys.stderr)
+
+        aligned_faces, aligned_idx = [], []
+        for i in indices:
+            try:
+                kp = kps[i] if kps is not None and i < len(kps) else None
+                aligned_faces.append(self.aligner.align(frame, keypoints=kp, box=boxes[i]))
+                aligned_idx.append(i)
+            except Exception as e:
+                print(f"对齐第 {i+1} 个人脸时出错: {e}", file=sys.stderr)
+        return aligned_faces, aligned_idx
+
+    def _record_attendance(self, name):
+        if self.attendance_sink is not None:
+            success, message = self.attendance_sink.record(name)
+        else:
+            success, message = self.db.add_attendance(name)
+        if success:
+            print(message)
+        else:
+            print(f"考勤记录: {message}")
+
+    def register(self, img, name, append_template=False):
+        """
+        注册人脸（取图像中的第一个人脸）
+        append_template: 为已注册人员追加一个新模板（如不同光照下的照片）
+        返回: (是否成功, 消息)
+        """
+        with metrics.span("register_stage_seconds", stage="detect"):
+            boxes, kps = self.detector.detect(img)
+        if len(boxes) == 0:
+            return False, "没有检测到人脸"
+
+        kp = kps[0] if kps is not None and len(kps) > 0 else None
+        with metrics.span("register_stage_seconds", stage="align"):
+            aligned = self.aligner.align(img, keypoints=kp, box=boxes[0])
+        with metrics.span("register_stage_seconds", stage="extract"):
+            feature = self.extractor.extract(aligned)
+
+        if feature is None:
+            return False, "特征提取失败"
+
+        # 检查是否已存在相同名字
+        name_exists = self.db.check_name_exists(name)
+        if append_template and not name_exists:
+            return False, f"名字 '{name}' 尚未注册，无法追加模板"
+        if name_exists and not append_template:
+            return False, f"警告：名字 '{name}' 已存在！\n如需更新，请使用不同的名字或修改数据库记录"
+
+        # 检查是否已存在相同人脸（通过特征相似度，与自己的其他模板相似不算重复）
+        with metrics.span("register_stage_seconds", stage="duplicate_check"):
+            similar = [(n, sim) for n, sim in self.db.find_similar_faces(feature, top_k=3, threshold=0.85)
+                       if n != name]
+        if similar:
+            matched_name, similarity = similar[0]
+            others = "、".join(f"'{n}'（{sim:.3f}）" for n, sim in similar[1:])
+            return False, (f"警告：检测到与已注册人员 '{matched_name}' 非常相似的人脸（相似度：{similarity:.3f}）\n"
+                           + (f"其他相似人员：{others}\n" if others else "")
+                           + f"请确认这是否是同一个人，如果是，请使用名字 '{matched_name}' 或更新该记录")
+
+        # 添加新记录
+        with metrics.span("register_stage_seconds", stage="insert"):
+            result = self.db.add(name, feature, append_template=append_template)
+        if result == "inserted":
+            if append_template:
+                return True, f"追加模板成功：{name}（共 {self.db.get_count_by_name(name)} 个模板）"
+            return True, f"注册成功：{name}"
+        return True, f"更新成功：{name}"
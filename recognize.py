@@ -0,0 +1,206 @@
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp"}
+CSV_FIELDS = ["file", "face", "x1", "y1", "x2", "y2", "label", "score",
+              "read_ms", "detect_ms", "align_ms", "embed_ms", "match_ms", "total_ms", "error"]
+
+# 工作进程内的识别流程（每个进程加载一次模型）
+_pipeline = None
+
+
+class _StaticGallery:
+    """把固定的人脸库包装成 RecognitionPipeline 需要的 gallery_source"""
+    def __init__(self, gallery):
+        self.gallery = gallery
+
+    def get_gallery(self):
+        return self.gallery
+
+
+def collect_files(patterns):
+    """
+    patterns: 目录（递归查找图片）或通配符（如 'snapshots/2024-*/*.jpg'）
+    返回: 排序后的图片路径列表
+    """
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for dirpath, _, filenames in os.walk(pattern):
+                files.extend(os.path.join(dirpath, f) for f in filenames
+                             if os.path.splitext(f)[1].lower() in IMAGE_EXTS)
+        else:
+            files.extend(f for f in glob.glob(pattern, recursive=True) if os.path.isfile(f))
+    return sorted(set(files))
+
+
+def _init_worker(detector_kwargs, threshold, gallery, store_path, runtime_config, quantization=None):
+    global _pipeline
+    # 结果只由主进程写出；工作进程中各模块和第三方库（模型加载日志等）的输出都改到标准错误，
+    # 避免混入输出到标准输出的 JSON Lines / CSV
+    sys.stdout = sys.stderr
+    cv2.setNumThreads(1)
+    if runtime_config is not None:
+        import runtime
+        runtime.configure(runtime_config)
+    from detector import FaceDetector
+    from aligner import FaceAligner
+    from extractor import FeatureExtractor
+    from matcher import FaceMatcher
+    from pipeline import RecognitionPipeline
+
+    if store_path:
+        # 本地特征库通过内存映射打开，多个进程共享同一份页缓存
+        from feature_store import MmapFeatureStore
+        source = MmapFeatureStore(store_path, quantization=quantization)
+    else:
+        source = _StaticGallery(gallery)
+    _pipeline = RecognitionPipeline(FaceDetector(**detector_kwargs), FaceAligner(), FeatureExtractor(),
+                                    FaceMatcher(threshold=threshold), db=None, gallery_source=source)
+
+
+def _recognize_file(path):
+    """
+    工作进程: 识别一张图片
+    返回: 每个人脸一行结果；读取失败、出错或没有人脸时返回一行 error
+    """
+    try:
+        return _recognize_file_rows(path)
+    except Exception as e:
+        # 单张图片出错不影响整批处理
+        return [{"file": path, "face": None, "box": None, "label": None, "score": None,
+                 "timings_ms": {}, "error": str(e)}]
+
+
+def _recognize_file_rows(path):
+    start = time.perf_counter()
+    img = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+    read = time.perf_counter() - start
+    if img is None:
+        return [{"file": path, "face": None, "box": None, "label": None, "score": None,
+                 "timings_ms": {"read": round(read * 1000, 2)}, "error": "无法读取图片"}]
+
+    timings = {}
+    results = _pipeline.recognize(img, record_attendance=False, timings=timings)
+    timings_ms = {"read": read * 1000}
+    timings_ms.update({k: v * 1000 for k, v in timings.items()})
+    timings_ms["total"] = (time.perf_counter() - start) * 1000
+    timings_ms = {k: round(v, 2) for k, v in timings_ms.items()}
+    if not results:
+        return [{"file": path, "face": None, "box": None, "label": None, "score": None,
+                 "timings_ms": timings_ms, "error": "没有检测到人脸"}]
+    return [{"file": path, "face": i, "box": [round(float(v), 1) for v in res['box']],
+             "label": res['label'], "score": round(float(res['score']), 4),
+             "timings_ms": timings_ms, "error": None}
+            for i, res in enumerate(results)]
+
+
+class _JsonlWriter:
+    def __init__(self, out):
+        self.out = out
+
+    def write(self, row):
+        self.out.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+
+class _CsvWriter:
+    def __init__(self, out):
+        self.writer = csv.DictWriter(out, fieldnames=CSV_FIELDS)
+        self.writer.writeheader()
+
+    def write(self, row):
+        flat = {"file": row["file"], "face": row["face"], "label": row["label"], "score": row["score"],
+                "error": row["error"]}
+        if row["box"] is not None:
+            flat.update(zip(("x1", "y1", "x2", "y2"), row["box"]))
+        for stage, ms in row["timings_ms"].items():
+            flat[f"{stage}_ms"] = ms
+        self.writer.writerow(flat)
+
+
+def recognize_files(files, out, fmt="jsonl", workers=None, detector_kwargs=None, threshold=0.55,
+                    gallery=None, store_path=None, runtime_config=None, quantization=None):
+    """
+    用多个进程识别图片，按输入顺序逐行输出结果
+    gallery: GalleryIndex（会复制到每个工作进程）；store_path: 本地特征库目录，二选一
+    runtime_config: 工作进程使用的 runtime.RuntimeConfig（应按进程数分配线程）
+    quantization: 使用 store_path 时的量化方式 'int8' / 'float16'（见 MmapFeatureStore）
+    返回: (图片数, 人脸数, 耗时秒)
+    """
+    writer = _CsvWriter(out) if fmt == "csv" else _JsonlWriter(out)
+    faces = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(detector_kwargs or {}, threshold, gallery, store_path,
+                                       runtime_config, quantization)) as pool:
+        for rows in pool.map(_recognize_file, files, chunksize=4):
+            for row in rows:
+                writer.write(row)
+                if row["error"] is None:
+                    faces += 1
+            out.flush()
+    return len(files), faces, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    import argparse
+    import runtime
+
+    parser = argparse.ArgumentParser(description="无界面批量识别图片，逐行输出每个人脸的结果")
+    parser.add_argument("inputs", nargs="+", help="图片目录（递归）或通配符")
+    parser.add_argument("--workers", type=int, default=None, help="工作进程数，默认 CPU 核数")
+    parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl", help="输出格式")
+    parser.add_argument("--out", default="-", help="输出文件，默认标准输出")
+    parser.add_argument("--threshold", type=float, default=0.55, help="识别相似度阈值")
+    parser.add_argument("--store", default=None, help="使用本地特征库目录（feature_store）代替数据库")
+    parser.add_argument("--index", choices=["exact", "ivf", "int8", "float16"], default="exact",
+                        help="人脸库索引: exact 精确 / ivf 近似（仅数据库）/ int8、float16 量化（内存更小）")
+    parser.add_argument("--ivf-path", default="gallery_ivf.npz", help="IVF 索引文件（--index ivf），过期时自动重建")
+    parser.add_argument("--ivf-min-size", type=int, default=10000, help="人脸库少于该条数时仍用精确搜索")
+    parser.add_argument("--backend", default="yolo", help="检测后端: yolo / onnx / scrfd")
+    parser.add_argument("--model", default=None, help="检测模型路径，默认使用后端的默认模型")
+    parser.add_argument("--max-side", type=int, default=1280, help="检测前把图像长边缩小到该尺寸")
+    runtime.add_arguments(parser)
+    args = parser.parse_args()
+
+    files = collect_files(args.inputs)
+    if not files:
+        sys.exit("没有找到图片")
+    if args.store and args.index == "ivf":
+        sys.exit("--index ivf 只支持从数据库加载人脸库")
+    quantization = args.index if args.index in ("int8", "float16") else None
+
+    gallery = None
+    if not args.store:
+        from database import FaceDatabase
+        # 量化后传给工作进程的只有量化矩阵
+        db = FaceDatabase(gallery_quantization=quantization)
+        if args.index == "ivf":
+            from ann import IVFGallery
+            gallery = IVFGallery(db, path=args.ivf_path, min_size=args.ivf_min_size).refresh()
+        else:
+            gallery = db.get_gallery()
+        db.close()
+
+    detector_kwargs = {"model_path": args.model, "backend": args.backend, "max_side": args.max_side}
+    out = sys.stdout if args.out == "-" else open(args.out, "w", encoding="utf-8", newline="")
+    try:
+        n_files, n_faces, seconds = recognize_files(files, out, fmt=args.format, workers=args.workers,
+                                                    detector_kwargs=detector_kwargs, threshold=args.threshold,
+                                                    gallery=gallery, store_path=args.store, quantization=quantization,
+                                                    runtime_config=runtime.from_args(
+                                                        args, default_threads=runtime.threads_per_worker(args.workers)))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    # 统计信息输出到标准错误，不混入结果
+    print(f"完成: {n_files} 张图片，{n_faces} 个人脸，耗时 {seconds:.1f} 秒"
+          f"（{n_files / max(seconds, 1e-9):.1f} 张/秒）", file=sys.stderr)
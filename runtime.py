@@ -0,0 +1,173 @@
+import os
+import sys
+
+# 图优化级别、执行模式的可选值
+GRAPH_OPTIMIZATION = ("disable", "basic", "extended", "all")
+EXECUTION_MODES = ("sequential", "parallel")
+
+
+class RuntimeConfig:
+    """
+    推理运行时配置，项目中创建的所有 onnxruntime 会话（识别模型、SCRFD、YOLOv8 ONNX）
+    以及 PyTorch（ultralytics YOLO）的线程数都从这里设置
+    多进程运行（批量注册/识别）时应按进程数分配线程，避免线程数超过 CPU 核数
+    """
+    def __init__(self, intra_op_threads=None, inter_op_threads=None, graph_optimization="all",
+                 execution_mode="sequential", enable_mem_arena=True, cpu_affinity=None, providers=None):
+        """
+        intra_op_threads: 单个算子内部的并行线程数，None 表示由 onnxruntime/torch 自行决定（通常为物理核数）
+        inter_op_threads: 算子之间的并行线程数（execution_mode='parallel' 时生效）
+        graph_optimization: 图优化级别 'disable' / 'basic' / 'extended' / 'all'
+        execution_mode: 'sequential' 或 'parallel'
+        enable_mem_arena: 是否启用 CPU 内存池（关闭可降低常驻内存，但分配更频繁）
+        cpu_affinity: 绑定到的 CPU 编号列表，如 [0, 1, 2, 3]（多路服务器上把进程固定在一个 CPU 插槽）
+        providers: onnxruntime 执行提供者，默认只用 CPU
+        """
+        if graph_optimization not in GRAPH_OPTIMIZATION:
+            raise ValueError(f"不支持的图优化级别: {graph_optimization}，可选: {', '.join(GRAPH_OPTIMIZATION)}")
+        if execution_mode not in EXECUTION_MODES:
+            raise ValueError(f"不支持的执行模式: {execution_mode}，可选: {', '.join(EXECUTION_MODES)}")
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.graph_optimization = graph_optimization
+        self.execution_mode = execution_mode
+        self.enable_mem_arena = enable_mem_arena
+        self.cpu_affinity = list(cpu_affinity) if cpu_affinity else None
+        self.providers = providers or ['CPUExecutionProvider']
+
+    def session_options(self):
+        """生成 onnxruntime.SessionOptions"""
+        import onnxruntime as ort
+        opts = ort.SessionOptions()
+        if self.intra_op_threads:
+            opts.intra_op_num_threads = self.intra_op_threads
+        if self.inter_op_threads:
+            opts.inter_op_num_threads = self.inter_op_threads
+        opts.graph_optimization_level = {
+            "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+            "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+            "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+            "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+        }[self.graph_optimization]
+        opts.execution_mode = (ort.ExecutionMode.ORT_PARALLEL if self.execution_mode == "parallel"
+                               else ort.ExecutionMode.ORT_SEQUENTIAL)
+        opts.enable_cpu_mem_arena = self.enable_mem_arena
+        return opts
+
+    def create_session(self, model_file):
+        """用本配置创建 onnxruntime.InferenceSession"""
+        import onnxruntime as ort
+        return ort.InferenceSession(model_file, sess_options=self.session_options(), providers=self.providers)
+
+    def apply_process_settings(self):
+        """设置进程级参数：CPU 绑定和 PyTorch 线程数"""
+        if self.cpu_affinity:
+            if hasattr(os, "sched_setaffinity"):
+                os.sched_setaffinity(0, self.cpu_affinity)
+            else:
+                print("当前系统不支持设置 CPU 绑定，已忽略 cpu_affinity", file=sys.stderr)
+        try:
+            import torch
+        except ImportError:
+            return
+        if self.intra_op_threads:
+            torch.set_num_threads(self.intra_op_threads)
+        if self.inter_op_threads:
+            try:
+                torch.set_num_interop_threads(self.inter_op_threads)
+            except RuntimeError:
+                # torch 已经开始并行计算后不能再修改
+                print("PyTorch 算子间线程数只能在推理开始前设置，已忽略 inter_op_threads", file=sys.stderr)
+
+    def to_dict(self):
+        return {
+            "intra_op_threads": self.intra_op_threads,
+            "inter_op_threads": self.inter_op_threads,
+            "graph_optimization": self.graph_optimization,
+            "execution_mode": self.execution_mode,
+            "enable_mem_arena": self.enable_mem_arena,
+            "cpu_affinity": self.cpu_affinity,
+            "providers": self.providers,
+        }
+
+    @classmethod
+    def from_env(cls, prefix="FACE_"):
+        """
+        从环境变量读取配置（界面程序使用）:
+        FACE_INTRA_OP_THREADS, FACE_INTER_OP_THREADS, FACE_GRAPH_OPTIMIZATION,
+        FACE_EXECUTION_MODE, FACE_MEM_ARENA=0/1, FACE_CPU_AFFINITY=0-3,8,9
+        """
+        env = os.environ
+        return cls(
+            intra_op_threads=int(env[prefix + "INTRA_OP_THREADS"]) if env.get(prefix + "INTRA_OP_THREADS") else None,
+            inter_op_threads=int(env[prefix + "INTER_OP_THREADS"]) if env.get(prefix + "INTER_OP_THREADS") else None,
+            graph_optimization=env.get(prefix + "GRAPH_OPTIMIZATION", "all"),
+            execution_mode=env.get(prefix + "EXECUTION_MODE", "sequential"),
+            enable_mem_arena=env.get(prefix + "MEM_ARENA", "1") != "0",
+            cpu_affinity=parse_cpu_list(env.get(prefix + "CPU_AFFINITY", "")),
+        )
+
+
+def parse_cpu_list(text):
+    """'0-3,8,9' → [0, 1, 2, 3, 8, 9]"""
+    cpus = []
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+_config = None
+
+
+def configure(config):
+    """设置全局推理配置并应用进程级参数；之后创建的模型默认使用该配置"""
+    global _config
+    _config = config
+    config.apply_process_settings()
+    return config
+
+
+def get_config():
+    """当前全局推理配置，未设置时为默认配置"""
+    global _config
+    if _config is None:
+        _config = RuntimeConfig()
+    return _config
+
+
+def add_arguments(parser):
+    """给命令行工具添加推理配置参数"""
+    group = parser.add_argument_group("推理运行时")
+    group.add_argument("--intra-op-threads", type=int, default=None, help="算子内部并行线程数")
+    group.add_argument("--inter-op-threads", type=int, default=None, help="算子之间并行线程数")
+    group.add_argument("--graph-optimization", choices=GRAPH_OPTIMIZATION, default="all", help="onnxruntime 图优化级别")
+    group.add_argument("--execution-mode", choices=EXECUTION_MODES, default="sequential", help="onnxruntime 执行模式")
+    group.add_argument("--no-mem-arena", action="store_true", help="关闭 onnxruntime CPU 内存池")
+    group.add_argument("--cpu-affinity", default="", help="绑定的 CPU 编号，如 0-7 或 0,2,4,6")
+
+
+def from_args(args, default_threads=None):
+    """
+    由 add_arguments 添加的命令行参数生成配置
+    default_threads: 未指定 --intra-op-threads 时使用的线程数（多进程时按进程数分配）
+    """
+    return RuntimeConfig(
+        intra_op_threads=args.intra_op_threads or default_threads,
+        inter_op_threads=args.inter_op_threads,
+        graph_optimization=args.graph_optimization,
+        execution_mode=args.execution_mode,
+        enable_mem_arena=not args.no_mem_arena,
+        cpu_affinity=parse_cpu_list(args.cpu_affinity),
+    )
+
+
+def threads_per_worker(workers):
+    """多进程时每个进程分到的线程数"""
+    return max(1, (os.cpu_count() or 1) // max(1, workers or os.cpu_count() or 1))
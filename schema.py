@@ -0,0 +1,127 @@
+"""
+数据库表结构初始化与迁移
+FaceDatabase 启动时调用一次 migrate()，之后各个方法不再执行任何 DDL
+每个迁移只执行一次，已执行到的版本号记录在 schema_version 表中；
+修改表结构时在 MIGRATIONS 末尾追加新版本，不要修改已发布的迁移
+迁移中的语句可以是 SQL 字符串，也可以是接收 cursor 的函数（需要先查询当前结构再决定执行什么时使用）；
+MySQL 的 DDL 不能回滚，迁移应当可以重复执行（中途中断后重跑、或表是按 README 手动创建的）
+"""
+import sys
+
+
+def _index_names(cursor, table):
+    cursor.execute("SELECT DISTINCT index_name FROM information_schema.statistics "
+                   "WHERE table_schema = DATABASE() AND table_name = %s", (table,))
+    return {row[0] for row in cursor.fetchall()}
+
+
+def _add_attendance_name_time_index(cursor):
+    """v2: 只执行还没完成的部分，已有 idx_name_time 或已删除 idx_name 时跳过对应子句"""
+    indexes = _index_names(cursor, "attendance_records")
+    clauses = []
+    if "idx_name_time" not in indexes:
+        clauses.append("ADD INDEX idx_name_time (name, attendance_time)")
+    if "idx_name" in indexes:
+        clauses.append("DROP INDEX idx_name")
+    if clauses:
+        cursor.execute("ALTER TABLE attendance_records " + ", ".join(clauses))
+
+
+MIGRATIONS = [
+    (1, "创建人脸特征表、人脸库版本表和考勤表", [
+        # 同一人可以登记多条特征（多模板），所以 name 上是普通索引而不是唯一键
+        """
+        CREATE TABLE IF NOT EXISTS face_features (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            feature BLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_name (name)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS face_features_version (
+            id TINYINT PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+        "INSERT IGNORE INTO face_features_version (id, version) VALUES (1, 0)",
+        """
+        CREATE TABLE IF NOT EXISTS attendance_records (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            attendance_time DATETIME NOT NULL,
+            date DATE NOT NULL,
+            time TIME NOT NULL,
+            INDEX idx_name (name),
+            INDEX idx_date (date),
+            INDEX idx_attendance_time (attendance_time)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+    ]),
+    (2, "考勤表增加 (name, attendance_time) 组合索引，用于按人查询最近考勤", [
+        # 组合索引的前缀已覆盖按姓名查询，单独的 idx_name 不再需要
+        _add_attendance_name_time_index,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# 多个进程同时启动时，只让一个进程执行迁移
+_LOCK_NAME = "face_recognition_schema_migration"
+
+
+def get_version(cursor):
+    """当前数据库的表结构版本号，未初始化时为 0"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INT PRIMARY KEY,
+        description VARCHAR(255) NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+    cursor.execute("SELECT MAX(version) FROM schema_version")
+    row = cursor.fetchone()
+    return row[0] or 0
+
+
+def migrate(pool, lock_timeout=30):
+    """
+    把数据库表结构升级到最新版本
+    pool: db_pool.ConnectionPool
+    返回: 本次执行的迁移版本号列表
+    """
+    applied = []
+    with pool.cursor() as cursor:
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (_LOCK_NAME, lock_timeout))
+        if not cursor.fetchone()[0]:
+            raise TimeoutError(f"等待其他进程完成数据库迁移超时（{lock_timeout} 秒）")
+        try:
+            current = get_version(cursor)
+            for version, description, statements in MIGRATIONS:
+                if version <= current:
+                    continue
+                # MySQL 的 DDL 会隐式提交，无法放在事务里回滚；每个迁移完成后立即记录版本号
+                for sql in statements:
+                    if callable(sql):
+                        sql(cursor)
+                    else:
+                        cursor.execute(sql)
+                cursor.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                               (version, description))
+                # 提示信息输出到标准错误，不混入命令行工具输出到标准输出的结果
+                print(f"数据库迁移完成: v{version} {description}", file=sys.stderr)
+                applied.append(version)
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (_LOCK_NAME,))
+    return applied
+
+
+if __name__ == '__main__':
+    from database import FaceDatabase
+
+    # FaceDatabase 初始化时会自动迁移
+    db = FaceDatabase()
+    with db.pool.cursor() as cursor:
+        print(f"当前表结构版本: v{get_version(cursor)}（最新 v{LATEST_VERSION}）")
+    db.close()
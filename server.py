@@ -0,0 +1,375 @@
+import json
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import cv2
+import numpy as np
+
+import metrics
+
+
+class MicroBatcher:
+    """
+    跨请求合并特征提取
+    各请求线程调用 extract_batch 后阻塞等待；后台线程收集最多 max_batch 张人脸后，
+    只调用一次 extractor.extract_batch，再把结果分发回各请求
+    等待窗口随负载调整：请求进入服务时用 expect() 登记，只要还有已登记、尚未提交人脸的请求
+    （通常正排队等待串行检测），就继续等待，最长 max_wait_ms 毫秒；没有时立即处理，单个请求不空等
+    接口与 FeatureExtractor 相同（extract / extract_batch），可直接传给 RecognitionPipeline
+    """
+    def __init__(self, extractor, max_batch=32, max_wait_ms=20, timeout=30):
+        """timeout: 请求线程等待提取结果的最长时间（秒）"""
+        self.extractor = extractor
+        self.feature_dim = extractor.feature_dim
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.timeout = timeout
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.faces = 0
+        self.expected = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    @contextmanager
+    def expect(self):
+        """登记一个即将提交人脸的请求，提取线程凑批时会等待它"""
+        with self._lock:
+            self.expected += 1
+        self._local.expected = True
+        try:
+            yield
+        finally:
+            # 没有检测到人脸等情况下不会提交，退出时注销
+            with self._lock:
+                self._unexpect()
+
+    def _unexpect(self):
+        if getattr(self._local, "expected", False):
+            self._local.expected = False
+            self.expected -= 1
+
+    def extract_batch(self, face_imgs, batch_size=None):
+        face_imgs = list(face_imgs)
+        if not face_imgs:
+            return np.zeros((0, self.feature_dim), dtype=np.float32)
+        future = Future()
+        with self._lock:
+            if not self.running:
+                raise RuntimeError("特征提取服务已停止")
+            self.requests.put((face_imgs, future))
+            self._unexpect()
+        return future.result(timeout=self.timeout)
+
+    def extract(self, face_img):
+        feature = self.extract_batch([face_img])[0]
+        return feature if feature.any() else None
+
+    def _run(self):
+        while self.running:
+            try:
+                first = self.requests.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if first is None:
+                break
+            items = [first]
+            count = len(first[0])
+            deadline = time.monotonic() + self.max_wait
+            while count < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.requests.get_nowait()
+                except queue.Empty:
+                    if self.expected <= 0:
+                        break
+                    # 还有请求在检测中，短暂等待后重新检查
+                    try:
+                        item = self.requests.get(timeout=min(remaining, 0.001))
+                    except queue.Empty:
+                        continue
+                if item is None:
+                    self.running = False
+                    break
+                items.append(item)
+                count += len(item[0])
+
+            faces = [face for face_imgs, _ in items for face in face_imgs]
+            try:
+                feats = self.extractor.extract_batch(faces)
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.faces += len(faces)
+            metrics.inc("extract_batches_total")
+            metrics.inc("extract_batch_faces_total", len(faces))
+            offset = 0
+            for face_imgs, future in items:
+                future.set_result(feats[offset:offset + len(face_imgs)])
+                offset += len(face_imgs)
+
+    def stop(self):
+        """停止提取线程；仍在排队的请求以异常结束，不会一直阻塞"""
+        with self._lock:
+            self.running = False
+            self.requests.put(None)
+        self.thread.join(timeout=5)
+        while True:
+            try:
+                item = self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[1].set_exception(RuntimeError("特征提取服务已停止"))
+
+
+class _LockedDetector:
+    """ultralytics 的 YOLO 模型不是线程安全的，多个请求线程串行调用检测"""
+    def __init__(self, detector):
+        self.detector = detector
+        self.lock = threading.Lock()
+
+    def detect(self, image):
+        with self.lock:
+            return self.detector.detect(image)
+
+
+class _RequestTooLarge(ValueError):
+    pass
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    POST /detect             请求体为图片文件内容，返回人脸框和关键点
+    POST /recognize          返回每个人脸的姓名和相似度；?attendance=1 时记录考勤
+    POST /enroll?name=姓名   注册请求体图片中的第一个人脸；&append=1 追加为该人的新模板
+    GET  /health             服务状态和批处理统计
+    GET  /metrics            Prometheus 文本格式的指标
+    """
+    protocol_version = "HTTP/1.1"
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_image(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        max_bytes = self.server.service.max_body_bytes
+        if length > max_bytes:
+            raise _RequestTooLarge(f"请求体过大（{length} 字节），最大 {max_bytes} 字节")
+        data = self.rfile.read(length) if length > 0 else b""
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR) if data else None
+        if img is None:
+            raise ValueError("请求体不是有效的图片")
+        return img
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/metrics":
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if urlparse(self.path).path != "/health":
+            self._send_json(404, {"error": "未知路径"})
+            return
+        service = self.server.service
+        batcher = service.batcher
+        self._send_json(200, {
+            "status": "ok",
+            "gallery": len(service.db.get_gallery()),
+            "batches": batcher.batches,
+            "avg_batch": round(batcher.faces / batcher.batches, 2) if batcher.batches else 0,
+            "pending_attendance": service.attendance_writer.pending(),
+        })
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        service = self.server.service
+        if url.path not in ("/detect", "/recognize", "/enroll"):
+            self._send_json(404, {"error": "未知路径"})
+            return
+        metrics.inc("http_requests_total", path=url.path)
+        try:
+            img = self._read_image()
+            if url.path == "/detect":
+                self._send_json(200, service.detect(img))
+            elif url.path == "/recognize":
+                self._send_json(200, service.recognize(img, record_attendance=params.get("attendance") == "1"))
+            elif url.path == "/enroll":
+                name = params.get("name", "").strip()
+                if not name:
+                    self._send_json(400, {"error": "缺少参数 name"})
+                    return
+                ok, message = service.enroll(img, name, append_template=params.get("append") == "1")
+                self._send_json(200 if ok else 409, {"ok": ok, "message": message})
+        except _RequestTooLarge as e:
+            # 请求体没有读取，连接不能复用
+            self.close_connection = True
+            self._send_json(413, {"error": str(e)})
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+        except TimeoutError:
+            self._send_json(503, {"error": "服务繁忙，特征提取超时"})
+        except Exception as e:
+            print(f"处理请求 {url.path} 失败: {e}", file=sys.stderr)
+            self._send_json(500, {"error": str(e)})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RecognitionService:
+    """
+    HTTP 识别服务：模型只加载一次，所有请求线程共享
+    检测串行执行，特征提取通过 MicroBatcher 跨请求合并
+    """
+    def __init__(self, detector, aligner, extractor, matcher, db, max_batch=32, max_wait_ms=20,
+                 gallery_source=None, timeout=30, max_body_mb=20):
+        """
+        gallery_source: 识别时使用的人脸库来源（如 ann.IVFGallery），默认为 db
+        timeout: 等待特征提取结果的最长时间（秒），超时返回 503
+        max_body_mb: 请求体（图片）的最大大小，超过返回 413
+        """
+        from attendance import AttendanceWriter
+        from pipeline import RecognitionPipeline
+
+        self.db = db
+        self.max_body_bytes = int(max_body_mb * 1024 * 1024)
+        self.detector = _LockedDetector(detector)
+        self.batcher = MicroBatcher(extractor, max_batch=max_batch, max_wait_ms=max_wait_ms, timeout=timeout)
+        self.attendance_writer = AttendanceWriter(db).start()
+        self.pipeline = RecognitionPipeline(self.detector, aligner, self.batcher, matcher, db,
+                                            gallery_source=gallery_source, attendance_sink=self.attendance_writer)
+        self._enroll_locks = {}
+        self._enroll_locks_guard = threading.Lock()
+        self.httpd = None
+
+    @contextmanager
+    def _enroll_lock(self, name):
+        """同名注册串行执行，避免并发请求都通过重名检查后各插入一条"""
+        with self._enroll_locks_guard:
+            lock, users = self._enroll_locks.get(name, (None, 0))
+            lock = lock or threading.Lock()
+            self._enroll_locks[name] = (lock, users + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._enroll_locks_guard:
+                lock, users = self._enroll_locks[name]
+                if users == 1:
+                    del self._enroll_locks[name]
+                else:
+                    self._enroll_locks[name] = (lock, users - 1)
+
+    def enroll(self, img, name, append_template=False):
+        with self._enroll_lock(name), self.batcher.expect():
+            return self.pipeline.register(img, name, append_template=append_template)
+
+    def detect(self, img):
+        boxes, kps = self.detector.detect(img)
+        faces = []
+        for i, box in enumerate(boxes):
+            face = {"box": [round(float(v), 1) for v in box]}
+            if kps is not None and i < len(kps):
+                face["keypoints"] = np.round(np.asarray(kps[i], dtype=np.float32), 1).tolist()
+            faces.append(face)
+        return {"faces": faces}
+
+    def recognize(self, img, record_attendance=False):
+        timings = {}
+        with self.batcher.expect():
+            results = self.pipeline.recognize(img, record_attendance=record_attendance, timings=timings)
+        return {
+            "faces": [{"box": [round(float(v), 1) for v in res['box']], "label": res['label'],
+                       "score": round(float(res['score']), 4)} for res in results],
+            "timings_ms": {k: round(v * 1000, 2) for k, v in timings.items()},
+        }
+
+    def serve_forever(self, host="0.0.0.0", port=8000):
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.service = self
+        print(f"识别服务已启动: http://{host}:{port}")
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.httpd.server_close()
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+        self.batcher.stop()
+        self.attendance_writer.stop()
+
+
+if __name__ == '__main__':
+    import argparse
+    import runtime
+    from aligner import FaceAligner
+    from database import FaceDatabase
+    from detector import FaceDetector
+    from extractor import FeatureExtractor
+    from matcher import FaceMatcher
+
+    parser = argparse.ArgumentParser(description="HTTP 人脸识别服务（多个终端共用一套模型）")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--backend", default="yolo", help="检测后端: yolo / onnx / scrfd")
+    parser.add_argument("--model", default=None, help="检测模型路径，默认使用后端的默认模型")
+    parser.add_argument("--max-side", type=int, default=1280, help="检测前把图像长边缩小到该尺寸")
+    parser.add_argument("--threshold", type=float, default=0.55, help="识别相似度阈值")
+    parser.add_argument("--max-batch", type=int, default=32, help="特征提取每批最多人脸数")
+    parser.add_argument("--max-wait-ms", type=float, default=20,
+                        help="凑批最长等待时间（毫秒），只在还有请求正在检测时等待")
+    parser.add_argument("--timeout", type=float, default=30, help="等待特征提取结果的最长时间（秒）")
+    parser.add_argument("--max-body-mb", type=float, default=20, help="上传图片的最大大小（MB）")
+    parser.add_argument("--index", choices=["exact", "ivf", "int8", "float16"], default="exact",
+                        help="识别使用的人脸库索引: exact 精确 / ivf 近似 / int8、float16 量化（内存更小）")
+    parser.add_argument("--ivf-path", default="gallery_ivf.npz", help="IVF 索引文件（--index ivf）")
+    parser.add_argument("--ivf-min-size", type=int, default=10000, help="人脸库少于该条数时仍用精确搜索")
+    runtime.add_arguments(parser)
+    args = parser.parse_args()
+
+    runtime.configure(runtime.from_args(args))
+
+    db = FaceDatabase(gallery_quantization=args.index if args.index in ("int8", "float16") else None)
+    gallery_source = None
+    if args.index == "ivf":
+        from ann import IVFGallery
+        gallery_source = IVFGallery(db, path=args.ivf_path, min_size=args.ivf_min_size)
+    service = RecognitionService(FaceDetector(model_path=args.model, backend=args.backend, max_side=args.max_side),
+                                 FaceAligner(), FeatureExtractor(), FaceMatcher(threshold=args.threshold),
+                                 db, max_batch=args.max_batch, max_wait_ms=args.max_wait_ms,
+                                 gallery_source=gallery_source, timeout=args.timeout,
+                                 max_body_mb=args.max_body_mb)
+    try:
+        service.serve_forever(args.host, args.port)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+        if gallery_source is not None:
+            gallery_source.close()
+        service.db.close()
@@ -0,0 +1,105 @@
+import threading
+import time
+import cv2
+
+import metrics
+
+
+def parse_source(source):
+    """
+    解析视频源
+    纯数字视为摄像头编号，其余视为视频文件路径或 RTSP/HTTP 地址
+    """
+    if isinstance(source, int):
+        return source
+    source = str(source).strip()
+    if source.isdigit():
+        return int(source)
+    return source
+
+
+class FrameGrabber:
+    """
+    后台线程持续读取视频帧，只保留最新的一帧
+    识别速度跟不上帧率时，旧帧直接丢弃而不是排队，保证显示延迟有上限
+    """
+    def __init__(self, source, realtime_file=True):
+        """
+        source: 摄像头编号、视频文件路径或 RTSP 地址
+        realtime_file: 视频文件是否按原始帧率读取（否则会尽可能快地读完）
+        """
+        self.source = parse_source(source)
+        self.cap = cv2.VideoCapture(self.source)
+        if not self.cap.isOpened():
+            raise ValueError(f"无法打开视频源: {source}")
+        # 尽量减小摄像头/网络流内部缓冲，避免读到积压的旧帧
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+        self.is_file = isinstance(self.source, str) and "://" not in self.source
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.frame_interval = 1.0 / fps if (realtime_file and self.is_file and fps > 0) else 0.0
+
+        self.lock = threading.Lock()
+        self.frame = None
+        self.frame_id = 0
+        self.consumed_id = 0
+        self.dropped = 0
+        self.finished = False
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        try:
+            while self.running:
+                t0 = time.monotonic()
+                ok, frame = self.cap.read()
+                if not ok:
+                    self.finished = True
+                    break
+                with self.lock:
+                    # 上一帧还没被取走就被覆盖，计为丢帧
+                    if self.frame_id > self.consumed_id:
+                        self.dropped += 1
+                        metrics.inc("stream_frames_dropped_total")
+                    self.frame = frame
+                    self.frame_id += 1
+                metrics.inc("stream_frames_total")
+                if self.frame_interval:
+                    delay = self.frame_interval - (time.monotonic() - t0)
+                    if delay > 0:
+                        time.sleep(delay)
+        finally:
+            self.running = False
+            # VideoCapture 只在读取线程中释放，避免与阻塞中的 cap.read() 并发
+            self.cap.release()
+
+    def read(self):
+        """
+        取最新的一帧
+        返回: 新帧；如果自上次读取后没有新帧，返回 None
+        """
+        with self.lock:
+            if self.frame is None or self.frame_id == self.consumed_id:
+                return None
+            self.consumed_id = self.frame_id
+            return self.frame
+
+    def stop(self, timeout=1.0):
+        """
+        停止读取；VideoCapture 由读取线程退出时释放
+        RTSP 等网络流的 cap.read() 可能阻塞很久，超时后不等待，读取线程返回后自行退出并释放
+        """
+        self.running = False
+        if self.thread is None:
+            # 读取线程没有启动过，直接释放
+            self.cap.release()
+            return
+        self.thread.join(timeout=timeout)
+        if self.thread.is_alive():
+            print("视频源读取仍在阻塞，读取线程返回后会自行释放视频源")
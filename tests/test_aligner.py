@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+face_align = pytest.importorskip("insightface.utils.face_align")
+
+from aligner import FaceAligner, estimate_transforms  # noqa: E402
+
+
+def _keypoints(n, seed=0):
+    """在标准关键点上做随机旋转、缩放和平移"""
+    rng = np.random.default_rng(seed)
+    kps = []
+    for _ in range(n):
+        angle, scale = rng.uniform(-0.5, 0.5), rng.uniform(0.5, 3.0)
+        rot = scale * np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+        kps.append(face_align.arcface_dst @ rot.T + rng.uniform(0, 300, 2))
+    return np.array(kps, dtype=np.float32)
+
+
+def test_transforms_match_insightface():
+    kps = _keypoints(8)
+    for size in (112, 128):
+        M = estimate_transforms(kps, size)
+        for i, kp in enumerate(kps):
+            np.testing.assert_allclose(M[i], face_align.estimate_norm(kp, size), atol=1e-6)
+
+
+def test_align_batch_matches_align_and_reuses_buffer():
+    rng = np.random.default_rng(1)
+    image = rng.integers(0, 256, size=(480, 640, 3), dtype=np.uint8)
+    kps = _keypoints(4)
+    aligner = FaceAligner()
+    buffer = np.empty((8, 112, 112, 3), dtype=np.uint8)
+    batch = aligner.align_batch(image, kps, out=buffer)
+    assert batch.shape == (4, 112, 112, 3)
+    assert np.shares_memory(batch, buffer)
+    for face, kp in zip(batch, kps):
+        np.testing.assert_array_equal(face, aligner.align(image, keypoints=kp))
@@ -0,0 +1,108 @@
+import numpy as np
+
+from ann import IVFGallery, IVFIndex
+from matcher import GalleryIndex
+
+
+def _features(n, dim=32, seed=0):
+    rng = np.random.default_rng(seed)
+    f = rng.standard_normal((n, dim)).astype(np.float32)
+    return f / np.linalg.norm(f, axis=1, keepdims=True)
+
+
+class _FakeDatabase:
+    """只提供 IVFGallery 需要的 get_gallery_snapshot"""
+    def __init__(self, labels, features):
+        self.gallery = GalleryIndex(labels, features, dim=features.shape[1])
+        self.version = 1
+
+    def get_gallery_snapshot(self):
+        return self.gallery, self.version
+
+
+class _ListeningDatabase(_FakeDatabase):
+    """模拟 FaceDatabase 本地增删：版本号加一，并通知订阅者"""
+    def __init__(self, labels, features):
+        super().__init__(labels, features)
+        self.listeners = []
+
+    def add_gallery_listener(self, callback):
+        self.listeners.append(callback)
+
+    def _change(self, update):
+        self.version += 1
+        update(self.gallery)
+        for callback in self.listeners:
+            callback(self.version, update)
+
+    def add(self, name, feature):
+        self._change(lambda g: g.add(name, feature))
+
+    def delete(self, name):
+        self._change(lambda g: g.remove(name))
+
+
+def test_full_probe_equals_exact_search():
+    features = _features(400)
+    labels = [f"p{i}" for i in range(400)]
+    index = IVFIndex(dim=32, nlist=10, nprobe=10).build(labels, features)
+    exact = GalleryIndex(labels, features, dim=32)
+    labels_a, scores_a = index.search_batch(features[:20], top_k=3)
+    labels_b, scores_b = exact.search_batch(features[:20], top_k=3)
+    assert labels_a == labels_b
+    np.testing.assert_allclose(scores_a, scores_b, atol=1e-5)
+
+
+def test_save_and_load_keep_version(tmp_path):
+    features = _features(100)
+    index = IVFIndex(dim=32, nlist=5).build([f"p{i}" for i in range(100)], features)
+    index.version = 7
+    path = str(tmp_path / "index.npz")
+    index.save(path)
+    loaded = IVFIndex.load(path)
+    assert loaded.version == 7
+    assert loaded.trained_size == 100
+    assert len(loaded) == 100
+
+
+def test_gallery_falls_back_to_exact_until_rebuilt(tmp_path):
+    features = _features(200)
+    db = _FakeDatabase([f"p{i}" for i in range(200)], features)
+    path = str(tmp_path / "index.npz")
+
+    # 小于 min_size 时总是精确搜索
+    assert isinstance(IVFGallery(db, path=path, min_size=1000).get_gallery(), GalleryIndex)
+
+    source = IVFGallery(db, path=path, min_size=10)
+    assert isinstance(source.refresh(), IVFIndex)
+
+    # 数据库版本变化后索引过期，先返回精确索引；同步重建后切换回 IVF，并保存到文件
+    db.version = 2
+    source._building = True          # 阻止后台重建，检查过期时的返回值
+    assert isinstance(source.get_gallery(), GalleryIndex)
+    source._building = False
+    assert isinstance(source.refresh(), IVFIndex)
+    assert IVFIndex.load(path).version == 2
+
+
+def test_local_changes_update_index_incrementally(tmp_path):
+    features = _features(201)
+    db = _ListeningDatabase([f"p{i}" for i in range(200)], features[:200])
+    path = str(tmp_path / "index.npz")
+    source = IVFGallery(db, path=path, nprobe=100, min_size=10, save_interval=60)
+    before = source.refresh()
+
+    db.add("new", features[200])
+    db.delete("p0")
+    index = source.get_gallery()
+    # 没有重建：沿用同一组聚类中心，旧索引对象不受影响
+    assert isinstance(index, IVFIndex) and index is not before
+    assert index.centroids is before.centroids
+    assert index.version == 3 and len(index) == 200 and len(before) == 200
+    assert index.search(features[200])[0] == ["new"]
+    assert "p0" not in index.search(features[0], top_k=5)[0]
+
+    # 文件延迟合并保存，close 时写入
+    assert IVFIndex.load(path).version == 1
+    source.close()
+    assert IVFIndex.load(path).version == 3
@@ -0,0 +1,58 @@
+import threading
+import time
+from datetime import datetime
+
+from attendance import AttendanceWriter
+
+
+class _FakeDB:
+    """name 在 bad 中的记录总是写入失败；down 时所有写入都失败"""
+    def __init__(self, bad=()):
+        self.bad = set(bad)
+        self.down = False
+        self.rows = []
+        self.lock = threading.Lock()
+
+    def get_last_attendance_times(self):
+        return {}
+
+    def add_attendance_batch(self, records):
+        with self.lock:
+            if self.down or any(name in self.bad for name, _ in records):
+                return False, "写入失败"
+            self.rows.extend(name for name, _ in records)
+            return True, "ok"
+
+
+def test_permanently_failing_record_does_not_block_others():
+    db = _FakeDB(bad={"坏记录"})
+    writer = AttendanceWriter(db, flush_interval=0.01, batch_size=4, max_retries=3).start()
+    for i, name in enumerate(["a", "坏记录", "b", "c", "d"]):
+        writer.record(name, datetime(2026, 1, 1, 9, 0, i))
+    writer.stop()
+    assert sorted(db.rows) == ["a", "b", "c", "d"]
+    assert writer.dropped == 1
+
+
+def test_transient_failure_is_retried():
+    db = _FakeDB()
+    db.down = True
+    writer = AttendanceWriter(db, flush_interval=0.05, max_retries=100).start()
+    writer.record("a", datetime(2026, 1, 1, 9, 0, 0))
+    threading.Timer(0.2, lambda: setattr(db, "down", False)).start()
+    deadline = time.monotonic() + 5
+    while not db.rows and time.monotonic() < deadline:
+        time.sleep(0.01)
+    writer.stop()
+    assert db.rows == ["a"]
+    assert writer.dropped == 0
+
+
+def test_stop_does_not_retry_forever():
+    db = _FakeDB()
+    db.down = True
+    writer = AttendanceWriter(db, flush_interval=0.01, max_retries=1000).start()
+    writer.record("a", datetime(2026, 1, 1, 9, 0, 0))
+    writer.stop()
+    assert writer.thread is None
+    assert writer.dropped == 1
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from feature_store import MmapFeatureStore
+from matcher import FaceMatcher
+
+
+def _features(n, dim=8, seed=0):
+    rng = np.random.default_rng(seed)
+    f = rng.standard_normal((n, dim)).astype(np.float32)
+    return f / np.linalg.norm(f, axis=1, keepdims=True)
+
+
+def test_reader_sees_writes_made_before_first_get_gallery(tmp_path):
+    f = _features(2)
+    writer = MmapFeatureStore(str(tmp_path), dim=8)
+    writer.append("a", f[0])
+    reader = MmapFeatureStore(str(tmp_path), dim=8)
+    writer.append("b", f[1])
+
+    matcher = FaceMatcher(threshold=0.5)
+    assert matcher.match(f[1], reader.get_gallery())[0] == "b"
+    assert matcher.match(f[1], reader.get_gallery())[0] == "b"
+
+
+def test_reader_sees_delete_and_compact(tmp_path):
+    f = _features(3)
+    writer = MmapFeatureStore(str(tmp_path), dim=8)
+    writer.append_batch(["a", "b", "c"], f)
+    reader = MmapFeatureStore(str(tmp_path), dim=8)
+    assert len(reader.get_gallery()) == 3
+
+    writer.delete("a")
+    assert len(reader.get_gallery()) == 2
+    writer.compact()
+    gallery = reader.get_gallery()
+    assert list(gallery.labels) == ["b", "c"]
+    np.testing.assert_allclose(gallery.matrix, f[1:])
+
+
+def test_compact_crash_before_switch_keeps_old_generation(tmp_path, monkeypatch):
+    f = _features(3)
+    store = MmapFeatureStore(str(tmp_path), dim=8)
+    store.append_batch(["a", "b", "c"], f)
+    store.delete("a")
+
+    def crash(self, dim, generation):
+        raise RuntimeError("进程中断")
+    monkeypatch.setattr(MmapFeatureStore, "_write_meta", crash)
+    with pytest.raises(RuntimeError):
+        store.compact()
+    monkeypatch.undo()
+
+    # 新一代文件已经写出，但 meta.json 仍指向旧一代：姓名、特征和墓碑保持一致
+    reopened = MmapFeatureStore(str(tmp_path), dim=8)
+    gallery = reopened.get_gallery()
+    assert len(gallery) == 2
+    matcher = FaceMatcher(threshold=0.5)
+    assert matcher.match(f[1], gallery)[0] == "b"
+    assert matcher.match(f[2], gallery)[0] == "c"
+
+    reopened.compact()
+    assert reopened.generation == 1
+    assert list(reopened.get_gallery().labels) == ["b", "c"]
+    assert matcher.match(f[2], reopened.get_gallery())[0] == "c"
+
+
+def test_unterminated_last_label_is_ignored(tmp_path):
+    f = _features(2)
+    store = MmapFeatureStore(str(tmp_path), dim=8)
+    store.append("a", f[0])
+    with open(store.labels_file, "a", encoding="utf-8") as fh:
+        fh.write("写了一半")
+    reopened = MmapFeatureStore(str(tmp_path), dim=8)
+    assert reopened.labels == ["a"]
+
+    # 写入进程重启后继续追加：半行被截掉，不会拼进新记录
+    reopened.append("b", f[1])
+    again = MmapFeatureStore(str(tmp_path), dim=8)
+    assert again.labels == ["a", "b"]
+    matcher = FaceMatcher(threshold=0.5)
+    assert matcher.match(f[1], again.get_gallery())[0] == "b"
+
+
+def test_unterminated_tombstone_is_not_merged_into_next_delete(tmp_path):
+    labels = [f"p{i}" for i in range(16)]
+    store = MmapFeatureStore(str(tmp_path), dim=8)
+    store.append_batch(labels, _features(16))
+    with open(store.deleted_file, "a", encoding="utf-8") as fh:
+        fh.write("1")
+    store.delete("p5")
+    reopened = MmapFeatureStore(str(tmp_path), dim=8)
+    assert np.flatnonzero(reopened.deleted).tolist() == [5]
@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+
+from matcher import FaceMatcher, GalleryIndex, QuantizedGalleryIndex
+
+
+def _features(n, dim=32, seed=0):
+    rng = np.random.default_rng(seed)
+    f = rng.standard_normal((n, dim)).astype(np.float32)
+    return f / np.linalg.norm(f, axis=1, keepdims=True)
+
+
+def _brute_force(labels, features, probe, aggregate, top_templates, valid=None):
+    """逐人计算聚合相似度，作为参考结果"""
+    sims = features @ probe
+    person = {}
+    for i, label in enumerate(labels):
+        if valid is None or valid[i]:
+            person.setdefault(label, []).append(sims[i])
+    result = {}
+    for label, values in person.items():
+        values = sorted(values, reverse=True)
+        result[label] = values[0] if aggregate == "max" else np.mean(values[:top_templates])
+    return sorted(result.items(), key=lambda kv: -kv[1])
+
+
+@pytest.mark.parametrize("aggregate", ["max", "mean_topk"])
+@pytest.mark.parametrize("with_valid", [False, True])
+def test_search_matches_brute_force(aggregate, with_valid):
+    rng = np.random.default_rng(1)
+    # 大多数人 1 个模板，一个人 50 个模板，标签打乱顺序
+    labels = [f"p{i}" for i in range(40)] + ["heavy"] * 50 + ["two"] * 2
+    labels = [labels[i] for i in rng.permutation(len(labels))]
+    features = _features(len(labels))
+    valid = rng.random(len(labels)) > 0.2 if with_valid else None
+    gallery = GalleryIndex(labels, features, dim=32, valid=valid, aggregate=aggregate, top_templates=3)
+    probes = features[:5] + 0.1 * rng.standard_normal((5, 32)).astype(np.float32)
+
+    found, scores = gallery.search_batch(probes, top_k=4)
+    for probe, row_labels, row_scores in zip(probes, found, scores):
+        expected = _brute_force(labels, features, probe, aggregate, 3, valid)[:4]
+        np.testing.assert_allclose(row_scores, [s for _, s in expected], atol=1e-5)
+        assert row_labels == [label for label, _ in expected]
+
+
+def test_centroid_candidates_finds_same_best_match():
+    # 每人 3 个模板围绕同一个中心
+    rng = np.random.default_rng(2)
+    features = np.repeat(_features(100), 3, axis=0) + 0.1 * rng.standard_normal((300, 32)).astype(np.float32)
+    features /= np.linalg.norm(features, axis=1, keepdims=True)
+    labels = [f"p{i // 3}" for i in range(300)]
+    exact = GalleryIndex(labels, features, dim=32)
+    coarse = GalleryIndex(labels, features, dim=32, centroid_candidates=10)
+    labels_a, scores_a = exact.search_batch(features[::7], top_k=1)
+    labels_b, scores_b = coarse.search_batch(features[::7], top_k=1)
+    assert labels_a == labels_b
+    np.testing.assert_allclose(scores_a, scores_b, atol=1e-5)
+
+
+def test_add_and_remove():
+    features = _features(3)
+    gallery = GalleryIndex(["a", "b"], features[:2], dim=32)
+    gallery.add("c", features[2])
+    assert gallery.search(features[2])[0] == ["c"]
+    assert gallery.remove("c") == 1
+    assert gallery.search(features[2])[0] != ["c"]
+    assert gallery.num_identities == 2
+
+
+def test_add_batch_matches_sequential_add():
+    features = _features(6)
+    one_by_one = GalleryIndex(["a"], features[:1], dim=32, valid=[True])
+    batched = GalleryIndex(["a"], features[:1], dim=32, valid=[True])
+    labels = ["b", "c", "b", "d", "e"]
+    for label, feature in zip(labels, features[1:]):
+        one_by_one.add(label, feature)
+    batched.add_batch(labels, features[1:])
+    np.testing.assert_array_equal(batched.matrix, one_by_one.matrix)
+    assert list(batched.labels) == list(one_by_one.labels)
+    assert batched.valid.tolist() == [True] * 6
+    labels_a, scores_a = batched.search_batch(features, top_k=1)
+    labels_b, scores_b = one_by_one.search_batch(features, top_k=1)
+    assert labels_a == labels_b
+    np.testing.assert_allclose(scores_a, scores_b)
+
+    quantized = QuantizedGalleryIndex(GalleryIndex(["a"], features[:1], dim=32))
+    quantized.add_batch(labels, features[1:])
+    assert len(quantized) == 6
+    assert quantized.search(features[4])[0] == ["d"]
+
+
+@pytest.mark.parametrize("mode", ["int8", "float16"])
+def test_quantized_index_agrees_with_exact(mode):
+    features = _features(500, dim=128)
+    labels = [f"p{i}" for i in range(500)]
+    exact = GalleryIndex(labels, features, dim=128)
+    quantized = QuantizedGalleryIndex(exact, mode=mode)
+    assert quantized.matrix is None
+    assert quantized.nbytes < exact.matrix.nbytes
+
+    matcher = FaceMatcher(threshold=0.5)
+    for (label_q, score_q), (label_e, score_e) in zip(matcher.match_batch(features[:20], quantized),
+                                                      matcher.match_batch(features[:20], exact)):
+        assert label_q == label_e
+        assert score_q == pytest.approx(score_e, abs=1e-2)
+    quantized.add("new", -features[0])
+    assert quantized.search(-features[0])[0] == ["new"]
@@ -0,0 +1,91 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from server import MicroBatcher
+
+
+class _FakeExtractor:
+    feature_dim = 4
+
+    def __init__(self, delay=0.0, block=None):
+        self.delay = delay
+        self.block = block
+        self.calls = []
+
+    def extract_batch(self, faces):
+        if self.block is not None:
+            self.block.wait()
+        time.sleep(self.delay)
+        self.calls.append(len(faces))
+        return np.full((len(faces), self.feature_dim), 1.0, dtype=np.float32)
+
+
+def test_single_request_does_not_wait_for_window():
+    batcher = MicroBatcher(_FakeExtractor(), max_wait_ms=500)
+    try:
+        start = time.monotonic()
+        with batcher.expect():
+            feats = batcher.extract_batch([np.zeros((112, 112, 3), np.uint8)] * 2)
+        assert feats.shape == (2, 4)
+        assert time.monotonic() - start < 0.25
+    finally:
+        batcher.stop()
+
+
+def test_batches_form_behind_serialized_detection():
+    # 模拟 HTTP 服务：检测串行（每张 10ms），提取线程在还有请求检测中时继续凑批
+    batcher = MicroBatcher(_FakeExtractor(delay=0.03), max_wait_ms=50)
+    detect_lock = threading.Lock()
+
+    def request():
+        with batcher.expect():
+            with detect_lock:
+                time.sleep(0.01)
+            batcher.extract_batch([np.zeros((112, 112, 3), np.uint8)])
+
+    try:
+        threads = [threading.Thread(target=request) for _ in range(16)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert batcher.faces == 16
+        assert batcher.faces / batcher.batches > 2
+        assert batcher.expected == 0
+    finally:
+        batcher.stop()
+
+
+def test_stop_fails_pending_requests_and_timeout():
+    block = threading.Event()
+    batcher = MicroBatcher(_FakeExtractor(block=block), max_wait_ms=0, timeout=0.2)
+    face = np.zeros((112, 112, 3), np.uint8)
+    with pytest.raises(TimeoutError):
+        batcher.extract_batch([face])
+
+    errors = []
+
+    def request():
+        try:
+            batcher.extract_batch([face])
+        except Exception as e:
+            errors.append(e)
+
+    batcher.timeout = 10
+    waiter = threading.Thread(target=request)
+    waiter.start()
+    time.sleep(0.05)
+    # 提取线程卡在第一批上，排队中的请求在 stop 时以异常结束
+    stopper = threading.Thread(target=batcher.stop)
+    stopper.start()
+    time.sleep(0.05)
+    block.set()
+    stopper.join()
+    waiter.join(timeout=5)
+    assert not waiter.is_alive()
+    assert len(errors) == 1 and isinstance(errors[0], RuntimeError)
+    with pytest.raises(RuntimeError):
+        batcher.extract_batch([face])
@@ -0,0 +1,40 @@
+import numpy as np
+
+from tracker import FaceTracker, iou_matrix
+
+
+def test_iou_matrix():
+    ious = iou_matrix([[0, 0, 10, 10]], [[0, 0, 10, 10], [5, 0, 15, 10], [20, 20, 30, 30]])
+    np.testing.assert_allclose(ious, [[1.0, 1 / 3, 0.0]], atol=1e-6)
+
+
+def test_moving_face_keeps_track_and_identity():
+    tracker = FaceTracker(reembed_interval=30)
+    first = tracker.update([[0, 0, 50, 50]])[0]
+    assert tracker.needs_embedding(first)
+    tracker.set_identity(first, "张三", 0.9)
+
+    for step in range(1, 10):
+        track = tracker.update([[step * 2, 0, 50 + step * 2, 50]])[0]
+        assert track.track_id == first.track_id
+        assert not tracker.needs_embedding(track)
+    assert track.label == "张三"
+
+    # 另一处出现的人脸是新轨迹
+    tracks = tracker.update([[18, 0, 68, 50], [200, 200, 250, 250]])
+    assert tracks[0].track_id == first.track_id
+    assert tracks[1].track_id != first.track_id
+    assert tracker.needs_embedding(tracks[1])
+
+
+def test_lost_track_is_removed_and_low_score_is_retried():
+    tracker = FaceTracker(max_misses=2, min_score=0.6, retry_interval=3)
+    track = tracker.update([[0, 0, 50, 50]])[0]
+    tracker.set_identity(track, "Unknown", 0.0)
+    for _ in range(3):
+        tracker.update([[0, 0, 50, 50]])
+    assert tracker.needs_embedding(track)
+
+    for _ in range(3):
+        tracker.update([])
+    assert tracker.tracks == []
@@ -0,0 +1,136 @@
+import itertools
+import numpy as np
+
+
+def iou_matrix(a, b):
+    """计算两组框 [N,4] 与 [M,4]（x1,y1,x2,y2）的 IoU 矩阵 [N,M]"""
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-6), 0.0)
+
+
+def _box_area(box):
+    return max(0.0, float(box[2] - box[0])) * max(0.0, float(box[3] - box[1]))
+
+
+class Track:
+    """一条人脸轨迹，缓存该轨迹已识别出的身份"""
+    def __init__(self, track_id, box):
+        self.track_id = track_id
+        self.box = np.asarray(box, dtype=np.float32)
+        self.velocity = np.zeros(4, dtype=np.float32)
+        self.hits = 1
+        self.misses = 0
+        # 身份缓存
+        self.label = None
+        self.score = 0.0
+        self.frames_since_embed = 0
+        self.embed_area = 0.0
+        self.attended_label = None
+
+    def predict(self):
+        """匀速模型预测下一帧位置"""
+        return self.box + self.velocity
+
+    def update(self, box, smoothing=0.5):
+        box = np.asarray(box, dtype=np.float32)
+        self.velocity = smoothing * (box - self.box) + (1 - smoothing) * self.velocity
+        self.box = box
+        self.hits += 1
+        self.misses = 0
+
+
+class FaceTracker:
+    """
+    基于 IoU 的多目标人脸跟踪（纯 CPU）
+    为每个检测框分配轨迹ID并缓存身份，只在需要时重新提取特征：
+    新轨迹、距上次识别超过 reembed_interval 帧、上次相似度低于 min_score、
+    或人脸面积明显变大（更清晰）时
+    """
+    def __init__(self, iou_thresh=0.3, max_misses=10, reembed_interval=30,
+                 min_score=0.6, retry_interval=5, area_growth=1.5):
+        """
+        iou_thresh: 检测框与轨迹匹配的最小 IoU
+        max_misses: 轨迹连续丢失多少帧后删除
+        reembed_interval: 已识别轨迹重新提取特征的间隔帧数
+        min_score: 相似度低于该值（含 Unknown）视为低置信度
+        retry_interval: 低置信度轨迹重新提取特征的间隔帧数
+        area_growth: 人脸面积超过上次识别时的倍数后重新提取特征
+        """
+        self.iou_thresh = iou_thresh
+        self.max_misses = max_misses
+        self.reembed_interval = reembed_interval
+        self.min_score = min_score
+        self.retry_interval = retry_interval
+        self.area_growth = area_growth
+        self.tracks = []
+        self._ids = itertools.count(1)
+
+    def update(self, boxes):
+        """
+        用当前帧的检测结果更新轨迹
+        返回: 与 boxes 一一对应的 Track 列表
+        """
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        assigned = [None] * len(boxes)
+
+        if self.tracks and len(boxes):
+            predicted = np.stack([t.predict() for t in self.tracks])
+            ious = iou_matrix(predicted, boxes)
+            # 贪心匹配：按 IoU 从大到小依次分配
+            for flat in np.argsort(-ious, axis=None):
+                ti, di = np.unravel_index(flat, ious.shape)
+                if ious[ti, di] < self.iou_thresh:
+                    break
+                track = self.tracks[ti]
+                if assigned[di] is not None or track.misses < 0:
+                    continue
+                track.update(boxes[di])
+                track.misses = -1  # 本帧已匹配标记
+                assigned[di] = track
+
+        for track in self.tracks:
+            if track.misses < 0:
+                track.misses = 0
+            else:
+                track.misses += 1
+                track.box = track.predict()
+            track.frames_since_embed += 1
+        self.tracks = [t for t in self.tracks if t.misses <= self.max_misses]
+
+        for di, track in enumerate(assigned):
+            if track is None:
+                track = Track(next(self._ids), boxes[di])
+                self.tracks.append(track)
+                assigned[di] = track
+        return assigned
+
+    def needs_embedding(self, track):
+        """判断该轨迹本帧是否需要重新提取特征"""
+        if track.label is None:
+            return True
+        if track.frames_since_embed >= self.reembed_interval:
+            return True
+        if track.score < self.min_score and track.frames_since_embed >= self.retry_interval:
+            return True
+        if track.embed_area > 0 and _box_area(track.box) > track.embed_area * self.area_growth:
+            return True
+        return False
+
+    def set_identity(self, track, label, score):
+        """记录本帧识别结果"""
+        track.label = label
+        track.score = score
+        track.frames_since_embed = 0
+        track.embed_area = _box_area(track.box)
+
+    def reset(self):
+        self.tracks = []
@@ -0,0 +1,165 @@
+import itertools
+import queue
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt6.QtCore import QObject, QThread, pyqtSignal
+
+import metrics
+
+
+class _Task:
+    def __init__(self, task_id, fn, args, kwargs):
+        self.task_id = task_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+
+class _WorkerThread(QThread):
+    """从任务队列中取任务执行，结果通过 engine 的信号发回界面线程"""
+    def __init__(self, engine):
+        super().__init__()
+        self.engine = engine
+
+    def run(self):
+        engine = self.engine
+        while engine.running:
+            try:
+                task = engine.tasks.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if task is None:
+                break
+            if engine._take_cancelled(task.task_id):
+                continue
+            try:
+                with metrics.span("inference_task_seconds"):
+                    result = task.fn(*task.args, **task.kwargs)
+            except Exception as e:
+                traceback.print_exc()
+                if not engine._take_cancelled(task.task_id):
+                    engine.task_failed.emit(task.task_id, str(e))
+                continue
+            # 执行期间被取消的任务不再回传结果
+            if not engine._take_cancelled(task.task_id):
+                engine.task_finished.emit(task.task_id, result)
+
+
+class InferenceEngine(QObject):
+    """
+    后台推理引擎
+    检测/识别/数据库等耗时操作提交到有界队列，由 QThread 工作线程执行，
+    完成后通过 task_finished / task_failed 信号通知界面，不阻塞 Qt 事件循环
+    排队中被丢弃（drop_oldest / cancel_all）的任务发出 task_dropped，提交方据此清理等待状态
+    """
+    task_finished = pyqtSignal(int, object)
+    task_failed = pyqtSignal(int, str)
+    task_dropped = pyqtSignal(int)
+
+    def __init__(self, max_queue=4, num_workers=1, parent=None):
+        """
+        max_queue: 等待队列的最大长度
+        num_workers: 工作线程数；YOLO 模型本身不是线程安全的，默认只用 1 个
+        """
+        super().__init__(parent)
+        self.tasks = queue.Queue(maxsize=max_queue)
+        self.running = True
+        self._ids = itertools.count(1)
+        self._cancelled = set()
+        self._lock = threading.Lock()
+        metrics.set_gauge("inference_queue_depth", self.queue_depth)
+        self.workers = [_WorkerThread(self) for _ in range(num_workers)]
+        for w in self.workers:
+            w.start()
+
+    def submit(self, fn, *args, drop_oldest=False, **kwargs):
+        """
+        提交任务
+        drop_oldest: 队列已满时丢弃最早的等待任务（实时视频用），否则拒绝新任务；
+                     被丢弃的任务可能来自其他页面，通过 task_dropped 信号通知
+        返回: 任务ID；队列已满且未丢弃时返回 None
+        """
+        task = _Task(next(self._ids), fn, args, kwargs)
+        while True:
+            try:
+                self.tasks.put_nowait(task)
+                return task.task_id
+            except queue.Full:
+                if not drop_oldest:
+                    metrics.inc("inference_tasks_rejected_total")
+                    return None
+                try:
+                    dropped = self.tasks.get_nowait()
+                except queue.Empty:
+                    continue
+                if dropped is not None:
+                    self._take_cancelled(dropped.task_id)
+                    metrics.inc("inference_tasks_dropped_total")
+                    self.task_dropped.emit(dropped.task_id)
+
+    def cancel(self, task_id):
+        """取消任务：未开始的不再执行，执行中的不再回传结果"""
+        if task_id is None:
+            return
+        with self._lock:
+            self._cancelled.add(task_id)
+
+    def cancel_all(self):
+        """清空等待队列，每个被丢弃的任务发出 task_dropped"""
+        while True:
+            try:
+                task = self.tasks.get_nowait()
+            except queue.Empty:
+                break
+            if task is not None:
+                self._take_cancelled(task.task_id)
+                self.task_dropped.emit(task.task_id)
+
+    def queue_depth(self):
+        return self.tasks.qsize()
+
+    def _take_cancelled(self, task_id):
+        with self._lock:
+            if task_id in self._cancelled:
+                self._cancelled.discard(task_id)
+                return True
+            return False
+
+    def stop(self):
+        self.running = False
+        self.cancel_all()
+        for w in self.workers:
+            w.wait(2000)
+
+
+class ModelLoader(QObject):
+    """
+    在后台线程池中并行加载模型，界面不必等待
+    每个模型加载完成后通过 loaded / failed 信号在界面线程中通知
+    """
+    loaded = pyqtSignal(str, object)
+    failed = pyqtSignal(str, str)
+
+    def __init__(self, max_workers=2, parent=None):
+        super().__init__(parent)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-loader")
+
+    def load(self, name, factory):
+        """在后台调用 factory() 创建模型，完成后发出 loaded(name, model)"""
+        future = self.executor.submit(factory)
+        future.add_done_callback(lambda f: self._done(name, f))
+
+    def _done(self, name, future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            traceback.print_exception(error)
+            self.failed.emit(name, str(error))
+        else:
+            self.loaded.emit(name, future.result())
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)